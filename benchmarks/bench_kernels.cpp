@@ -0,0 +1,173 @@
+/* -*- c-basic-offset: 2 -*-
+  bench_kernels -- micro-benchmarks for the bulk copy kernels in
+  ``mlabwrap/mlabraw_kernels.h``.
+
+  The kernels don't depend on MATLAB(TM) or NumPy, so this builds and runs
+  without either:
+
+    g++ -O2 -Imlabwrap -o bench_kernels benchmarks/bench_kernels.cpp
+    ./bench_kernels [--json] [--size N]
+
+  For every element type and memory layout the throughput (in GB/s of data
+  read plus written) of the kernel is reported next to the naive
+  element-by-element loop it replaced.
+*/
+#include <chrono>
+#include <complex>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <stdint.h>
+#include <string>
+#include <vector>
+
+#include "mlabraw_kernels.h"
+
+using namespace mlabraw_kernels;
+
+static bool gJson = false;
+static bool gFirst = true;
+
+static void report(const char *pName, const char *pLayout, const char *pImpl,
+                   double pBytes, double pSeconds)
+{
+  double lGBs = pBytes / pSeconds / 1e9;
+  if (gJson) {
+    std::printf("%s\n  {\"kernel\": \"%s\", \"layout\": \"%s\", \"impl\": \"%s\", "
+                "\"bytes\": %.0f, \"seconds\": %.6g, \"gb_per_s\": %.3f}",
+                gFirst ? "[" : ",", pName, pLayout, pImpl, pBytes, pSeconds, lGBs);
+  } else {
+    std::printf("%-24s %-16s %-8s %8.2f GB/s\n", pName, pLayout, pImpl, lGBs);
+  }
+  gFirst = false;
+}
+
+// Runs `pFn` repeatedly for at least ~0.2s and returns the best time per call.
+template <class Fn>
+static double timeit(Fn pFn)
+{
+  typedef std::chrono::steady_clock Clock;
+  double lBest = 1e30, lTotal = 0;
+  for (int i = 0; i < 3 || lTotal < 0.2; i++) {
+    Clock::time_point t0 = Clock::now();
+    pFn();
+    double dt = std::chrono::duration<double>(Clock::now() - t0).count();
+    lTotal += dt;
+    if (dt < lBest) lBest = dt;
+  }
+  return lBest;
+}
+
+// the loops the kernels replaced (cf. the old copyNumeric2Mx & co.)
+template <class S, class D>
+static void naiveGatherC2F(const S *pSrc, index_t pRows, index_t pCols, D *pDst)
+{
+  for (unsigned int j = 0; j != pCols; j++)
+    for (unsigned int i = 0; i != pRows; i++)
+      *pDst++ = pSrc[i * pCols + j];
+}
+
+template <class S, class D>
+static void naiveCopy(const S *pSrc, index_t pN, D *pDst)
+{
+  for (unsigned int i = 0; i != pN; i++) *pDst++ = *pSrc++;
+}
+
+// python -> matlab (gather) and matlab -> python (scatter) for a rows x cols
+// matrix of S in fortran order, C order and as a strided view (every other
+// column of a twice as wide C-ordered matrix).
+template <class S, class D>
+static void benchReal(const char *pName, index_t pRows, index_t pCols)
+{
+  const index_t n = pRows * pCols;
+  std::vector<S> lSrc(2 * n);
+  std::vector<D> lDst(n);
+  for (index_t i = 0; i != 2 * n; i++) lSrc[i] = static_cast<S>(i % 101);
+  const double lBytes = double(n) * (sizeof(S) + sizeof(D));
+  const char *lSrcP = (const char *)&lSrc[0];
+  D *lDstP = &lDst[0];
+
+  index_t lShape[2] = {pRows, pCols};
+  index_t lFStrides[2] = {(index_t)sizeof(S), (index_t)(pRows * sizeof(S))};
+  index_t lCStrides[2] = {(index_t)(pCols * sizeof(S)), (index_t)sizeof(S)};
+  index_t lVStrides[2] = {(index_t)(2 * pCols * sizeof(S)), (index_t)(2 * sizeof(S))};
+
+  report(pName, "fortran", "kernel", lBytes, timeit([&] {
+    gatherF<S, D>(lSrcP, 2, lShape, lFStrides, lDstP); }));
+  report(pName, "fortran", "naive", lBytes, timeit([&] {
+    naiveCopy(&lSrc[0], n, lDstP); }));
+  report(pName, "C (transpose)", "kernel", lBytes, timeit([&] {
+    gatherF<S, D>(lSrcP, 2, lShape, lCStrides, lDstP); }));
+  report(pName, "C (transpose)", "naive", lBytes, timeit([&] {
+    naiveGatherC2F(&lSrc[0], pRows, pCols, lDstP); }));
+  for (index_t i = 0; i < n; i += 997) {   // sanity check of the transposition
+    if (lDst[i] != static_cast<D>(lSrc[(i % pRows) * pCols + i / pRows])) {
+      std::fprintf(stderr, "%s: wrong result at %ld\n", pName, (long)i);
+      std::exit(1);
+    }
+  }
+  report(pName, "strided view", "kernel", lBytes, timeit([&] {
+    gatherF<S, D>(lSrcP, 2, lShape, lVStrides, lDstP); }));
+  // and back again, into a C-ordered result
+  std::vector<S> lBack(n);
+  index_t lBackStrides[2] = {(index_t)(pCols * sizeof(S)), (index_t)sizeof(S)};
+  report(pName, "C (scatter)", "kernel", lBytes, timeit([&] {
+    scatterF<D, S>(lDstP, 2, lShape, lBackStrides, (char *)&lBack[0]); }));
+}
+
+// interleaved complex <-> split planes
+template <class S, class D>
+static void benchComplex(const char *pName, index_t pRows, index_t pCols)
+{
+  const index_t n = pRows * pCols;
+  std::vector<S> lSrc(2 * n);
+  std::vector<D> lRe(n), lIm(n);
+  for (index_t i = 0; i != 2 * n; i++) lSrc[i] = static_cast<S>(i % 101);
+  const double lBytes = double(n) * 2 * (sizeof(S) + sizeof(D));
+  index_t lShape[2] = {pRows, pCols};
+  index_t lFStrides[2] = {(index_t)(2 * sizeof(S)), (index_t)(2 * pRows * sizeof(S))};
+  index_t lCStrides[2] = {(index_t)(2 * pCols * sizeof(S)), (index_t)(2 * sizeof(S))};
+
+  report(pName, "fortran (split)", "kernel", lBytes, timeit([&] {
+    gatherSplitF<S, D>((const char *)&lSrc[0], 2, lShape, lFStrides, &lRe[0], &lIm[0]); }));
+  report(pName, "fortran (split)", "naive", lBytes, timeit([&] {
+    const S *p = &lSrc[0]; D *r = &lRe[0], *im = &lIm[0];
+    for (unsigned int i = 0; i != n; i++) { *r++ = *p++; *im++ = *p++; } }));
+  report(pName, "C (split)", "kernel", lBytes, timeit([&] {
+    gatherSplitF<S, D>((const char *)&lSrc[0], 2, lShape, lCStrides, &lRe[0], &lIm[0]); }));
+  report(pName, "C (merge)", "kernel", lBytes, timeit([&] {
+    scatterMergeF<D, S>(&lRe[0], &lIm[0], 2, lShape, lCStrides, (char *)&lSrc[0]); }));
+  // interleaved complex API: no splitting at all
+  std::vector<Complex<D> > lZ(n);
+  report(pName, "fortran (inter)", "kernel", lBytes, timeit([&] {
+    gatherF<Complex<S>, Complex<D> >((const char *)&lSrc[0], 2, lShape, lFStrides, &lZ[0]); }));
+  report(pName, "C (inter)", "kernel", lBytes, timeit([&] {
+    gatherF<Complex<S>, Complex<D> >((const char *)&lSrc[0], 2, lShape, lCStrides, &lZ[0]); }));
+}
+
+int main(int argc, char **argv)
+{
+  index_t lSize = 2048;         // matrices are lSize x lSize
+  for (int i = 1; i < argc; i++) {
+    if (!std::strcmp(argv[i], "--json")) gJson = true;
+    else if (!std::strcmp(argv[i], "--size") && i + 1 < argc) lSize = std::atol(argv[++i]);
+    else {
+      std::fprintf(stderr, "usage: %s [--json] [--size N]\n", argv[0]);
+      return 2;
+    }
+  }
+  if (!gJson) std::printf("%ld x %ld matrices\n", (long)lSize, (long)lSize);
+
+  benchReal<double, double>("double -> double", lSize, lSize);
+  benchReal<float, float>("single -> single", lSize, lSize);
+  benchReal<float, double>("single -> double", lSize, lSize);
+  benchReal<int32_t, double>("int32 -> double", lSize, lSize);
+  benchReal<int32_t, int32_t>("int32 -> int32", lSize, lSize);
+  benchReal<uint8_t, uint8_t>("uint8 -> uint8", lSize, lSize);
+  benchReal<int64_t, int64_t>("int64 -> int64", lSize, lSize);
+  benchComplex<double, double>("complex double", lSize, lSize);
+  benchComplex<float, float>("complex single", lSize, lSize);
+
+  if (gJson) std::printf("\n]\n");
+  return 0;
+}
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+"""Measures mlabwrap's per-call overhead and transfer throughput: the latency
+of ``mlab.<fn>`` calls with 0 to ``--max-args`` arguments, ``_set``/``_get``
+of double, single, complex and int32 arrays (in C and Fortran order) from one
+element up to ``--max-mb``, the conversion of structs and cells, attribute
+access on proxies and the first lookup of a function (``__getattr__``).
+
+It runs against matlab(tm) or, with ``--engine fake``, against the fake
+engine (``tests/fakeengine.py``), which shows mlabwrap's own share of the
+cost. Save the results with ``--output`` and pass an earlier file to
+``--compare`` to see what got slower (or faster) since.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy
+
+# (where the fake engine lives)
+TESTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                         'tests')
+
+DTYPES = [('double', numpy.float64), ('single', numpy.float32),
+          ('complex', numpy.complex128), ('int32', numpy.int32)]
+
+
+def best_time(fn, repeat, min_time=0.05):
+    """The best time per call of `fn` over `repeat` runs, each of which
+    calls it often enough to take `min_time` (like ``timeit``)."""
+    number = 1
+    while True:
+        t0 = time.time()
+        for _ in range(number):
+            fn()
+        elapsed = time.time() - t0
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        t0 = time.time()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.time() - t0) / number)
+    return best
+
+
+def bench_calls(mlab, args):
+    """Latency of calls with 0 to ``--max-args`` scalar arguments."""
+    results = []
+    mlab.horzcat(1.)  # (looked up once)
+    for nargs in range(args.max_args + 1):
+        call_args = [float(i) for i in range(nargs)]
+        seconds = best_time(lambda: mlab.horzcat(*call_args), args.repeat)
+        results.append(dict(group='call', op='horzcat', nargs=nargs,
+                            seconds=seconds))
+    seconds = best_time(lambda: mlab.sum(1., nout=0), args.repeat)
+    results.append(dict(group='call', op='sum(nout=0)', nargs=1,
+                        seconds=seconds))
+    return results
+
+
+def sizes(max_bytes, itemsize):
+    """Numbers of elements from one up to `max_bytes`."""
+    n = 1
+    while n * itemsize <= max_bytes:
+        yield n
+        n = max(n * 16, 1024 // itemsize) if n == 1 else n * 16
+
+
+def test_array(n, dtype, order):
+    cols = min(n, 1024)
+    a = numpy.arange(n).reshape(n // cols, cols).astype(dtype)
+    if numpy.dtype(dtype).kind == 'c':
+        a = a + 1j * a
+    return numpy.asfortranarray(a) if order == 'F' else a
+
+
+def bench_transfer(mlab, args):
+    """Throughput of ``_set`` and ``_get`` by type, size and order."""
+    results = []
+    native = mlab._native_dtypes
+    mlab._native_dtypes = True  # so that int32 stays int32
+    try:
+        for label, dtype in DTYPES:
+            itemsize = numpy.dtype(dtype).itemsize
+            for n in sizes(args.max_mb << 20, itemsize):
+                for order in 'CF':
+                    a = test_array(n, dtype, order)
+                    repeat = args.repeat if a.nbytes < 64 << 20 else 1
+                    t_set = best_time(lambda: mlab._set('BENCH_X__', a),
+                                      repeat)
+                    t_get = best_time(lambda: mlab._get('BENCH_X__',
+                                                        order=order),
+                                      repeat)
+                    for op, seconds in [('_set', t_set), ('_get', t_get)]:
+                        results.append(dict(
+                            group='transfer', op=op, dtype=label,
+                            order=order, elements=n, bytes=a.nbytes,
+                            seconds=seconds,
+                            mb_per_s=a.nbytes / 2.**20 / seconds))
+        mlab.clear('BENCH_X__')
+    finally:
+        mlab._native_dtypes = native
+    return results
+
+
+def bench_conversion(mlab, args):
+    """Cost of converting structs and cells with `n` scalar parts."""
+    results = []
+    for n in [10, 100, 1000]:
+        cell = [float(i) for i in range(n)]
+        struct = dict(('f%d' % i, float(i)) for i in range(n))
+        for kind, value in [('cell', cell), ('struct', struct)]:
+            name = 'BENCH_%s__' % kind.upper()
+            t_set = best_time(lambda: mlab._set(name, value), args.repeat)
+            t_get = best_time(lambda: mlab._get(name), args.repeat)
+            for op, seconds in [('_set', t_set), ('_get', t_get)]:
+                results.append(dict(group='conversion', op=op, kind=kind,
+                                    elements=n, seconds=seconds))
+            mlab.clear(name)
+    return results
+
+
+def bench_proxy(mlab, args):
+    """Attribute access (and creation) of proxies."""
+    mlab._eval("BENCH_S__ = struct('a', 1, 'b', 'text');")
+    proxy = mlab._make_proxy('BENCH_S__')
+    results = [
+        dict(group='proxy', op='getattr', seconds=best_time(
+            lambda: proxy.a, args.repeat)),
+        dict(group='proxy', op='setattr', seconds=best_time(
+            lambda: setattr(proxy, 'a', 2.), args.repeat)),
+        dict(group='proxy', op='create', seconds=best_time(
+            lambda: mlab._make_proxy('BENCH_S__'), args.repeat)),
+    ]
+    mlab.clear('BENCH_S__')
+    return results
+
+
+def bench_lookup(mlab, args):
+    """The first ``mlab.<name>`` lookup, without and with the metadata
+    cache, and later ones (a plain attribute)."""
+    from mlabwrap import _MetadataCache
+    names = ['sin', 'cos', 'sum', 'zeros', 'size', 'class', 'numel',
+             'repmat']
+    results = []
+    metadata = mlab._metadata
+    try:
+        for op, fresh_cache in [('cold', True), ('cached', False)]:
+            def lookup():
+                if fresh_cache:
+                    mlab._metadata = _MetadataCache(None)
+                for name in names:
+                    mlab.__dict__.pop(name, None)
+                    getattr(mlab, name)
+            seconds = best_time(lookup, args.repeat) / len(names)
+            results.append(dict(group='getattr', op=op, seconds=seconds))
+        seconds = best_time(lambda: mlab.sin, args.repeat)
+        results.append(dict(group='getattr', op='bound', seconds=seconds))
+    finally:
+        mlab._metadata = metadata
+    return results
+
+
+BENCHMARKS = [('call', bench_calls), ('transfer', bench_transfer),
+              ('conversion', bench_conversion), ('proxy', bench_proxy),
+              ('getattr', bench_lookup)]
+
+
+def key(result):
+    """What identifies a measurement across runs."""
+    return tuple(sorted((k, v) for k, v in result.items()
+                        if k not in ('seconds', 'mb_per_s')))
+
+
+def describe(result):
+    return " ".join("%s=%s" % (k, v) for k, v in sorted(result.items())
+                    if k not in ('group', 'seconds', 'mb_per_s'))
+
+
+def compare(old, new, threshold):
+    """Prints the measurements that changed by more than `threshold`
+    (a fraction); returns the number of those that got slower."""
+    before = dict((key(r), r['seconds']) for r in old['results'])
+    slower = 0
+    for r in new['results']:
+        if key(r) not in before:
+            continue
+        ratio = r['seconds'] / before[key(r)]
+        if abs(ratio - 1) > threshold:
+            slower += ratio > 1
+            print("%-10s %-50s %6.2fx %s" % (
+                r['group'], describe(r), ratio,
+                'slower' if ratio > 1 else 'faster'))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--engine', choices=['matlab', 'fake'],
+                        default=os.environ.get('MLABWRAP_ENGINE', 'matlab'))
+    parser.add_argument('--latency', type=float, default=None,
+                        help='the round-trip latency of the fake engine')
+    parser.add_argument('--max-args', type=int, default=8)
+    parser.add_argument('--max-mb', type=int, default=64,
+                        help='the largest array transferred (use 4096 for '
+                        '4GB, which needs plenty of memory on both sides)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', action='append',
+                        choices=[name for name, _ in BENCHMARKS],
+                        help='run only these benchmarks')
+    parser.add_argument('--output', help='save the results (JSON) here')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare with earlier results')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='the change to report with --compare')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    args = parser.parse_args(argv)
+
+    # (the engine is chosen when mlabwrap is imported)
+    if args.engine == 'fake':
+        os.environ['MLABWRAP_ENGINE'] = 'fake'
+        sys.path.insert(0, TESTS_DIR)
+        if args.latency is not None:
+            os.environ['MLABWRAP_FAKE_LATENCY'] = str(args.latency)
+    import mlabwrap
+    from mlabwrap import MlabWrap
+
+    mlab = MlabWrap(metadata_cache=None)
+    mlab.plus(1., 0.)  # warm up
+    run = dict(engine=args.engine,
+               matlab_version=str(mlab._do("version")),
+               python=platform.python_version(),
+               numpy=numpy.__version__,
+               platform=platform.platform(),
+               time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+               results=[])
+    if args.engine == 'fake':
+        run['latency'] = mlabwrap.mlabraw.set_latency(mlab._session, 0)
+        mlabwrap.mlabraw.set_latency(mlab._session, run['latency'])
+    for name, bench in BENCHMARKS:
+        if args.only and name not in args.only:
+            continue
+        for result in bench(mlab, args):
+            run['results'].append(result)
+            if not args.json:
+                print("%-10s %-50s %12.1f us%s" % (
+                    result['group'], describe(result),
+                    result['seconds'] * 1e6,
+                    " %9.1f MB/s" % result['mb_per_s']
+                    if 'mb_per_s' in result else ""))
+    mlab.close()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(run, f, indent=1, sort_keys=True)
+    if args.json:
+        json.dump(run, sys.stdout, indent=1, sort_keys=True)
+        print()
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        print("\ncompared with %s (%s, %s engine):" % (
+            args.compare, old.get('time'), old.get('engine')))
+        return 1 if compare(old, run, args.threshold) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
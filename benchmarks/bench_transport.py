@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""Compares the 'pipe' and 'shm' transports of ``MlabWrap`` for payloads of
+1MB up to (by default) 256MB; use ``--max-mb 4096`` to go up to 4GB (which
+needs plenty of memory on both sides).
+
+For every size the best of ``--repeat`` runs is reported for putting an
+array into matlab, getting it back and a call that does both (``x + 0``).
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import sys
+import time
+
+import numpy
+
+from mlabwrap import MlabWrap
+
+
+def best_time(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.time()
+        fn()
+        best = min(best, time.time() - t0)
+    return best
+
+
+def bench(mlab, nbytes, repeat):
+    a = numpy.random.rand(nbytes // 8 // 1024, 1024)
+    mlab._set('BENCH_X__', a)
+    res = {
+        'put': best_time(lambda: mlab._set('BENCH_X__', a), repeat),
+        # touch the data, memmaps are lazy
+        'get': best_time(lambda: mlab._get('BENCH_X__').sum(), repeat),
+        'call': best_time(lambda: mlab.plus(a, 0).sum(), repeat),
+    }
+    mlab.clear('BENCH_X__')
+    return res
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--max-mb', type=int, default=256)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--shm-dir', default=None)
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    args = parser.parse_args(argv)
+
+    results = []
+    for transport in ['pipe', 'shm']:
+        mlab = MlabWrap(transport=transport, shm_dir=args.shm_dir)
+        mlab.plus(1, 0) # warm up
+        mb = 1
+        while mb <= args.max_mb:
+            times = bench(mlab, mb << 20, args.repeat)
+            for op, seconds in sorted(times.items()):
+                results.append(dict(transport=transport, op=op, mb=mb,
+                                    seconds=seconds, mb_per_s=mb / seconds))
+                if not args.json:
+                    print("%-5s %-5s %6d MB %9.4f s %9.1f MB/s" % (
+                        transport, op, mb, seconds, mb / seconds))
+            mb *= 4
+        mlab.close()
+    if args.json:
+        json.dump(results, sys.stdout, indent=1)
+        print()
+
+
+if __name__ == '__main__':
+    main()
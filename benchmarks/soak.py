@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""Soak test for leaks: runs a mix of typical ``MlabWrap`` operations (calls
+with array arguments, procedure calls, ``_set``/``_get``, struct and cell
+conversion, short-lived proxies) for ``--iterations`` rounds and checks that
+neither python's resident memory nor the size of the matlab workspace keep
+growing after the first ``--warmup`` rounds, and that no orphaned mlabwrap
+variables are left behind (see ``MlabWrap._workspace_report``).
+
+Exits with status 1 if any of the checks fails. Run it with the environment
+variable ``MLABWRAP_ENGINE=fake`` to check mlabwrap's own side without matlab
+(the fake engine, ``tests/fakeengine.py``, is found by itself).
+"""
+from __future__ import print_function
+
+import argparse
+import gc
+import json
+import os
+import resource
+import sys
+
+import numpy
+
+if os.environ.get('MLABWRAP_ENGINE') == 'fake':
+    # (the fake engine lives with the tests)
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    os.pardir, 'tests'))
+
+from mlabwrap import MlabWrap
+
+
+def rss_bytes():
+    """The resident memory of this process (the peak, where that's all
+    that is available)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError):
+        # kilobytes on linux, bytes on OS X
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def workload(mlab, a):
+    """One round of operations that shouldn't leave anything behind."""
+    mlab.sin(a)
+    mlab.sum(a, nout=0)
+    mlab._set('SOAK_X__', a)
+    mlab._get('SOAK_X__', remove=True)
+    mlab.struct('a', a, 'b', 'text')
+    mlab.num2cell(a[0, :10])
+    p = mlab.int8(a[:3] * 10) # int8 is proxied (without _native_dtypes)
+    p[0]
+    del p
+
+
+def sample(mlab):
+    gc.collect()
+    report = mlab._workspace_report()
+    return dict(rss=rss_bytes(), workspace_bytes=report['workspace_bytes'],
+                orphans=report['orphans'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--size', type=int, default=100,
+                        help='the arrays used are SIZE x SIZE')
+    parser.add_argument('--max-rss-growth-mb', type=float, default=20.)
+    parser.add_argument('--max-workspace-growth-kb', type=float, default=64.)
+    parser.add_argument('--json', action='store_true',
+                        help='print the samples as JSON')
+    args = parser.parse_args(argv)
+
+    mlab = MlabWrap()
+    a = numpy.random.rand(args.size, args.size)
+    samples = []
+    for i in range(args.iterations):
+        workload(mlab, a)
+        if (i + 1) % max(args.warmup, 1) == 0:
+            samples.append(dict(sample(mlab), iteration=i + 1))
+            if not args.json:
+                print("%6d rounds: rss %8.1f MB, workspace %8.1f KB" % (
+                    i + 1, samples[-1]['rss'] / 2.**20,
+                    samples[-1]['workspace_bytes'] / 1024.))
+    final = dict(sample(mlab), iteration=args.iterations)
+    samples.append(final)
+    mlab.close()
+
+    baseline = samples[0]
+    failures = []
+    rss_growth = (final['rss'] - baseline['rss']) / 2.**20
+    if rss_growth > args.max_rss_growth_mb:
+        failures.append("python's rss grew by %.1f MB" % rss_growth)
+    ws_growth = (final['workspace_bytes'] - baseline['workspace_bytes']) / 1024.
+    if ws_growth > args.max_workspace_growth_kb:
+        failures.append("the matlab workspace grew by %.1f KB" % ws_growth)
+    if final['orphans']:
+        failures.append("orphaned variables: %s" % ", ".join(final['orphans']))
+    if args.json:
+        json.dump(dict(samples=samples, failures=failures), sys.stdout,
+                  indent=1)
+        print()
+    for failure in failures:
+        print("FAILED: " + failure, file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,10 +9,10 @@
 ## o license: MIT
 ## o FIXME:
 ##   - it seems proxies can somehow still 'disappear', maybe in connection
-##     with exceptions in the matlab workspace?
-##   - add test that defunct proxy-values are culled from matlab workspace
-##     (for some reason ipython seems to keep them alive somehwere, even after
-##     a zaphist, should find out what causes that!)
+##     with exceptions in the matlab workspace? (``mlab._workspace_report()``
+##     lists the values of live proxies that are missing, as well as orphaned
+##     ones; for some reason ipython seems to keep defunct proxies alive
+##     somehwere, even after a zaphist, should find out what causes that!)
 ##   - add tests for exception handling!
 ##   - the proxy getitem/setitem only works quite properly for 1D arrays
 ##     (matlab's moronic syntax also means that 'foo(bar)(watz)' is not the
@@ -103,11 +103,13 @@ handles what you want.
 Fine points and limitations
 ---------------------------
 
-- Only 2D matrices are directly supported as return values of matlab
-  functions (arbitrary matlab classes are supported via proxy objects --
-  in most cases this shouldn't make much of a difference (as these proxy
-  objects can be even pickled) -- still this functionality is yet
-  experimental).
+- Numeric, logical and char arrays of any dimension, structs and struct
+  arrays (see ``_struct_as``) and cell arrays (vectors become lists, others
+  object arrays) are directly supported as return values of matlab
+  functions; char matrices become numpy unicode arrays of their rows.
+  Arbitrary matlab classes are supported via proxy objects -- in most cases
+  this shouldn't make much of a difference (as these proxy objects can be
+  even pickled) -- still this functionality is yet experimental.
 
   One potential pitfall with structs (which are currently proxied) is that
   setting indices of subarrays ``struct.part[index] = value`` might seem
@@ -119,13 +121,17 @@ Fine points and limitations
 
   will have the desired effect.
 
+- If scipy is installed, matlab(tm) sparse matrices are returned as
+  ``scipy.sparse.csc_matrix`` and scipy sparse matrices (of any format) can
+  be passed to matlab(tm) functions (otherwise sparse matrices are proxied).
+
 - Matlab doesn't know scalars, or 1D arrays. Consequently all functions
   that one might expect to return a scalar or 1D array will return a 1x1
   array instead. Also, because matlab(tm) is built around the 'double'
   matrix type (which also includes complex matrices), single floats and
-  integer types will be cast to double. Note that row and column vectors
-  can be autoconverted automatically to 1D arrays if that is desired (see
-  ``_flatten_row_vecs``).
+  integer types will be cast to double (unless ``_native_dtypes`` is set).
+  Note that row and column vectors can be autoconverted automatically to 1D
+  arrays if that is desired (see ``_flatten_row_vecs``).
 
 - for matlab(tm) function names like ``print`` that are reserved words in
   python, so you have to add a trailing underscore (e.g. ``mlab.print_``).
@@ -142,12 +148,80 @@ Fine points and limitations
   Now ``mlab.foo()`` will by default always return 3 values, but you can still
   get only one by doing ``mlab.foo(nout=1)``
 
+- large arrays can be exchanged through files in shared memory rather than
+  through the engine's pipe::
+
+    mlab = MlabWrap(transport='shm', shm_threshold=1<<20)
+
+  Then numeric arrays of more than ``shm_threshold`` bytes are written to a
+  file (by default under /dev/shm) that matlab(tm) reads with
+  ``memmapfile``; large real results come back as (fortran-ordered,
+  copy-on-write) ``numpy.memmap``\s of a file written by matlab(tm).
+
+- to run independent calls in parallel, use a pool of sessions::
+
+    pool = MlabPool(4)
+    results = pool.map('fft', list_of_arrays)
+    with pool.session() as mlab:
+        mlab.plot(results[0])
+
 - by default the working directory of matlab(tm) is kept in synch with that of
   python to avoid unpleasant surprises. In case this behavior does instaed
   cause you unpleasant surprises, you can turn it off with::
 
     mlab._autosync_dirs = False
 
+  Matlab(tm) is only told to ``cd`` when python's working directory has
+  changed since the last call; if you change matlab's directory behind
+  mlabwrap's back (e.g. with ``mlabraw.eval``), call
+  ``mlab._invalidate_dir_sync()`` to have it synchronized again.
+
+- the output of a command is normally passed to ``handle_out`` (i.e.
+  printed) when it is done; to see it while a long computation is still
+  running, set ``mlab._stream_output = True`` (or pass ``stream=True`` to
+  ``mlab._do``). Up to 1MB of output is kept per command, to change that
+  use ``mlabraw.set_output_size(mlab._session, nbytes)``.
+
+- to see where the time goes, set ``mlab._profile = MlabProfile()``: it
+  collects the number of calls, engine round-trips, bytes transferred and
+  the time spent in the engine, in conversions and in python per matlab
+  function (``mlab._profile.as_dict()``). ``mlabraw.stats(mlab._session)``
+  has the raw counters of the session.
+
+- in chains of calls on large arrays, have the intermediate results left in
+  matlab: ``x = mlab.foo(a, lazy=True)`` returns a ``MlabLazyResult``,
+  which can be passed on (``mlab.bar(x)``) without being copied to python
+  and back, and is only fetched when python needs its value
+  (``numpy.asarray(x)``). ``mlab._lazy_results = True`` makes that the
+  default.
+
+- chains of cheap calls, where the engine round-trips take most of the
+  time, can be recorded and then run as a single script::
+
+    with mlab._batch() as b:
+        m = b.mean(b.abs(b.fft(x)))
+    m._value()
+
+  See ``MlabBatch`` for the details.
+
+- to move many variables at once, use ``mlab._set_many({'a': 1, 'b': x})``
+  and ``a, b = mlab._get_many(['a', 'b'])``: they cost a few engine
+  round-trips in all rather than one or two per variable.
+
+- the matlab variables of proxies that have been garbage collected (and
+  mlabwrap's own temporaries) aren't cleared right away, but as part of the
+  next command (``__del__`` never calls matlab). If you use ``mlabraw`` on
+  ``mlab._session`` yourself, evaluate with ``mlab._eval`` so that pending
+  clears can't hit variables you've just set.
+
+- to measure or regression-test mlabwrap itself without matlab(tm), set
+  the environment variable ``MLABWRAP_ENGINE`` to 'fake' before importing
+  mlabwrap: ``fakeengine`` (``tests/fakeengine.py``, which has to be on
+  ``sys.path``), a pure-python stand-in for ``mlabraw`` that interprets the
+  small subset of the matlab(tm) language that mlabwrap uses, is imported
+  instead (with an artificial latency per round-trip of
+  ``MLABWRAP_FAKE_LATENCY`` seconds, if that is set).
+
 - you can customize how matlab setting the appropriate keyword args on the
   MatlabInstance call. For example:
   >>> MlabInstance.get_instance(
@@ -174,6 +248,25 @@ import sys
 import re
 import weakref
 import atexit
+import tempfile
+import io
+import threading
+import time
+import contextlib
+import functools
+import collections
+
+try:
+    import Queue
+    import cPickle
+except ImportError: # python 3
+    import queue as Queue
+    import pickle as cPickle
+
+try:
+    basestring
+except NameError: # python 3
+    basestring = str
 
 import numpy
 
@@ -181,7 +274,18 @@ from mlabwrap_utils import find_matlab_root
 
 ndarray = numpy.ndarray
 
-import mlabraw
+# (re-raises an exception with its original traceback; python 2's syntax for
+# that is an error in python 3)
+if sys.version_info[0] < 3:
+    exec("def _reraise(typ, value, tb):\n    raise typ, value, tb\n")
+else:
+    def _reraise(typ, value, tb):
+        raise value.with_traceback(tb)
+
+if os.environ.get('MLABWRAP_ENGINE') == 'fake':
+    import fakeengine as mlabraw
+else:
+    from . import mlabraw
 
 
 #XXX: nested access
@@ -207,6 +311,84 @@ class CurlyIndexer(object):
         self.proxy.__setitem__(index, value, '{}')
 
 
+def _synchronized(method):
+    """Makes `method` hold the lock of the ``MlabWrap`` it is called on, so
+    that sequences of engine calls sharing workspace temporaries don't get
+    interleaved when a session is used from several threads."""
+    @functools.wraps(method)
+    def synchronized(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return synchronized
+
+
+def _profiled(fmt):
+    """Makes a ``MlabWrap`` method record its engine calls etc. with the
+    ``_profile`` of the ``MlabWrap`` (if there is one), under the name `fmt`
+    ``%`` its first argument (or just `fmt`, if that has no placeholder).
+    Calls made from within profiled methods count towards the outermost
+    one."""
+    def decorate(method):
+        @functools.wraps(method)
+        def profiled(self, name, *args, **kwargs):
+            profile = self._profile
+            if profile is None or self._profiling:
+                return method(self, name, *args, **kwargs)
+            self._profiling = True
+            before = mlabraw.stats(self._session)
+            start = time.time()
+            try:
+                return method(self, name, *args, **kwargs)
+            finally:
+                self._profiling = False
+                profile.record(fmt % name if '%' in fmt else fmt, before,
+                               mlabraw.stats(self._session),
+                               time.time() - start)
+        return profiled
+    return decorate
+
+
+class _DiaryTail(object):
+    """Switches on matlab's diary (to a temporary file) and passes whatever
+    gets written to it on to `handle_out` from a helper thread, every
+    `interval` seconds until ``stop`` is called."""
+
+    def __init__(self, mlabwrap, handle_out, interval):
+        self._mlabwrap = mlabwrap
+        self._handle_out = handle_out
+        self._interval = interval
+        fd, self._path = tempfile.mkstemp(prefix='mlabwrap-diary-')
+        os.close(fd)
+        mlabwrap._eval("diary('%s'); diary on;" %
+                       self._path.replace("'", "''"))
+        # (io's files, unlike python 2's, can be read on after hitting EOF)
+        self._file = io.open(self._path, 'rb')
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while not self._done.wait(self._interval):
+            self._flush()
+
+    def _flush(self):
+        chunk = self._file.read()
+        if chunk:
+            self._handle_out(chunk)
+
+    def stop(self):
+        """Switches the diary off and passes on the rest of the output."""
+        try:
+            self._mlabwrap._eval("diary off;")
+        finally:
+            self._done.set()
+            self._thread.join()
+            self._flush()
+            self._file.close()
+            os.remove(self._path)
+
+
 class MlabObjectProxy(object):
     """A proxy class for matlab objects that can't be converted to python
     types.
@@ -215,9 +397,10 @@ class MlabObjectProxy(object):
     that make designing such a class difficult (e.g. dimensionality, indexing
     and ``length`` work fundamentally different in matlab than in python), so
     although this class currently tries to transparently support some stuff
-    (notably (1D) indexing, slicing and attribute access), other operations
-    (e.g. math operators and in particular __len__ and __iter__) are not yet
-    supported. Don't depend on the indexing semantics not to change.
+    (notably (1D) indexing, slicing, attribute access, ``len`` (the number of
+    elements) and iteration over the elements), other operations (e.g. math
+    operators) are not yet supported. Don't depend on the indexing semantics
+    not to change.
 
     Note:
 
@@ -230,7 +413,11 @@ class MlabObjectProxy(object):
 
       some_array[index] = 3; proxy.foo = some_array
 
-
+    The matlab class, size and fieldnames of the proxied value are fetched
+    (in one go) the first time they are needed and then cached; assigning to
+    a part of a proxy drops the cached metadata of all proxies for the same
+    matlab variable. Use ``_invalidate`` after modifying the variable behind
+    the proxy's back (e.g. with ``mlab._do``).
        """
 
     def __init__(self, mlabwrap, name, parent=None):
@@ -239,12 +426,37 @@ class MlabObjectProxy(object):
         """The name is the name of the proxies representation in matlab."""
         self.__dict__['_parent'] = parent
         """To fake matlab's ``obj{foo}`` style indexing."""
+        self.__dict__['_meta'] = None
+        """The cached metadata and the `_version` of the root it belongs to."""
+        self.__dict__['_version'] = 0
+        """Bumped (in the root proxy) whenever the matlab variable changes."""
+
+    def _root(self):
+        proxy = self
+        while proxy._parent is not None:
+            proxy = proxy._parent
+        return proxy
+
+    def _metadata(self):
+        """Returns the (cached) result of ``mlabwrap._proxy_metadata`` for
+        this proxy."""
+        version = self._root()._version
+        meta = self._meta
+        if meta is None or meta[0] != version:
+            meta = (version, self._mlabwrap._proxy_metadata(self._name))
+            self.__dict__['_meta'] = meta
+        return meta[1]
+
+    def _invalidate(self):
+        """Drops the cached metadata of all proxies for the matlab variable
+        of this one."""
+        self._root().__dict__['_version'] += 1
 
     def __repr__(self):
         output = []
         self._mlabwrap._do('disp(%s)' % self._name, nout=0, handle_out=output.append)
         rep = "".join(output)
-        klass = self._mlabwrap._do("class(%s)" % self._name)
+        klass = self._metadata()['class']
         ##         #XXX what about classes?
         ##         if klass == "struct":
         ##             rep = "\n" + self._mlabwrap._format_struct(self._name)
@@ -257,33 +469,41 @@ class MlabObjectProxy(object):
 
     def __del__(self):
         if self._parent is None:
-            mlabraw.eval(self._mlabwrap._session, 'clear %s;' % self._name)
-
-    def _get_part(self, to_get):
-        if self._mlabwrap._var_type(
-                to_get) in self._mlabwrap._mlabraw_can_convert:
-            #!!! need assignment to TMP_VAL__ because `mlabraw.get` only works
-            # with 'atomic' values like ``foo`` and not e.g. ``foo.bar``.
-            mlabraw.eval(self._mlabwrap._session, "TMP_VAL__=%s" % to_get)
-            return self._mlabwrap._get('TMP_VAL__', remove=True)
+            # (cleared along with the next command, see ``MlabWrap._discard``)
+            self._mlabwrap._discard(self._name)
+
+    def _get_part(self, to_get, vartype=None):
+        with self._mlabwrap._lock:
+            if vartype is None:
+                vartype = self._mlabwrap._var_type(to_get)
+            if (vartype in self._mlabwrap._convertible_types() or
+                vartype.endswith('-large')):
+                #!!! need assignment to TMP_VAL__ because `mlabraw.get` only works
+                # with 'atomic' values like ``foo`` and not e.g. ``foo.bar``.
+                self._mlabwrap._eval("TMP_VAL__=%s" % to_get)
+                return self._mlabwrap._get('TMP_VAL__', remove=True,
+                                           vartype=vartype)
         return type(self)(self._mlabwrap, to_get, self)
 
     def _set_part(self, to_set, value):
         #FIXME s.a.
         if isinstance(value, MlabObjectProxy):
-            mlabraw.eval(self._mlabwrap._session,
-                         "%s = %s;" % (to_set, value._name))
+            self._mlabwrap._eval("%s = %s;" % (to_set, value._name))
         else:
-            self._mlabwrap._set("TMP_VAL__", value)
-            mlabraw.eval(self._mlabwrap._session, "%s = TMP_VAL__;" % to_set)
-            mlabraw.eval(self._mlabwrap._session, 'clear TMP_VAL__;')
-
+            with self._mlabwrap._lock:
+                self._mlabwrap._set("TMP_VAL__", value)
+                self._mlabwrap._eval("%s = TMP_VAL__;" % to_set)
+                self._mlabwrap._discard('TMP_VAL__')
+        self._invalidate()
 
     def __getattr__(self, attr):
         if attr == "_":
             return self.__dict__.setdefault('_', CurlyIndexer(self))
         else:
-            return self._get_part("%s.%s" % (self._name, attr))
+            # the fields of scalar structs are classified along with the
+            # metadata, so there's no need to ask again
+            return self._get_part("%s.%s" % (self._name, attr),
+                                  self._metadata()['fieldtypes'].get(attr))
 
     def __setattr__(self, attr, value):
         self._set_part("%s.%s" % (self._name, attr), value)
@@ -295,12 +515,14 @@ class MlabObjectProxy(object):
             "%s does not yet implement truth testing" % type(self).__name__)
 
     def __len__(self):
-        raise TypeError(
-            "%s does not yet implement __len__" % type(self).__name__)
+        return int(numpy.prod(self._metadata()['size']))
 
     def __iter__(self):
-        raise TypeError(
-            "%s does not yet implement iteration" % type(self).__name__)
+        """Iterates over the elements (the contents for cells) in matlab's
+        (column-major) order."""
+        parens = ['()', '{}'][self._metadata()['class'] == 'cell']
+        for i in range(len(self)):
+            yield self.__getitem__(i, parens)
 
     def _matlab_str_repr(s):
         if '\n' not in s:
@@ -308,8 +530,10 @@ class MlabObjectProxy(object):
         else:
             # Matlab's string literals suck. They can't represent all
             # strings, so we need to use sprintf
-            return "sprintf('%s')" % escape(s).replace("'", "''").replace("%",
-                                                                          "%%")
+            escaped = s.replace('\\', '\\\\').replace('\n', '\\n').replace(
+                '\t', '\\t').replace('\r', '\\r')
+            return "sprintf('%s')" % escaped.replace("'", "''").replace("%",
+                                                                        "%%")
 
     _matlab_str_repr = staticmethod(_matlab_str_repr)
 
@@ -350,8 +574,15 @@ class MlabObjectProxy(object):
            HACK: Matlab decadently allows overloading *2* different indexing parens,
            ``()`` and ``{}``, hence the ``parens`` option."""
         index = self._convert_index(index)
+        klass = self._metadata()['class']
+        # ``()``-indexing cells and structs gives more of the same (whereas
+        # objects may overload it)
+        if parens == '()' and klass in ('cell', 'struct'):
+            vartype = klass
+        else:
+            vartype = None
         return self._get_part(
-            "".join([self._name, parens[0], index, parens[1]]))
+            "".join([self._name, parens[0], index, parens[1]]), vartype)
 
     def __setitem__(self, index, value, parens='()'):
         """WARNING: see ``__getitem__``."""
@@ -361,11 +592,376 @@ class MlabObjectProxy(object):
             value)
 
 
+class MlabLazyResult(MlabObjectProxy):
+    """A result of a call made with ``lazy=True`` (see ``MlabWrap._do``).
+
+    It stays in the matlab workspace and can be passed to further calls
+    (like any proxy) without a round-trip through python; its value is only
+    fetched (and then kept) when python needs it: ``numpy.asarray(result)``
+    or ``result._value()``. Changing the variable through the proxy (e.g.
+    ``result[0] = 1``) drops the fetched value."""
+
+    def __init__(self, mlabwrap, name, parent=None):
+        MlabObjectProxy.__init__(self, mlabwrap, name, parent)
+        self.__dict__['_cached'] = None
+        """The fetched value and the `_version` of the root it belongs to."""
+
+    def _value(self):
+        """Returns the value, as ``mlab._get`` would have (fetched the first
+        time it is needed)."""
+        version = self._root()._version
+        cached = self._cached
+        if cached is None or cached[0] != version:
+            cached = (version, self._mlabwrap._fetch(self._name))
+            self.__dict__['_cached'] = cached
+        return cached[1]
+
+    def __getattr__(self, attr):
+        # (numpy looks for ``__array_interface__`` etc. before ``__array__``;
+        # don't ask matlab about those)
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        return MlabObjectProxy.__getattr__(self, attr)
+
+    def __array__(self, dtype=None):
+        value = numpy.asarray(self._value())
+        if dtype is not None:
+            value = value.astype(dtype)
+        return value
+
+
+_NATIVE_MLAB_TYPES = ('logical', 'int8', 'uint8', 'int16', 'uint16',
+                      'int32', 'uint32', 'int64', 'uint64')
+"""The matlab(tm) types mlabraw converts to numpy arrays of matching type."""
+
+try:
+    import scipy.sparse
+except ImportError:
+    _SPARSE_MLAB_TYPES = ()
+else:
+    _SPARSE_MLAB_TYPES = ('double-sparse', 'logical-sparse')
+"""The sparse matlab(tm) types mlabraw converts to (and from)
+``scipy.sparse.csc_matrix`` (if scipy is available)."""
+
+_SHM_TYPES = {'double': 'float64', 'single': 'float32', 'logical': 'bool',
+              'int8': 'int8', 'uint8': 'uint8', 'int16': 'int16',
+              'uint16': 'uint16', 'int32': 'int32', 'uint32': 'uint32',
+              'int64': 'int64', 'uint64': 'uint64'}
+"""The dtypes of matlab(tm) classes as exchanged via the 'shm' transport."""
+
+
+_INTERNAL_VAR_RE = re.compile(
+    r'^(PROXY_VAL\d+|TMP_\w+|SHM_ARG\d+|arg\d+|RES\d+|MLABRAW_\w+)__$')
+"""The names of the variables mlabwrap (and mlabraw) keep in the workspace."""
+
+
+_METADATA_CACHE_ENV = 'MLABWRAP_METADATA_CACHE'
+"""The environment variable naming the file in which ``MlabWrap`` keeps the
+metadata of matlab(tm) functions if no ``metadata_cache`` is given."""
+
+
+class _MetadataCache(object):
+    """The number of outputs and the docstrings of matlab(tm) functions,
+    persisted in the file `path` (or just kept in memory if `path` is None).
+
+    Entries are keyed by matlab version and function name and are only valid
+    as long as the function's ``stamp`` (the path ``which`` reports and the
+    file's mtime) is unchanged."""
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = self._load()
+        self._dirty = False
+
+    def _load(self):
+        if self.path is None:
+            return {}
+        try:
+            f = open(self.path, 'rb')
+            try:
+                entries = cPickle.load(f)
+            finally:
+                f.close()
+        except (IOError, EOFError, cPickle.UnpicklingError, ValueError,
+                TypeError, AttributeError, ImportError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def lookup(self, key, stamp):
+        """Returns the entry for `key` (a dict) if its stamp is `stamp`."""
+        entry = self._entries.get(key)
+        if entry is not None and entry['stamp'] == stamp:
+            return entry
+        return None
+
+    def store(self, key, stamp, **fields):
+        """Updates the entry for `key`, dropping it first if it is stale."""
+        entry = self.lookup(key, stamp) or {'stamp': stamp}
+        entry.update(fields)
+        self._entries[key] = entry
+        self._dirty = True
+
+    def save(self):
+        """Writes the cache back (merged with what other processes may have
+        written in the meantime), if anything changed."""
+        if self.path is None or not self._dirty:
+            return
+        entries = self._load()
+        entries.update(self._entries)
+        try:
+            dirname = os.path.dirname(self.path)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            # write to a temp file and rename, so concurrent readers never
+            # see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=dirname or None)
+            f = os.fdopen(fd, 'wb')
+            try:
+                cPickle.dump(entries, f, cPickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            if os.name == 'nt' and os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError):
+            warnings.warn("Couldn't save the metadata cache to %r" %
+                          self.path)
+            return
+        self._entries = entries
+        self._dirty = False
+
+
+class MlabCommand(object):
+    """A matlab(tm) function, procedure or object as returned by
+    ``MlabWrap.__getattr__``. Calling it calls it in matlab; its docstring is
+    only fetched from matlab (and cached) once ``__doc__`` is accessed."""
+
+    def __init__(self, mlabwrap, name, nout, doc=None):
+        self._mlabwrap = mlabwrap
+        self.__name__ = name
+        self._nout = nout
+        self._doc = doc
+
+    def __call__(self, *args, **kwargs):
+        if 'nout' not in kwargs:
+            kwargs['nout'] = self._nout
+        return self._mlabwrap._do(self.__name__, *args, **kwargs)
+
+    def __get__(self, obj, type=None):
+        # never actually bound (commands are instance attributes), but having
+        # this makes pydoc treat commands as routines and show ``__doc__``
+        return self
+
+    @property
+    def __doc__(self):
+        if self._doc is None:
+            self._doc = self._mlabwrap._command_doc(self.__name__)
+        return "\n" + self._doc
+
+    def __repr__(self):
+        return "<%s %r>" % (type(self).__name__, self.__name__)
+
+
+class MlabBatchResult(object):
+    """A result of a call recorded in a ``MlabBatch``: pass it on to further
+    calls in the batch; once the batch has run, ``_value()`` (or
+    ``numpy.asarray(result)``) returns its value, if it was fetched."""
+
+    def __init__(self, batch, name):
+        self._batch = batch
+        self._name = name
+        """The matlab variable the result is assigned to in the script."""
+        self._fetched = False
+        self._result = None
+
+    def _value(self):
+        if not self._fetched:
+            raise ValueError("%r hasn't been fetched (see MlabBatch._fetch)"
+                             % self)
+        return self._result
+
+    def __array__(self, dtype=None):
+        value = numpy.asarray(self._value())
+        if dtype is not None:
+            value = value.astype(dtype)
+        return value
+
+    def __repr__(self):
+        return "<%s %s%s>" % (type(self).__name__, self._name,
+                              ['', ' (fetched)'][self._fetched])
+
+
+class MlabBatch(object):
+    """Records calls and runs them as a single matlab script (see
+    ``MlabWrap._batch``)::
+
+      with mlab._batch() as b:
+          spectrum = b.abs(b.fft(x))
+          m = b.mean(spectrum)
+      m._value()
+
+    ``b.fname(*args, nout=1)`` records a call of the matlab function `fname`
+    and returns its results as ``MlabBatchResult``s (a tuple for ``nout >
+    1``, None for ``nout=0``; there is no lookup of the number of outputs).
+    Arguments can be python values (shipped to matlab together), proxies
+    and results of earlier calls in the batch.
+
+    When the ``with`` block is left (without an exception) the script is
+    run in a single evaluation and the results that weren't passed on to
+    other calls, as well as those given to ``_fetch``, are fetched together;
+    the other results are cleared in matlab. The output of the script is
+    passed to `handle_out` (as for ``MlabWrap._do``)."""
+
+    def __init__(self, mlabwrap, handle_out=_flush_write_stdout):
+        self._mlabwrap = mlabwrap
+        self._handle_out = handle_out
+        self._calls = []
+        """The recorded calls, as (result names, fname, argument exprs)."""
+        self._values = []
+        """The python arguments, shipped as cell ``TMP_BATCH_ARGS__``."""
+        self._value_indices = {}
+        self._results = []
+        self._used = set()
+        """The names of the results passed on to other calls."""
+        self._wanted = set()
+        self._done = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self._run()
+        return False
+
+    def __getattr__(self, fname):
+        if fname.startswith('_'):
+            raise AttributeError(fname)
+        return functools.partial(self._call, fname)
+
+    def _arg_expr(self, arg):
+        if isinstance(arg, MlabBatchResult):
+            if arg._batch is self:
+                self._used.add(arg._name)
+                return arg._name
+            arg = arg._value()
+        if isinstance(arg, MlabObjectProxy):
+            return arg._name
+        # (the same object passed twice is only shipped once)
+        if id(arg) not in self._value_indices:
+            self._value_indices[id(arg)] = len(self._values)
+            self._values.append(arg)
+        return "TMP_BATCH_ARGS__{%d}" % (self._value_indices[id(arg)] + 1)
+
+    def _call(self, fname, *args, **kwargs):
+        """Records a call of `fname` (see the class docstring)."""
+        nout = kwargs.pop('nout', 1)
+        if kwargs:
+            raise TypeError("Unexpected keyword arguments: %s" %
+                            ", ".join(sorted(kwargs)))
+        if self._done:
+            raise ValueError("The batch has already been run")
+        argexprs = [self._arg_expr(arg) for arg in args]
+        results = [MlabBatchResult(self, "TMP_B%d__" % (len(self._results) + i))
+                   for i in range(nout)]
+        self._results.extend(results)
+        self._calls.append(([r._name for r in results], fname, argexprs))
+        if nout == 0:
+            return None
+        elif nout == 1:
+            return results[0]
+        return tuple(results)
+
+    def _fetch(self, *results):
+        """Makes sure `results` are fetched, even if they are passed on to
+        other calls."""
+        for result in results:
+            self._wanted.add(result._name)
+
+    def _script(self):
+        """The matlab code of the recorded calls."""
+        code = []
+        for names, fname, argexprs in self._calls:
+            if names:
+                code.append("[%s] = " % ",".join(names))
+            code.append("%s(%s); " % (fname, ",".join(argexprs)))
+        return "".join(code)
+
+    def _run(self):
+        """Runs the recorded calls (done when leaving the ``with`` block)."""
+        if self._done:
+            raise ValueError("The batch has already been run")
+        self._done = True
+        fetched = [r for r in self._results
+                   if r._name not in self._used or r._name in self._wanted]
+        values = self._mlabwrap._run_batch(
+            self._script(), self._values, [r._name for r in fetched],
+            [r._name for r in self._results if r not in fetched],
+            self._handle_out)
+        for result, value in zip(fetched, values):
+            result._fetched = True
+            result._result = value
+        # (don't keep the arguments, or results, alive)
+        self._values = []
+        self._value_indices.clear()
+        self._results = []
+
+
 class MlabConversionError(Exception):
     """Raised when a mlab type can't be converted to a python primitive."""
     pass
 
 
+class MlabProfile(object):
+    """Collects, per matlab function (or command), figures on the calls made
+    by a ``MlabWrap`` (turn it on with ``mlab._profile = MlabProfile()``):
+
+    ``calls``, ``round_trips``
+      the number of calls and of the engine round-trips they took,
+    ``bytes_put``, ``bytes_got``
+      the data sent to matlab and fetched from it,
+    ``seconds``
+      the total wall time, made up of ``put``, ``eval`` and ``get`` (waiting
+      for the engine), ``py2mx`` and ``mx2py`` (converting arguments and
+      results in mlabraw) and ``python`` (the rest).
+
+    ``_get`` and ``_set`` are recorded under ``_get(varname)`` etc. If
+    `callback` is given it is called with the name and the figures of every
+    single call."""
+
+    PHASES = ('put', 'eval', 'get', 'py2mx', 'mx2py', 'python')
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self._totals = {}
+
+    def record(self, name, before, after, seconds):
+        """Records a call of `name` that took `seconds`, given the
+        ``mlabraw.stats`` of the session `before` and `after` it."""
+        def delta(key):
+            return after[key] - before[key]
+        call = dict(calls=1, seconds=seconds,
+                    round_trips=delta('evals') + delta('gets') + delta('puts'),
+                    bytes_put=delta('bytes_put'), bytes_got=delta('bytes_got'))
+        for phase in self.PHASES[:-1]:
+            call[phase] = delta(phase + '_seconds')
+        call['python'] = max(
+            seconds - sum([call[phase] for phase in self.PHASES[:-1]]), 0.)
+        totals = self._totals.setdefault(name, dict.fromkeys(call, 0))
+        for key, value in call.items():
+            totals[key] += value
+        if self.callback is not None:
+            self.callback(name, call)
+
+    def as_dict(self):
+        """Returns the totals so far, as ``{name: figures}``."""
+        return dict([(name, dict(totals))
+                     for name, totals in self._totals.items()])
+
+    def reset(self):
+        self._totals.clear()
+
+
 class MlabWrap(object):
     """This class does most of the wrapping work. It manages a single matlab
        session (you can in principle have multiple open sessions if you want,
@@ -376,9 +972,23 @@ class MlabWrap(object):
        documented below."""
 
     def __init__(self, matlab_root=find_matlab_root(), use_jvm=False,
-             use_display=False):
+             use_display=False, transport='pipe', shm_threshold=1<<20,
+             shm_dir=None, metadata_cache=None):
         """Create a new matlab(tm) wrapper object.
+
+        ``transport`` selects how numeric arrays of more than
+        ``shm_threshold`` bytes are exchanged with matlab: 'pipe' (the
+        default) sends everything through the engine, 'shm' through files in
+        ``shm_dir`` (default: /dev/shm if available, else the temp dir).
+
+        ``metadata_cache`` is the file in which the number of outputs and the
+        docstrings of the functions used are kept across sessions (default:
+        the file named by the environment variable
+        ``MLABWRAP_METADATA_CACHE``; if that isn't set either, they are kept
+        for this session only).
         """
+        if transport not in ('pipe', 'shm'):
+            raise ValueError("Unknown transport: %r" % (transport,))
         self._array_cast = None
         # Specifies a cast for arrays. If the result of an
         # operation is a numpy array, ``return_type(res)`` will be returned
@@ -386,33 +996,108 @@ class MlabWrap(object):
         self._autosync_dirs = True
         # autosync_dirs specifies whether the working directory of the
         # matlab session should be kept in sync with that of python.
+        self._synced_dir = None
+        # The directory matlab was last told to ``cd`` to (None forces a
+        # ``cd`` before the next call).
+        self._dir_syncs = 0
+        # The number of ``cd``s issued so far (for instrumentation).
         self._flatten_row_vecs = False
         # Automatically return 1xn matrices as flat numeric arrays.
         self._flatten_col_vecs = False
         # Automatically return nx1 matrices as flat numeric arrays.
+        self._array_order = 'C'
+        # The memory layout of returned numeric arrays. 'F' keeps matlab's own
+        # (fortran) order, which saves a copy of every array fetched (and for
+        # real arrays avoids copying altogether). Can be overridden per call
+        # with the ``order`` keyword of ``_do`` and ``_get``.
         self._clear_call_args = True
+        self._struct_as = 'dicts'
+        # How struct arrays (of other than one element) are returned:
+        # 'dicts' gives a list of dicts (in matlab's element order),
+        # 'records' a record array of their shape (with object fields).
+        # Single structs are always returned as a dict.
+        self._cell_max_depth = None
+        self._cell_max_size = None
+        # Cell arrays nested more than ``_cell_max_depth`` levels deep (in
+        # cells and structs) or with more than ``_cell_max_size`` elements
+        # are proxied rather than converted (None: no limit). So are parts
+        # of cells and structs that can't be converted.
+        self._stream_output = False
+        # Pass matlab's output on to ``handle_out`` in chunks while a call is
+        # still running (tailing a diary file, from a helper thread, every
+        # ``_stream_interval`` seconds), rather than all of it at the end.
+        # Can be overridden per call with the ``stream`` keyword of ``_do``.
+        self._stream_interval = 0.1
+        self._lazy_results = False
+        # Leave the (convertible) results of calls in matlab as
+        # ``MlabLazyResult``s, to be fetched only when python needs them,
+        # rather than fetching them right away. Can be overridden per call
+        # with the ``lazy`` keyword of ``_do``.
+        self._native_dtypes = False
+        # Transfer numpy arrays of integer, boolean and single type as the
+        # corresponding matlab class (rather than as double) and return
+        # matlab integer and logical arrays as numpy arrays of matching type
+        # (rather than proxying them).
+        self._transport = transport
+        self._shm_threshold = shm_threshold
+        # With the 'shm' transport, numeric arrays of more than this many
+        # bytes are exchanged via files rather than via the engine.
+        if shm_dir is None:
+            shm_dir = ('/dev/shm' if os.path.isdir('/dev/shm')
+                       else tempfile.gettempdir())
+        self._shm_dir = shm_dir
+        self._shm_count = 0
+        self._shm_leftovers = []
+        # Files that couldn't be removed yet, because they were still mapped
+        # (only on windows).
 
         self._closed = False
+        self._lock = threading.RLock()
+        # Serializes the use of the session by several threads (mlabraw
+        # releases the GIL while matlab is busy).
+        self._metadata = _MetadataCache(
+            metadata_cache or os.environ.get(_METADATA_CACHE_ENV) or None)
+        self._matlab_version = None
+        self._metadata_keys = {}
+        # The metadata cache keys and stamps of the functions looked up by
+        # ``__getattr__`` (for fetching their docstrings later).
+        self._garbage = collections.deque()
+        # The names of matlab variables that are no longer needed (those of
+        # dead proxies and temporaries); they are cleared as part of the next
+        # command rather than with commands of their own (see ``_discard``).
+        self._garbage_threshold = 100
+        # Once more than this many names are pending, a helper thread clears
+        # them without waiting for the next command.
+        self._garbage_flusher = None
+        self._profile = None
+        # A ``MlabProfile`` to record the round-trips, transfers and timings
+        # of every call in (None: don't profile).
+        self._profiling = False
 
         # Remove the function args from matlab workspace after each function
         # call. Otherwise they are left to be (partly) overwritten by the next
         # function call. This saves a function call in matlab but means that the
         # memory used up by the arguments will remain unreclaimed till
         # overwritten.
-        cmd_str = os.path.join(matlab_root, 'bin', 'matlab')
-        cmd_str += ' -nodesktop'
-        if not use_jvm:
-            cmd_str += ' -nojvm'
-        if not use_display:
-            cmd_str += ' -nodisplay'
+        if getattr(mlabraw, 'is_fake', False):
+            cmd_str = None      # (no matlab(tm) to start)
+        else:
+            cmd_str = os.path.join(matlab_root, 'bin', 'matlab')
+            cmd_str += ' -nodesktop'
+            if not use_jvm:
+                cmd_str += ' -nojvm'
+            if not use_display:
+                cmd_str += ' -nodisplay'
         self._session = mlabraw.open(cmd_str)
         atexit.register(self.close)
         self._proxies = weakref.WeakValueDictionary()
         # Use ``mlab._proxies.values()`` for a list of matlab object's that
         # are currently proxied.
         self._proxy_count = 0
-        self._mlabraw_can_convert = ('single', 'double', 'char', 'cell', 'struct')
-        # The matlab(tm) types that mlabraw will automatically convert for us.
+        self._mlabraw_can_convert = (('single', 'double', 'char', 'cell', 'struct') +
+                                     _SPARSE_MLAB_TYPES)
+        # The matlab(tm) types that mlabraw will automatically convert for us
+        # (see also ``_native_dtypes``).
         self._dont_proxy = {'cell': False}
         # The matlab(tm) types we can handle ourselves with a bit of
         # effort. To turn on autoconversion for e.g. cell arrays do:
@@ -428,6 +1113,117 @@ class MlabWrap(object):
                 mlabraw.close(self._session)
             except AssertionError:
                 pass
+            for path in self._shm_leftovers:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._metadata.save()
+
+    def _discard(self, *names):
+        """Schedules the matlab variables `names` for clearing (along with
+        the next command). Never calls matlab itself, so it's safe to use
+        e.g. from ``__del__``."""
+        self._garbage.extend(names)
+        if (len(self._garbage) > self._garbage_threshold and
+            self._garbage_flusher is None and not self._closed):
+            self._garbage_flusher = threading.Thread(
+                target=self._flush_garbage)
+            self._garbage_flusher.daemon = True
+            self._garbage_flusher.start()
+
+    def _claim(self, name):
+        """Takes `name` off the garbage list (it's about to be reused)."""
+        while True:
+            try:
+                self._garbage.remove(name)
+            except ValueError:
+                break
+
+    def _take_garbage(self):
+        """Takes all pending garbage; returns the (sorted) names and the
+        matlab code clearing them. Whoever runs that code must hand the
+        names back with `_return_garbage` if it fails."""
+        names = set()
+        while True:
+            try:
+                names.add(self._garbage.popleft())
+            except IndexError:
+                break
+        if not names:
+            return [], ""
+        names = sorted(names)
+        return names, "clear('%s'); " % "','".join(names)
+
+    def _return_garbage(self, names):
+        """Puts the garbage `names` (from `_take_garbage`) back on the list,
+        because the evaluation that should have cleared them failed."""
+        self._garbage.extendleft(reversed(names))
+
+    @_synchronized
+    def _flush_garbage(self):
+        """Clears the pending garbage right away."""
+        try:
+            if self._garbage and not self._closed:
+                self._eval("")
+        finally:
+            self._garbage_flusher = None
+
+    @_synchronized
+    def _eval(self, cmd):
+        """``mlabraw.eval`` of `cmd`, clearing the pending garbage first (in
+        the same evaluation). All evaluations should go through here, so that
+        reused temporaries are never cleared after being set again."""
+        garbage, prologue = self._take_garbage()
+        try:
+            return mlabraw.eval(self._session, prologue + cmd)
+        except:
+            self._return_garbage(garbage)
+            raise
+
+    @_synchronized
+    def _workspace_report(self):
+        """Returns a dict describing the variables mlabwrap keeps in the
+        matlab workspace (after clearing the pending garbage), with
+
+        ``variables``
+          ``{name: (class, bytes)}`` for the values of proxies
+          (``PROXY_VAL*__``) and the temporaries (``TMP_*__``, ``arg*__``,
+          ``RES*__`` ...) that ``whos`` lists,
+        ``bytes``
+          their total size,
+        ``workspace_bytes``
+          the size of the whole workspace,
+        ``orphans``
+          the names of those of them that should have been cleared (proxy
+          values without a live proxy and temporaries, apart from the call
+          arguments if ``_clear_call_args`` is off) and
+        ``missing``
+          the names of live proxies whose value is gone.
+        """
+        self._eval("TMP_WHOS__ = whos; TMP_WHOS__ = {{TMP_WHOS__.name},"
+                   "{TMP_WHOS__.class}, [TMP_WHOS__.bytes]};")
+        try:
+            names, classes, sizes = mlabraw.get(self._session, "TMP_WHOS__")
+        finally:
+            self._discard("TMP_WHOS__")
+        sizes = [int(n) for n in numpy.ravel(sizes)]
+        variables = {}
+        workspace_bytes = 0
+        for name, klass, nbytes in zip(names, classes, sizes):
+            if name == "TMP_WHOS__":
+                continue
+            workspace_bytes += nbytes
+            if _INTERNAL_VAR_RE.match(name):
+                variables[name] = (klass, nbytes)
+        live = set(self._proxies.keys())
+        orphans = [name for name in sorted(variables)
+                   if name not in live and not
+                   (name.startswith('arg') and not self._clear_call_args)]
+        return dict(variables=variables,
+                    bytes=sum([nbytes for _, nbytes in variables.values()]),
+                    workspace_bytes=workspace_bytes, orphans=orphans,
+                    missing=sorted(live - set(variables)))
 
     def _format_struct(self, varname):
         fieldnames = self._do("fieldnames(%s)" % varname)
@@ -442,16 +1238,74 @@ class MlabWrap(object):
     ##         return "\n".join(["%*s: %s" % (maxlen, (`fv`,`fv`[:20] + '...')[len(`fv`) > 23])
     ##                                        for fv in fieldvalues])
 
+    def _convertible_types(self):
+        """The matlab(tm) types to let mlabraw convert."""
+        if self._native_dtypes:
+            return self._mlabraw_can_convert + _NATIVE_MLAB_TYPES
+        return self._mlabraw_can_convert
+
     def _var_type(self, varname):
-        mlabraw.eval(self._session,
-                     "TMP_CLS__ = class(%(x)s); if issparse(%(x)s),"
-                     "TMP_CLS__ = [TMP_CLS__,'-sparse']; end;" % dict(
-                         x=varname))
-        res_type = mlabraw.get(self._session, "TMP_CLS__")
-        mlabraw.eval(self._session, "clear TMP_CLS__;")
-        # unlikely to need try/finally to ensure clear
-        return res_type
+        return self._var_types([varname])[0]
+
+    def _classify_code(self, target, x):
+        """The matlab(tm) code that assigns the class of `x` (with the
+        suffixes that ``mlabraw.call`` uses) to `target`."""
+        if self._transport == 'shm':
+            # numeric arrays get the '-large' suffix that ``mlabraw.call``
+            # uses (`x` can be an expression, hence the temp for whos)
+            large = (" elseif isnumeric(%(x)s) || islogical(%(x)s),"
+                     "TMP_SZ__ = %(x)s; TMP_W__ = whos('TMP_SZ__');"
+                     "if TMP_W__.bytes > %(n)d,"
+                     " %(t)s = [%(t)s,'-large'];"
+                     "end; clear TMP_SZ__ TMP_W__;")
+        else:
+            large = ""
+        return (("%(t)s = class(%(x)s); if issparse(%(x)s),"
+                 "%(t)s = [%(t)s,'-sparse'];" + large + " end;") %
+                dict(t=target, x=x, n=self._shm_threshold))
+
+    @_synchronized
+    def _var_types(self, varnames):
+        """Returns the classes of all of `varnames` (with the suffixes that
+        ``mlabraw.call`` uses), at the cost of two engine calls in all."""
+        try:
+            # (TMP_CLS__ exists even if classifying one of them fails)
+            self._eval("TMP_CLS__ = {};" + "".join([
+                self._classify_code("TMP_CLS__{%d}" % (i + 1), varname)
+                for i, varname in enumerate(varnames)]))
+            return mlabraw.get(self._session, "TMP_CLS__")
+        finally:
+            self._discard("TMP_CLS__")
+
+    @_synchronized
+    def _proxy_metadata(self, name):
+        """Returns a dict with the ``class``, ``size`` (a tuple) and
+        ``fieldnames`` of `name` and, for scalar structs, the ``fieldtypes``
+        (as for ``_var_types``, by fieldname), at the cost of two engine
+        calls in all."""
+        code = ("TMP_META__ = {class(%(x)s), size(%(x)s), {}, {}};"
+                "if isstruct(%(x)s) || isobject(%(x)s),"
+                " try, TMP_META__{3} = fieldnames(%(x)s)'; end;"
+                "end;"
+                "if isstruct(%(x)s) && numel(%(x)s) == 1,"
+                " for TMP_I__ = 1:numel(TMP_META__{3}),"
+                "  TMP_F__ = %(x)s.(TMP_META__{3}{TMP_I__}); %(classify)s"
+                " end; clear TMP_I__ TMP_F__;"
+                "end;") % dict(
+            x=name,
+            classify=self._classify_code("TMP_META__{4}{TMP_I__}", "TMP_F__"))
+        self._eval(code)
+        try:
+            klass, size, fieldnames, fieldtypes = mlabraw.get(self._session,
+                                                              "TMP_META__")
+        finally:
+            self._discard("TMP_META__")
+        return {'class': klass,
+                'size': tuple([int(d) for d in numpy.ravel(size)]),
+                'fieldnames': fieldnames,
+                'fieldtypes': dict(zip(fieldnames, fieldtypes))}
 
+    @_synchronized
     def _make_proxy(self, varname, parent=None, constructor=MlabObjectProxy):
         """Creates a proxy for a variable.
 
@@ -459,48 +1313,39 @@ class MlabWrap(object):
         """
         proxy_val_name = "PROXY_VAL%d__" % self._proxy_count
         self._proxy_count += 1
-        mlabraw.eval(self._session, "%s = %s;" % (proxy_val_name, varname))
+        self._eval("%s = %s;" % (proxy_val_name, varname))
         res = constructor(self, proxy_val_name, parent)
         self._proxies[proxy_val_name] = res
         return res
 
+    def _conversion_kwargs(self):
+        """The keyword args for ``mlabraw.get`` and ``mlabraw.call`` that
+        control the conversion of structs and cells (parts that can't be
+        converted are proxied)."""
+        return dict(struct_as=self._struct_as, leaf=self._make_proxy,
+                    max_depth=(-1 if self._cell_max_depth is None
+                               else self._cell_max_depth),
+                    max_size=(-1 if self._cell_max_size is None
+                              else self._cell_max_size))
+
+    @_synchronized
     def _get_cell(self, varname):
-        # XXX can currently only handle ``{}`` and 1D cells
-        mlabraw.eval(self._session,
-                     "TMP_SIZE_INFO__ = \
-                     [all(size(%(vn)s) == 0), \
-                      min(size(%(vn)s)) == 1 & ndims(%(vn)s) == 2, \
-                      max(size(%(vn)s))];" % {'vn': varname})
-        is_empty, is_rank1, cell_len = map(int,
-                                           self._get("TMP_SIZE_INFO__",
-                                                     remove=True).flat)
-        if is_empty:
-            return []
-        elif is_rank1:
-            cell_bits = (["TMP%i__" % (self.proxy_count + i)
-                          for i in range(cell_len)])
-            self._proxy_count += cell_len
-            mlabraw.eval(self._session, '[%s] = deal(%s{:});' %
-                                        (",".join(cell_bits), varname))
-            # !!! this recursive call means we have to take care with
-            # overwriting temps!!!
-            return self._get_values(cell_bits)
-        else:
-            raise MlabConversionError("Not a 1D cell array")
+        """Converts the cell array in the variable `varname` with a single
+        ``mlabraw.get`` (see ``_cell_max_depth``)."""
+        return mlabraw.get(self._session, varname, self._array_order,
+                           **self._conversion_kwargs())
 
     def _manually_convert(self, varname, vartype):
         if vartype == 'cell':
             return self._get_cell(varname)
 
+    @_synchronized
     def _get_values(self, varnames):
         if not varnames: raise ValueError("No varnames") #to prevent clear('')
-        res = []
-        for varname in varnames:
-            res.append(self._get(varname))
-        mlabraw.eval(self._session, "clear('%s');" % "','".join(
-            varnames)) #FIXME wrap try/finally?
-        return res
+        return self._get_many(varnames, remove=True)
 
+    @_synchronized
+    @_profiled("%s")
     def _do(self, cmd, *args, **kwargs):
         """Semi-raw execution of a matlab command.
 
@@ -523,116 +1368,476 @@ class MlabWrap(object):
         ``cast`` specifies which typecast should be applied to the result
         (e.g. `int`), it defaults to none.
 
+        ``order`` overrides ``_array_order`` for the results of this call.
+
+        ``lazy`` (default ``_lazy_results``) leaves the results in matlab:
+        those that would be converted are returned as ``MlabLazyResult``s,
+        which are only fetched when python needs their value and can be
+        passed on to further calls as they are (the others are proxied etc.
+        as usual). This saves copying large intermediate results back and
+        forth in chains of calls.
+
+        ``handle_out`` is called with the output of the command (by default
+        it is printed); with ``stream=True`` (see ``_stream_output``) it is
+        called with chunks of the output as they appear.
+
+        Shipping the arguments, the call itself and fetching (and clearing)
+        all convertible results are done by a single ``mlabraw.call``; only
+        results that need proxying cost extra round-trips.
+
         XXX: should we add ``parens`` parameter?
         """
         handle_out = kwargs.get('handle_out', _flush_write_stdout)
         #self._session = self._session or mlabraw.open()
         # HACK
         if self._autosync_dirs:
-            mlabraw.eval(self._session,
-                         "cd('%s');" % os.getcwd().replace("'", "''"))
+            self._sync_dirs()
+        if re.match(r'\s*(cd|chdir)\b', cmd):
+            # matlab goes elsewhere; python's cwd wins again on the next call
+            self._invalidate_dir_sync()
         nout = kwargs.get('nout', 1)
+        lazy = kwargs.get('lazy', self._lazy_results)
         #XXX what to do with matlab screen output
+        stream = kwargs.get('stream', self._stream_output)
         argnames = []
-        tempargs = []
+        argvalues = []
+        shm_args = []
+        diary = None
         try:
-            for count, arg in enumerate(args):
+            if stream:
+                diary = _DiaryTail(self, handle_out, self._stream_interval)
+            for arg in args:
                 if isinstance(arg, MlabObjectProxy):
                     argnames.append(arg._name)
+                elif self._transport == 'shm' and self._is_large(arg):
+                    # goes through a file; put beforehand and passed by name
+                    shm_args.append('SHM_ARG%d__' % len(shm_args))
+                    self._shm_put(shm_args[-1], arg)
+                    argnames.append(shm_args[-1])
                 else:
-                    nextName = 'arg%d__' % count
-                    argnames.append(nextName)
-                    tempargs.append(nextName)
                     # have to convert these by hand
                     ## try:
                     ##     arg = self._as_mlabable_type(arg)
                     ## except TypeError:
                     ##     raise TypeError("Illegal argument type (%s.:) for %d. argument" %
                     ##                     (type(arg), type(count)))
-                    mlabraw.put(self._session, argnames[-1], arg)
-
-            if args:
-                cmd = "%s(%s)%s" % (cmd, ", ".join(argnames),
-                                    ('', ';')[kwargs.get('show', 0)])
-                # got three cases for nout:
-            # 0 -> None, 1 -> val, >1 -> [val1, val2, ...]
-            if nout == 0:
-                handle_out(mlabraw.eval(self._session, cmd))
-                return
-                # deal with matlab-style multiple value return
-            resSL = ((["RES%d__" % i for i in range(nout)]))
-            handle_out(mlabraw.eval(self._session,
-                                    '[%s]=%s;' % (", ".join(resSL), cmd)))
-            res = self._get_values(resSL)
-
-            if nout == 1:
-                res = res[0]
-            else:
-                res = tuple(res)
-            if kwargs.has_key('cast'):
-                if nout == 0: raise TypeError("Can't cast: 0 nout")
-                return kwargs['cast'](res)
-            else:
-                return res
+                    argnames.append('arg%d__' % len(argvalues))
+                    argvalues.append(arg)
+            garbage, prologue = self._take_garbage()
+            try:
+                output, classes, values = mlabraw.call(
+                    self._session, cmd, argvalues, nout,
+                    argnames=(argnames if args else None),
+                    convert=(() if lazy else self._convertible_types()),
+                    clear_args=self._clear_call_args,
+                    order=kwargs.get('order', self._array_order),
+                    native=self._native_dtypes,
+                    maxbytes=(self._shm_threshold if self._transport == 'shm'
+                              else -1),
+                    prologue=prologue,
+                    **self._conversion_kwargs())
+            except:
+                self._return_garbage(garbage)
+                raise
+        finally:
+            if diary is not None:
+                diary.stop()
+            self._discard(*shm_args)
+        if diary is None:
+            handle_out(output)
+        # got three cases for nout:
+        # 0 -> None, 1 -> val, >1 -> [val1, val2, ...]
+        if nout == 0:
+            return
+        # deal with matlab-style multiple value return
+        res = []
+        leftovers = []
+        try:
+            for i, (vartype, var) in enumerate(zip(classes, values)):
+                if var is None:
+                    leftovers.append("RES%d__" % i)
+                    if lazy and (vartype in self._convertible_types() or
+                                 vartype.endswith('-large')):
+                        var = self._make_proxy(leftovers[-1],
+                                               constructor=MlabLazyResult)
+                    else:
+                        var = self._convert_or_proxy(leftovers[-1], vartype)
+                else:
+                    var = self._postprocess_value(var)
+                res.append(var)
+        finally:
+            self._discard(*leftovers)
+        if nout == 1:
+            res = res[0]
+        else:
+            res = tuple(res)
+        if 'cast' in kwargs:
+            return kwargs['cast'](res)
+        else:
+            return res
+
+    def _batch(self, handle_out=_flush_write_stdout):
+        """Returns a ``MlabBatch``, to record calls that are then run as a
+        single script, fetching the results in one go::
+
+          with mlab._batch() as b:
+              m = b.mean(b.abs(b.fft(x)))
+          m._value()
+
+        The output of the script is passed to `handle_out` (see ``_do``).
+        """
+        return MlabBatch(self, handle_out)
+
+    @_synchronized
+    @_profiled("batch")
+    def _run_batch(self, script, values, fetch, clear,
+                   handle_out=_flush_write_stdout):
+        """Runs the matlab `script` of a ``MlabBatch``, with the python
+        `values` in the cell ``TMP_BATCH_ARGS__``, passing its output to
+        `handle_out`; returns the values of the variables `fetch` and clears
+        them and those in `clear`. Costs three engine calls (one put, one
+        evaluation and one get), plus the fetching of what mlabraw can't
+        convert (which is proxied etc. as for ``_get``)."""
+        if self._autosync_dirs:
+            self._sync_dirs()
+        if values:
+            self._set('TMP_BATCH_ARGS__', values)
+        convert = self._convertible_types()
+        if self._cell_max_depth is not None or self._cell_max_size is not None:
+            # (fetched on their own, so that the limits aren't applied to the
+            # cell all the results come in)
+            convert = tuple([t for t in convert if t not in ('cell', 'struct')])
+        code = ["TMP_BCONV__ = {%s}; try, " % ",".join(
+                    ["'%s'" % t for t in convert]),
+                script,
+                "TMP_BCLS__ = cell(1,%d); TMP_BVAL__ = TMP_BCLS__; " %
+                len(fetch)]
+        for i, name in enumerate(fetch):
+            code.append(self._classify_code("TMP_BCLS__{%d}" % (i + 1), name))
+            code.append("if any(strcmp(TMP_BCLS__{%(i)d},TMP_BCONV__)),"
+                        " TMP_BVAL__{%(i)d} = %(x)s; clear %(x)s; end; " %
+                        dict(i=i + 1, x=name))
+        code.append("TMP_BATCH__ = {0,TMP_BCLS__,TMP_BVAL__}; "
+                    "catch, TMP_BATCH__ = {1,lasterr}; end; "
+                    "clear TMP_BATCH_ARGS__ TMP_BCONV__ TMP_BCLS__ TMP_BVAL__")
+        code.extend([" " + name for name in clear])
+        code.append(";")
+        handle_out(self._eval("".join(code)))
+        kwargs = self._conversion_kwargs()
+        kwargs.update(max_depth=-1, max_size=-1)
+        try:
+            out = mlabraw.get(self._session, 'TMP_BATCH__', self._array_order,
+                              **kwargs)
         finally:
-            if len(tempargs) and self._clear_call_args:
-                mlabraw.eval(self._session, "clear('%s');" %
-                                            "','".join(tempargs))
+            self._discard('TMP_BATCH__')
+        if numpy.ravel(out[0])[0]:
+            self._discard(*fetch)
+            raise mlabraw.error(out[1])
+        res = []
+        leftovers = []
+        try:
+            for name, vartype, var in zip(fetch, out[1], out[2]):
+                if vartype in convert:
+                    var = self._postprocess_value(var)
+                else:
+                    leftovers.append(name)
+                    var = self._convert_or_proxy(name, vartype)
+                res.append(var)
+        finally:
+            self._discard(*leftovers)
+        return res
+
+    def _sync_dirs(self):
+        """Makes matlab ``cd`` to python's working directory, unless it was
+        already told to go there and nothing has changed since."""
+        cwd = os.getcwd()
+        if cwd != self._synced_dir:
+            self._eval("cd('%s');" % cwd.replace("'", "''"))
+            self._synced_dir = cwd
+            self._dir_syncs += 1
+
+    def _invalidate_dir_sync(self):
+        """Forces a ``cd`` before the next call (for when matlab's working
+        directory may have been changed from the matlab side)."""
+        self._synced_dir = None
 
     # this is really raw, no conversion of [[]] -> [], whatever
-    def _get(self, name, remove=False):
+    @_synchronized
+    @_profiled("_get(%s)")
+    def _get(self, name, remove=False, order=None, vartype=None):
         r"""Directly access a variable in matlab space.
 
+        ``order`` overrides ``_array_order`` for this variable; ``vartype``
+        saves looking up its class if that is already known (as returned by
+        ``_var_types``).
+
         This should normally not be used by user code."""
         # FIXME should this really be needed in normal operation?
         if name in self._proxies: return self._proxies[name]
-        varname = name
-        vartype = self._var_type(varname)
-        if vartype in self._mlabraw_can_convert:
-            var = mlabraw.get(self._session, varname)
-            if isinstance(var, ndarray):
-                if self._flatten_row_vecs and numpy.shape(var)[0] == 1:
-                    var.shape = var.shape[1:2]
-                elif self._flatten_col_vecs and numpy.shape(var)[1] == 1:
-                    var.shape = var.shape[0:1]
-                if self._array_cast:
-                    var = self._array_cast(var)
-        else:
-            var = None
-            if self._dont_proxy.get(vartype):
-                # manual conversions may fail (e.g. for multidimensional
-                # cell arrays), in that case just fall back on proxying.
-                try:
-                    var = self._manually_convert(varname, vartype)
-                except MlabConversionError:
-                    pass
-            if var is None:
-                # we can't convert this to a python object, so we just
-                # create a proxy, and don't delete the real matlab
-                # reference until the proxy is garbage collected
-                var = self._make_proxy(varname)
+        var = self._fetch(name, order, vartype)
         if remove:
-            mlabraw.eval(self._session, "clear('%s');" % varname)
+            self._discard(name)
+        return var
+
+    @_synchronized
+    def _fetch(self, varname, order=None, vartype=None):
+        """The value of the matlab variable `varname`, converted (or
+        proxied) as for ``_get``, but even if it's that of a proxy."""
+        if vartype is None:
+            vartype = self._var_type(varname)
+        if vartype in self._convertible_types():
+            return self._postprocess_value(mlabraw.get(
+                self._session, varname, order or self._array_order,
+                **self._conversion_kwargs()))
+        return self._convert_or_proxy(varname, vartype)
+
+    def _postprocess_value(self, var):
+        """Applies the array flattening and casting options to `var`."""
+        if isinstance(var, ndarray):
+            if self._flatten_row_vecs and numpy.shape(var)[0] == 1:
+                var.shape = var.shape[1:2]
+            elif self._flatten_col_vecs and numpy.shape(var)[1] == 1:
+                var.shape = var.shape[0:1]
+            if self._array_cast:
+                var = self._array_cast(var)
         return var
 
+    def _convert_or_proxy(self, varname, vartype):
+        """Handles a variable of a type that mlabraw can't convert."""
+        if vartype.endswith('-large'):
+            vartype = vartype[:-len('-large')]
+            if vartype in self._convertible_types():
+                return self._postprocess_value(self._shm_get(varname, vartype))
+        var = None
+        if self._dont_proxy.get(vartype):
+            # manual conversions may fail (e.g. for multidimensional
+            # cell arrays), in that case just fall back on proxying.
+            try:
+                var = self._manually_convert(varname, vartype)
+            except MlabConversionError:
+                pass
+        if var is None:
+            # we can't convert this to a python object, so we just
+            # create a proxy, and don't delete the real matlab
+            # reference until the proxy is garbage collected
+            var = self._make_proxy(varname)
+        return var
+
+    @_synchronized
+    @_profiled("_set(%s)")
     def _set(self, name, value):
         r"""Directly set a variable `name` in matlab space to `value`.
 
         This should normally not be used in user code."""
         if isinstance(value, MlabObjectProxy):
-            mlabraw.eval(self._session, "%s = %s;" % (name, value._name))
+            self._eval("%s = %s;" % (name, value._name))
+        elif self._transport == 'shm' and self._is_large(value):
+            self._shm_put(name, value)
         else:
         ##             mlabraw.put(self._session, name, self._as_mlabable_type(value))
-            mlabraw.put(self._session, name, value)
+            self._claim(name)
+            mlabraw.put(self._session, name, value, self._native_dtypes)
+
+    @_synchronized
+    @_profiled("_set_many")
+    def _set_many(self, variables):
+        r"""Like ``_set`` for all of `variables` (a dict or a sequence of
+        (name, value) pairs), but in two engine calls however many there are
+        (a single ``mlabraw.put_many``; proxies take one more evaluation and,
+        with the 'shm' transport, large arrays their own)."""
+        if isinstance(variables, dict):
+            variables = variables.items()
+        plain = []
+        assignments = []
+        for name, value in variables:
+            if isinstance(value, MlabObjectProxy):
+                assignments.append("%s = %s;" % (name, value._name))
+            elif self._transport == 'shm' and self._is_large(value):
+                self._shm_put(name, value)
+            else:
+                self._claim(name)
+                plain.append((name, value))
+        if plain:
+            mlabraw.put_many(self._session, plain, self._native_dtypes)
+        if assignments:
+            self._eval("".join(assignments))
+
+    @_synchronized
+    @_profiled("_get_many")
+    def _get_many(self, names, remove=False, order=None):
+        r"""Like ``_get`` for all of `names`, returning the list of their
+        values, but in a few engine calls however many there are: all are
+        classified together and the convertible ones fetched with a single
+        ``mlabraw.get_many`` (the others are proxied etc. as usual)."""
+        names = list(names)
+        res = [self._proxies.get(name) for name in names]
+        todo = [i for i, name in enumerate(names)
+                if name not in self._proxies]
+        if todo:
+            vartypes = dict(zip(todo, self._var_types([names[i]
+                                                       for i in todo])))
+            convertible = [i for i in todo
+                           if vartypes[i] in self._convertible_types()]
+            values = mlabraw.get_many(
+                self._session, [names[i] for i in convertible],
+                order or self._array_order, **self._conversion_kwargs())
+            for i, var in zip(convertible, values):
+                res[i] = self._postprocess_value(var)
+            for i in todo:
+                if i not in convertible:
+                    res[i] = self._convert_or_proxy(names[i], vartypes[i])
+            if remove:
+                self._discard(*[names[i] for i in todo])
+        return res
 
-    def _make_mlab_command(self, name, nout, doc=None):
-        def mlab_command(*args, **kwargs):
-            if 'nout' not in kwargs:
-                kwargs['nout'] = nout
-            return self._do(name, *args, **kwargs)
+    def _is_large(self, value):
+        """Whether `value` should be sent via the 'shm' transport."""
+        return (isinstance(value, ndarray) and value.dtype.kind in 'biufc'
+                and value.nbytes > self._shm_threshold)
 
-        mlab_command.__doc__ = "\n" + doc
-        return mlab_command
+    def _shm_path(self):
+        self._shm_count += 1
+        return os.path.join(self._shm_dir, "mlabwrap-%d-%d-%d.dat" % (
+            os.getpid(), id(self), self._shm_count))
+
+    def _remove_shm_file(self, path):
+        try:
+            os.remove(path)
+        except OSError: # still mapped (windows)
+            self._shm_leftovers.append(path)
+
+    def _shm_put(self, name, value):
+        """Sets `name` to the array `value` via a file that matlab maps."""
+        dtype = value.real.dtype
+        if not self._native_dtypes or dtype.name not in _SHM_TYPES.values():
+            dtype = numpy.dtype('float64')
+        mclass = dict((v, k) for (k, v) in _SHM_TYPES.items())[dtype.name]
+        shape = value.shape
+        if len(shape) < 2:
+            shape = (shape + (1, 1))[:2]
+        if numpy.iscomplexobj(value):
+            parts = [('re', value.real), ('im', value.imag)]
+            expr = "complex(TMP_MM__.Data.re,TMP_MM__.Data.im)"
+        else:
+            parts = [('re', value)]
+            expr = "TMP_MM__.Data.re"
+        if mclass == 'logical': # memmapfile has no logical format
+            mclass, expr = 'uint8', "logical(%s)" % expr
+        path = self._shm_path()
+        try:
+            f = open(path, 'wb')
+            try:
+                for _, part in parts:
+                    # the transpose of a fortran array is written in
+                    # matlab's order without further copying
+                    numpy.asfortranarray(part, dtype).T.tofile(f)
+            finally:
+                f.close()
+            self._eval("TMP_MM__ = memmapfile('%s','Format',{%s}); %s = %s;"
+                       "clear TMP_MM__;" % (
+                           path.replace("'", "''"),
+                           ";".join(["'%s',[%s],'%s'" % (
+                               mclass, " ".join(map(str, shape)), field)
+                               for field, _ in parts]),
+                           name, expr))
+        finally:
+            self._remove_shm_file(path)
+
+    def _shm_get(self, varname, vartype):
+        """Returns the numeric matlab variable `varname` (of type `vartype`)
+        as a memmap of a file matlab writes it to (or, for complex arrays, as
+        an array assembled from such a file)."""
+        path = self._shm_path()
+        x = varname
+        if vartype == 'logical':
+            x = 'uint8(%s)' % x
+        self._eval("TMP_FID__ = fopen('%(path)s','w');"
+                   "fwrite(TMP_FID__,real(%(x)s),'%(cls)s');"
+                   "if ~isreal(%(x)s), fwrite(TMP_FID__,imag(%(x)s),'%(cls)s'); end;"
+                   "fclose(TMP_FID__); clear TMP_FID__;"
+                   "TMP_SIZE_INFO__ = [~isreal(%(x)s), size(%(x)s)];" % dict(
+                       path=path.replace("'", "''"), x=x,
+                       cls=('uint8' if vartype == 'logical' else vartype)))
+        try:
+            info = [int(i) for i in
+                    self._get('TMP_SIZE_INFO__', remove=True,
+                              vartype='double').flat]
+            is_complex, shape = info[0], tuple(info[1:])
+            dtype = _SHM_TYPES[vartype]
+            if is_complex:
+                parts = numpy.memmap(path, dtype, 'r', shape=shape + (2,),
+                                     order='F')
+                var = numpy.empty(shape, numpy.result_type(dtype, 'F'), 'F')
+                var.real, var.imag = parts[..., 0], parts[..., 1]
+                del parts
+            else:
+                var = numpy.memmap(path, dtype, 'c', shape=shape, order='F')
+        finally:
+            self._remove_shm_file(path)
+        return var
+
+    def _make_mlab_command(self, name, nout, doc=None):
+        """Returns a ``MlabCommand`` calling `name` with `nout` outputs by
+        default; without `doc` the docstring is fetched when first needed."""
+        return MlabCommand(self, name, nout, doc)
+
+    def _metadata_key(self, name, path=None):
+        """Returns the metadata cache key and stamp of the function `name`
+        (`path` is what ``which`` says about it, asked if not given); the
+        stamp is None for things that shouldn't be cached (variables and
+        names matlab can't find)."""
+        if self._matlab_version is None:
+            self._matlab_version = self._do("version")
+        if path is None:
+            path = self._do("which('%s')" % name)
+        if not isinstance(path, basestring) or path in ('', 'variable'):
+            stamp = None
+        else:
+            try:
+                mtime = os.path.getmtime(path)
+            except (OSError, TypeError): # builtins, '<name> is a java method'
+                mtime = None
+            stamp = (path, mtime)
+        return (self._matlab_version, name), stamp
+
+    @_synchronized
+    def _function_info(self, name):
+        """Returns the metadata cache key and stamp of the function `name`
+        (see ``_metadata_key``), its number of outputs (None if ``nargout``
+        fails on it) and what ``exist`` says about it (if ``nargout``
+        failed), at the cost of two engine calls in all."""
+        self._eval("TMP_FN__ = {which('%(n)s'), [], 0, %(v)s};"
+                   "try, TMP_FN__{2} = nargout('%(n)s');"
+                   " catch, TMP_FN__{3} = exist('%(n)s'); end;" % dict(
+                       n=name,
+                       v="[]" if self._matlab_version else "version"))
+        try:
+            path, nout, typ, version = mlabraw.get(self._session, "TMP_FN__")
+        finally:
+            self._discard("TMP_FN__")
+        if not self._matlab_version:
+            self._matlab_version = version
+        key, stamp = self._metadata_key(name, path)
+        if numpy.size(nout):
+            nout = int(numpy.ravel(nout)[0])
+        else:
+            nout = None
+        return key, stamp, nout, int(numpy.ravel(typ)[0])
+
+    def _command_doc(self, name):
+        """Returns the help text of `name` (from the metadata cache if
+        possible)."""
+        if name in self._metadata_keys:
+            key, stamp = self._metadata_keys[name]
+        else:
+            key, stamp = self._metadata_key(name)
+        entry = stamp and self._metadata.lookup(key, stamp)
+        if entry and entry.get('doc') is not None:
+            return entry['doc']
+        doc = self._do("help('%s')" % name)
+        if stamp:
+            self._metadata.store(key, stamp, doc=doc)
+        return doc
 
     # XXX this method needs some refactoring, but only after it is clear how
     # things should be done (e.g. what should be extracted from docstrings and
@@ -649,27 +1854,129 @@ class MlabWrap(object):
             name = attr[:-1]
         else:
             name = attr
-        try:
-            nout = self._do("nargout('%s')" % name)
-        except mlabraw.error as msg:
-            typ = numpy.ravel(self._do("exist('%s')" % name))[0]
+        # ``which``, ``nargout`` and (if that fails) ``exist`` are asked in
+        # one go; the docstring is only fetched on demand (and then kept in
+        # the metadata cache)
+        key, stamp, nout, typ = self._function_info(name)
+        if nout is None:
             if typ == 0: # doesn't exist
                 raise AttributeError("No such matlab object: %s" % name)
-            else:
-                warnings.warn(
-                    "Couldn't ascertain number of output args"
-                    "for '%s', assuming 1." % name)
-                nout = 1
-        doc = self._do("help('%s')" % name)
+            warnings.warn(
+                "Couldn't ascertain number of output args"
+                "for '%s', assuming 1." % name)
+            nout = 1
+        if stamp:
+            self._metadata.store(key, stamp, nout=nout)
+            self._metadata_keys[name] = key, stamp
         # play it safe only return 1st if nout >= 1
         # XXX are all ``nout>1``s also useable as ``nout==1``s?
         nout = nout and 1
-        mlab_command = self._make_mlab_command(name, nout, doc)
+        mlab_command = self._make_mlab_command(name, nout)
         #!!! attr, *not* name, because we might have python keyword name!
         setattr(self, attr, mlab_command)
         return mlab_command
 
 
+class MlabPool(object):
+    """A pool of `n` independent matlab(tm) sessions, to spread independent
+    calls across several engines.
+
+    The sessions are started in parallel; all keyword arguments are passed on
+    to ``MlabWrap``. Use ``session`` to get exclusive use of one of them and
+    ``map`` to distribute calls across all of them:
+
+    >>> pool = MlabPool(4)
+    >>> with pool.session() as mlab:
+    ...     mlab.sum([1,2,3])
+    array([[ 6.]])
+    >>> pool.map('sum', [[1,2,3], [4,5,6]])
+    [array([[ 6.]]), array([[ 15.]])]
+    """
+
+    def __init__(self, n, **kwargs):
+        if n < 1:
+            raise ValueError("Need at least one session")
+        sessions = [None] * n
+        errors = []
+        def start(i):
+            try:
+                sessions[i] = MlabWrap(**kwargs)
+            except Exception:
+                errors.append(sys.exc_info())
+        # startup takes seconds per engine, so do it concurrently
+        threads = [threading.Thread(target=start, args=(i,)) for i in range(n)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self._sessions = [mlab for mlab in sessions if mlab is not None]
+        if errors:
+            self.close()
+            _reraise(*errors[0])
+        self._idle = Queue.Queue()
+        for mlab in self._sessions:
+            self._idle.put(mlab)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    @contextlib.contextmanager
+    def session(self):
+        """Returns a context manager that hands out an idle session (waiting
+        for one to become available if necessary) and takes it back on exit.
+        """
+        mlab = self._idle.get()
+        try:
+            yield mlab
+        finally:
+            self._idle.put(mlab)
+
+    def map(self, fname, iterable, nout=1, **kwargs):
+        """Calls the matlab(tm) function `fname` once for every item of
+        `iterable`, spreading the calls over the sessions of the pool, and
+        returns the list of results (in order).
+
+        Tuples are passed as argument lists, anything else as single argument.
+        `nout` and all other keyword arguments are passed on to ``_do``. If
+        any call fails, the first error is re-raised once all calls are done.
+        """
+        jobs = list(enumerate(iterable))
+        results = [None] * len(jobs)
+        errors = []
+        todo = Queue.Queue()
+        for job in jobs:
+            todo.put(job)
+        kwargs['nout'] = nout
+        def work():
+            with self.session() as mlab:
+                while True:
+                    try:
+                        i, args = todo.get_nowait()
+                    except Queue.Empty:
+                        return
+                    if not isinstance(args, tuple):
+                        args = (args,)
+                    try:
+                        results[i] = mlab._do(fname, *args, **kwargs)
+                    except Exception:
+                        errors.append((i, sys.exc_info()))
+        threads = [threading.Thread(target=work)
+                   for _ in range(min(len(self), len(jobs)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            _, (typ, value, tb) = min(errors)
+            _reraise(typ, value, tb)
+        return results
+
+    def close(self):
+        """Closes all sessions."""
+        for mlab in self._sessions:
+            mlab.close()
+
+
 class MlabInstance(object):
 
     @classmethod
@@ -0,0 +1,132 @@
+##############################################################################
+################ asyncmlab: an asyncio front-end for mlabwrap ################
+##############################################################################
+##
+## o keywords: matlab wrapper, asyncio
+## o license: MIT
+
+"""
+asyncmlab
+=========
+
+An asyncio front-end for ``MlabWrap`` (it needs asyncio, i.e. python 3 or
+the ``trollius`` and ``futures`` backports, hence it isn't imported by
+``mlabwrap`` itself):
+
+>>> from mlabwrap.asyncmlab import AsyncMlabWrap
+>>> amlab = AsyncMlabWrap()
+>>> res = await amlab.sort(numpy.array([3,1,2]))
+
+Every attribute call (and ``_do``, ``_get`` and ``_set``) returns an awaitable
+asyncio future right away; the work is queued for the session's own worker
+thread (a single-worker executor) and done in order. As mlabraw releases the
+GIL while matlab(tm) is busy, the event loop keeps running meanwhile and
+several sessions work in parallel:
+
+>>> a, b = AsyncMlabWrap(), AsyncMlabWrap()
+>>> x, y = await asyncio.gather(a.svd(m1), b.svd(m2))
+
+Cancelling a future whose request hasn't started yet drops the request. A
+running request can be cancelled, too: its future is cancelled at once, so
+nobody waits for it any longer, and its result is thrown away. The engine
+interface has no means to stop matlab(tm) itself, though, so the session
+stays busy until the command is finished (and later requests wait for that).
+``cancel_pending`` cancels everything that is still queued, ``interrupt``
+that and the running request.
+"""
+
+try:
+    import asyncio
+except ImportError: # python 2 (with the trollius backport)
+    import trollius as asyncio
+import concurrent.futures
+import threading
+
+from mlabwrap import MlabWrap
+
+
+class AsyncMlabWrap(object):
+    """Wraps a ``MlabWrap`` (a new one, created with `kwargs`, unless `mlab`
+    is given), so that calls return asyncio futures instead of blocking.
+    Use it from the thread that runs the event loop."""
+
+    def __init__(self, mlab=None, **kwargs):
+        if mlab is None:
+            mlab = MlabWrap(**kwargs)
+        self._mlab = mlab
+        # a single worker, so the executor's queue is the session's request
+        # queue
+        self._executor = concurrent.futures.ThreadPoolExecutor(1)
+        self._lock = threading.Lock()
+        self._pending = {}
+        # The requests that aren't done yet: {executor future: the asyncio
+        # future returned for it}.
+
+    def _forget(self, work):
+        with self._lock:
+            self._pending.pop(work, None)
+
+    def _submit(self, fn, *args, **kwargs):
+        """Queues ``fn(*args, **kwargs)``; returns an asyncio future for its
+        result."""
+        work = self._executor.submit(fn, *args, **kwargs)
+        # cancelling the returned future cancels `work`, which is a no-op
+        # once it is running (the result is then thrown away)
+        future = asyncio.wrap_future(work)
+        with self._lock:
+            if not work.done():
+                self._pending[work] = future
+        work.add_done_callback(self._forget)
+        return future
+
+    def _do(self, cmd, *args, **kwargs):
+        """See ``MlabWrap._do``."""
+        return self._submit(self._mlab._do, cmd, *args, **kwargs)
+
+    def _get(self, name, remove=False, order=None):
+        """See ``MlabWrap._get``."""
+        return self._submit(self._mlab._get, name, remove, order)
+
+    def _set(self, name, value):
+        """See ``MlabWrap._set``."""
+        return self._submit(self._mlab._set, name, value)
+
+    def cancel_pending(self):
+        """Cancels all queued requests that haven't started yet; returns how
+        many there were."""
+        with self._lock:
+            pending = list(self._pending)
+        return sum([work.cancel() for work in pending])
+
+    def interrupt(self):
+        """Cancels the queued requests and the running one (see the module
+        docs); returns how many requests were cancelled."""
+        n = self.cancel_pending()
+        with self._lock:
+            running = [future for work, future in self._pending.items()
+                       if work.running()]
+        return n + sum([future.cancel() for future in running])
+
+    def shutdown(self, wait=True):
+        """Stops taking requests; the worker finishes the queued ones and
+        exits (waits for that if `wait`). The session stays open."""
+        self._executor.shutdown(wait)
+
+    def close(self):
+        """Cancels the queued requests and closes the session once the
+        running one (if any) is done; returns a future for that."""
+        self.cancel_pending()
+        closed = self._submit(self._mlab.close)
+        self.shutdown(wait=False)
+        return closed
+
+    def __getattr__(self, attr):
+        """Returns an asynchronous version of ``getattr(mlab, attr)``."""
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        def call(*args, **kwargs):
+            # looking up the command may take engine calls, too
+            return self._submit(
+                lambda: getattr(self._mlab, attr)(*args, **kwargs))
+        call.__name__ = attr
+        return call
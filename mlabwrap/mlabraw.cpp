@@ -119,6 +119,7 @@
 #include <Python.h> // !!! must come before standard includes
 #include <bytesobject.h> // byte string
 #include <unicodeobject.h> // unicode
+#include <pythread.h> // session locks
 
 #if PY_MAJOR_VERSION >= 3
     #define PY3K
@@ -130,6 +131,7 @@
 
 #include <stdarg.h>
 #include <cstdio>
+#include <cctype>
 #define MLABRAW_VERSION "1.0.1"
 // We're not building a MEX file, we're building a standalone app.
 #undef MATLAB_MEX_FILE
@@ -142,6 +144,8 @@
 #define vsnprintf _vsnprintf
 #endif
 
+#else
+#include <sys/time.h> // gettimeofday
 #endif
 
 #include <numpy/arrayobject.h>
@@ -156,27 +160,280 @@
 #define mwSize int
 #define mwIndex int
 #endif
+// matrix.h defines MX_HAS_INTERLEAVED_COMPLEX if we're built against the
+// interleaved complex API (R2018a+, see setup.py); complex data is then stored
+// like numpy's (pairs of real and imaginary part) and there are no separate
+// imaginary planes (mxGetPi/mxGetImagData).
+#if defined(MX_HAS_INTERLEAVED_COMPLEX) && MX_HAS_INTERLEAVED_COMPLEX
+#define MLABRAW_INTERLEAVED_COMPLEX 1
+#else
+#define MLABRAW_INTERLEAVED_COMPLEX 0
+#endif
 
 #include<iostream>
+#include<string>
+#include<vector>
+
+#include "mlabraw_kernels.h"
 
 #ifndef max
 #define max(x,y) ((x) > (y) ? (x) : (y))
 #define min(x,y) ((x) < (y) ? (x) : (y))
 #endif
 
-static inline mxArray* _getMatlabVar(PyObject *lHandle, const char *lName){
+// Counters of a session's engine round-trips, of the data transferred and of
+// the time (in seconds) spent waiting for the engine and converting (see
+// `stats`). Only updated with the GIL held.
+struct MlabStats {
+  unsigned long evals, gets, puts;
+  PY_LONG_LONG bytesPut, bytesGot;
+  double evalSeconds, getSeconds, putSeconds;
+  double py2mxSeconds, mx2pySeconds;
+  MlabStats() { reset(); }
+  void reset() {
+    evals = gets = puts = 0;
+    bytesPut = bytesGot = 0;
+    evalSeconds = getSeconds = putSeconds = 0;
+    py2mxSeconds = mx2pySeconds = 0;
+  }
+};
+
+// A MATLAB(TM) engine session, as wrapped by the handles `open` returns.
+//
+// All (potentially long) engine calls are made with the GIL released, so
+// `lock` serializes the use of a session by several threads. It is held for
+// the whole of each operation (which often takes several engine calls) and is
+// reentrant for the thread holding it, as python code (e.g. a proxy's
+// ``__del__``) can run in the middle of an operation.
+struct MlabSession {
+  Engine *ep;                   // NULL once closed
+  PyThread_type_lock lock;
+  long owner;                   // the thread holding `lock`, if depth > 0
+  int depth;
+  std::vector<char> output;     // receives the engine's output
+  size_t outputSize;            // see `set_output_size`
+  size_t outputUsed;            // how much of `output` the last command used
+  MlabStats stats;
+};
+
+// The default size of a session's output buffer; output beyond that is lost
+// (with a warning).
+const size_t DEFAULT_OUTPUT_SIZE = 1 << 20;
+
+// Holds the lock of a session during its lifetime; the GIL is released while
+// waiting for the lock. (`owner` and `depth` are only touched with the GIL
+// held.)
+class SessionLock {
+public:
+  explicit SessionLock(MlabSession *pSession) : mSession(pSession) {
+    long lMe = PyThread_get_thread_ident();
+    if (mSession->depth && mSession->owner == lMe) {
+      mSession->depth++;
+      return;
+    }
+    if (! PyThread_acquire_lock(mSession->lock, NOWAIT_LOCK)) {
+      Py_BEGIN_ALLOW_THREADS
+      PyThread_acquire_lock(mSession->lock, WAIT_LOCK);
+      Py_END_ALLOW_THREADS
+    }
+    mSession->owner = lMe;
+    mSession->depth = 1;
+  }
+  ~SessionLock() {
+    if (--mSession->depth == 0) PyThread_release_lock(mSession->lock);
+  }
+private:
+  MlabSession *mSession;
+  SessionLock(const SessionLock &);
+  SessionLock &operator=(const SessionLock &);
+};
+
+static void _destroySession(PyObject *pCapsule)
+{
+  MlabSession *lSession = (MlabSession *)PyCapsule_GetPointer(pCapsule, NULL);
+  if (lSession->ep) engClose(lSession->ep);
+  PyThread_free_lock(lSession->lock);
+  delete lSession;
+}
+
+static PyObject *mlabraw_error;
+
+// Returns the session for the handle `pHandle` (NULL and an exception if it
+// isn't one or the session has been closed).
+static MlabSession *_getSession(PyObject *pHandle)
+{
+  MlabSession *lSession;
+  if (! PyCapsule_CheckExact(pHandle) ||
+      PyCapsule_GetDestructor(pHandle) != _destroySession) {
+    PyErr_SetString(PyExc_TypeError, "Invalid object passed as mlabraw session handle");
+    return NULL;
+  }
+  lSession = (MlabSession *)PyCapsule_GetPointer(pHandle, NULL);
+  if (lSession->ep == NULL) {
+    PyErr_SetString(mlabraw_error, "MATLAB(TM) session has been closed");
+    return NULL;
+  }
+  return lSession;
+}
+
+// Wall clock time in seconds (for the `stats`).
+static double _wallTime()
+{
+#ifdef WIN32
+  LARGE_INTEGER lFreq, lNow;
+  QueryPerformanceFrequency(&lFreq);
+  QueryPerformanceCounter(&lNow);
+  return (double)lNow.QuadPart / (double)lFreq.QuadPart;
+#else
+  struct timeval lNow;
+  gettimeofday(&lNow, NULL);
+  return lNow.tv_sec + 1e-6 * lNow.tv_usec;
+#endif
+}
+
+// Adds the time from its construction to its destruction to `pTotal`.
+class StopWatch {
+public:
+  explicit StopWatch(double &pTotal) : mTotal(pTotal), mStart(_wallTime()) {}
+  ~StopWatch() { mTotal += _wallTime() - mStart; }
+private:
+  double &mTotal;
+  double mStart;
+  StopWatch(const StopWatch &);
+  StopWatch &operator=(const StopWatch &);
+};
+
+// The size of the data of `pArray`, including that of its cells and fields
+// (for the `stats`).
+static PY_LONG_LONG _mxBytes(const mxArray *pArray)
+{
+  PY_LONG_LONG lBytes = 0;
+  if (pArray == NULL) return 0;
+  if (mxIsCell(pArray)) {
+    for (mwIndex i = 0; i != mxGetNumberOfElements(pArray); i++)
+      lBytes += _mxBytes(mxGetCell(pArray, i));
+    return lBytes;
+  }
+  if (mxIsStruct(pArray)) {
+    for (mwIndex i = 0; i != mxGetNumberOfElements(pArray); i++)
+      for (int j = 0; j != mxGetNumberOfFields(pArray); j++)
+        lBytes += _mxBytes(mxGetFieldByNumber(pArray, i, j));
+    return lBytes;
+  }
+  lBytes = (PY_LONG_LONG)mxGetElementSize(pArray) *
+    (mxIsSparse(pArray) ? mxGetNzmax(pArray) : mxGetNumberOfElements(pArray));
+#if ! MLABRAW_INTERLEAVED_COMPLEX
+  // (the element size is that of the real part only)
+  if (mxIsComplex(pArray)) lBytes *= 2;
+#endif
+  if (mxIsSparse(pArray)) {
+    lBytes += (PY_LONG_LONG)sizeof(mwIndex) *
+      (mxGetNzmax(pArray) + mxGetN(pArray) + 1);
+  }
+  return lBytes;
+}
+
+// The engine calls, with the GIL released (and counted in the session's
+// `stats`).
+static int _evalString(MlabSession *pSession, const char *pCmd)
+{
+  int lRetval;
+  double lStart = _wallTime();
+  Py_BEGIN_ALLOW_THREADS
+  lRetval = engEvalString(pSession->ep, pCmd);
+  Py_END_ALLOW_THREADS
+  pSession->stats.evals++;
+  pSession->stats.evalSeconds += _wallTime() - lStart;
+  return lRetval;
+}
+
+static inline mxArray* _getMatlabVar(MlabSession *pSession, const char *lName){
+  mxArray *lRetval;
+  double lStart = _wallTime();
+  Py_BEGIN_ALLOW_THREADS
 #ifdef _V6_5_OR_LATER
-  return engGetVariable((Engine *)PyCapsule_GetPointer(lHandle, NULL), lName);
+  lRetval = engGetVariable(pSession->ep, lName);
 #else
-  return engGetArray((Engine *)PyCapsule_GetPointer(lHandle, NULL), lName);
+  lRetval = engGetArray(pSession->ep, lName);
 #endif
+  Py_END_ALLOW_THREADS
+  pSession->stats.gets++;
+  pSession->stats.getSeconds += _wallTime() - lStart;
+  pSession->stats.bytesGot += _mxBytes(lRetval);
+  return lRetval;
 }
 
-// FIXME: functions declaration: move to .h
-static PyObject* mx2py( mxArray* lArray );
-static mxArray*  py2mx( PyObject* lSource );
+static inline int _putMatlabVar(MlabSession *pSession, const char *lName, mxArray *lArray){
+  int lRetval;
+  double lStart = _wallTime();
+  Py_BEGIN_ALLOW_THREADS
+// for matlab version >= 6.5 (FIXME UNTESTED)
+#ifdef _V6_5_OR_LATER
+  lRetval = engPutVariable(pSession->ep, lName, lArray);
+#else
+  mxSetName(lArray, lName);
+  lRetval = engPutArray(pSession->ep, lArray);
+#endif
+  Py_END_ALLOW_THREADS
+  pSession->stats.puts++;
+  pSession->stats.putSeconds += _wallTime() - lStart;
+  pSession->stats.bytesPut += _mxBytes(lArray);
+  return lRetval;
+}
 
-static PyObject *mlabraw_error;
+// options that control the conversion of mxArrays to python objects
+struct Mx2PyOptions {
+  bool fortranOrder;   // return numeric arrays in matlab's (fortran) order
+  bool structAsRecords; // return struct arrays as record arrays (rather
+                        // than as lists of dicts)
+  PyObject *leafHandler; // called with the matlab expression for parts of
+                         // cells and structs that can't be converted (or
+                         // exceed the limits below) to get a stand-in (e.g.
+                         // a proxy); if NULL, they are an error
+  int maxDepth;        // cells nested deeper aren't converted (-1: no limit)
+  int maxSize;         // cells with more elements aren't converted (-1: ditto)
+  mutable std::string path; // the matlab expression for what is converted
+  mutable int depth;        // how many cells and structs it is nested in
+  Mx2PyOptions() : fortranOrder(false), structAsRecords(false),
+                   leafHandler(NULL), maxDepth(-1), maxSize(-1), depth(0) {}
+};
+
+// Appends a matlab index expression for the current part to
+// ``pOpts.path`` (and increases the nesting depth) during its lifetime.
+class PathElement {
+public:
+  PathElement(const Mx2PyOptions &pOpts, const char *pFmt, mwIndex pIndex,
+              const char *pField = "")
+    : mOpts(pOpts), mLen(pOpts.path.size()) {
+    if (pOpts.leafHandler) {
+      char lBuf[64];
+      sprintf(lBuf, pFmt, (unsigned long)pIndex + 1);
+      pOpts.path += lBuf;
+      pOpts.path += pField;
+    }
+    pOpts.depth++;
+  }
+  ~PathElement() {
+    mOpts.path.resize(mLen);
+    mOpts.depth--;
+  }
+private:
+  const Mx2PyOptions &mOpts;
+  size_t mLen;
+  PathElement(const PathElement &);
+  PathElement &operator=(const PathElement &);
+};
+
+// options that control the conversion of python objects to mxArrays
+struct Py2MxOptions {
+  bool nativeTypes;    // keep the element type of numeric arrays (rather than
+                       // converting everything to double)
+  Py2MxOptions() : nativeTypes(false) {}
+};
+
+// FIXME: functions declaration: move to .h
+static PyObject* mx2py( mxArray* lArray, const Mx2PyOptions &pOpts );
+static mxArray*  py2mx( PyObject* lSource, const Py2MxOptions &pOpts );
 
 #define pyassert(x,y) if (! (x)) { _pyassert(y); goto error_return; }
 
@@ -185,15 +442,56 @@ static void _pyassert(const char *pStr)
   PyErr_SetString(PyExc_RuntimeError, pStr);
 }
 
-// XXX AFAIK there's no good portable way to *printf safely in C; this is a lame
-// attempt
-static inline bool my_snprintf(char *dst, size_t size, const char *fmt, ...)
+// Makes the engine write the output of the following commands to the
+// session's output buffer (which only needs clearing as far as the previous
+// output went).
+static void _captureOutput(MlabSession *pSession)
 {
-	va_list args;
-	va_start(args, fmt);
-	int n = vsnprintf(dst, size, fmt, args);
-	va_end(args);
-	return n >- 1 && static_cast<size_t>(n) < size;
+  std::vector<char> &lBuf = pSession->output;
+  if (lBuf.size() != pSession->outputSize + 1) {
+    // one more than we tell the engine, so the output is always terminated
+    lBuf.assign(pSession->outputSize + 1, '\0');
+  } else {
+    memset(&lBuf[0], 0, pSession->outputUsed + 1);
+  }
+  pSession->outputUsed = 0;
+  engOutputBuffer(pSession->ep, &lBuf[0], static_cast<int>(pSession->outputSize));
+}
+
+// Stops capturing and returns the output captured since `_captureOutput`
+// (warns if it filled the whole buffer, as the rest is lost; returns NULL if
+// that warning is turned into an exception).
+static const char *_capturedOutput(MlabSession *pSession)
+{
+  engOutputBuffer(pSession->ep, NULL, 0);
+  const char *lStart = &pSession->output[0];
+  const char *lEnd = (const char *)memchr(lStart, '\0', pSession->outputSize);
+  pSession->outputUsed = lEnd ? lEnd - lStart : pSession->outputSize;
+  if (lEnd == NULL &&
+      PyErr_WarnEx(PyExc_RuntimeWarning,
+                   "MATLAB(TM) output truncated (see mlabraw.set_output_size)",
+                   1) < 0)
+    return NULL;
+  return lStart;
+}
+
+static PyObject *_matlabOutput2py(const char *pStr)
+{
+  pStr += (strncmp(">> ", pStr, 3) == 0) ? 3 : 0; //FIXME
+#ifdef PY3K
+  return PyUnicode_DecodeFSDefault(pStr);
+#else
+  return (PyObject *)PyString_FromString(pStr);
+#endif
+}
+
+// Raises a `mlabraw.error` with the matlab output `pStr` as message.
+static void _setMatlabError(const char *pStr)
+{
+  PyObject *lMsg = _matlabOutput2py(pStr);
+  if (lMsg == NULL) return;
+  PyErr_SetObject(mlabraw_error, lMsg);
+  Py_DECREF(lMsg);
 }
 
 // FIXME: add string array support
@@ -223,315 +521,302 @@ static PyObject *mx2char(const mxArray *pArray)
 }
 
 
-static PyArrayObject *mx2numericDouble(const mxArray *pArray)
+// Maps matlab's numeric and logical classes to the corresponding numpy type
+// number (-1 if there is none).
+static int _mxClass2npy(mxClassID pClass)
 {
-  //current function returns PyArrayObject in c order currently
-  mwSize nd;
-  npy_intp  pydims[NPY_MAXDIMS];
-  PyArrayObject *lRetval = NULL,*t=NULL;
-  const double *lPR;
-  const double *lPI;
-  pyassert(PyArray_API,
-           "Unable to perform this function without NumPy installed");
+  switch (pClass) {
+  case mxLOGICAL_CLASS: return NPY_BOOL; // XXX assumes 1 byte mxLogicals
+  case mxINT8_CLASS:    return NPY_INT8;
+  case mxUINT8_CLASS:   return NPY_UINT8;
+  case mxINT16_CLASS:   return NPY_INT16;
+  case mxUINT16_CLASS:  return NPY_UINT16;
+  case mxINT32_CLASS:   return NPY_INT32;
+  case mxUINT32_CLASS:  return NPY_UINT32;
+  case mxINT64_CLASS:   return NPY_INT64;
+  case mxUINT64_CLASS:  return NPY_UINT64;
+  case mxSINGLE_CLASS:  return NPY_FLOAT32;
+  case mxDOUBLE_CLASS:  return NPY_FLOAT64;
+  default:              return -1;
+  }
+}
 
-  nd = mxGetNumberOfDimensions(pArray);
-  {
-    const mwSize *dims;
-    dims = mxGetDimensions(pArray);
-    for (mwSize i=0; i != nd; i++){
-        pydims[i] = static_cast<npy_intp>(dims[i]);
+// The inverse of `_mxClass2npy` (complex types map to the class of their
+// components); mxUNKNOWN_CLASS if there is no matching class.
+static mxClassID _npy2mxClass(const PyArray_Descr *pDescr)
+{
+  switch (pDescr->kind) {
+  case 'b':
+    return mxLOGICAL_CLASS;
+  case 'i':
+    switch (pDescr->elsize) {
+    case 1: return mxINT8_CLASS;
+    case 2: return mxINT16_CLASS;
+    case 4: return mxINT32_CLASS;
+    case 8: return mxINT64_CLASS;
     }
-  }
- //this function creates a fortran array
-  t = (PyArrayObject *)
-    PyArray_New(&PyArray_Type,static_cast<npy_intp>(nd), pydims,
-                mxIsComplex(pArray) ? PyArray_CDOUBLE : PyArray_DOUBLE,
-                NULL, // strides
-                NULL, // data
-                0,    //(ignored itemsize),
-                NPY_F_CONTIGUOUS, 
-                NULL); //  obj
-  if (t == NULL) return NULL;
-  
-  lPR  = mxGetPr(pArray);
-  if (mxIsComplex(pArray)) {
-    double *lDst = (double *)PyArray_DATA(t);
-    // AWMS unsigned int almost certainly can overflow on some platforms!
-    npy_intp numberOfElements = PyArray_SIZE(t);
-    lPI = mxGetPi(pArray);
-    for (unsigned int i = 0; i != numberOfElements; i++) {
-      *lDst++ = *lPR++;
-      *lDst++ = *lPI++;
+    break;
+  case 'u':
+    switch (pDescr->elsize) {
+    case 1: return mxUINT8_CLASS;
+    case 2: return mxUINT16_CLASS;
+    case 4: return mxUINT32_CLASS;
+    case 8: return mxUINT64_CLASS;
     }
-  }
-  else {
-    double *lDst = (double *)PyArray_DATA(t);
-    npy_intp numberOfElements = PyArray_SIZE(t);
-    for (unsigned int i = 0; i != numberOfElements; i++) {
-      *lDst++ = *lPR++;
+    break;
+  case 'f':
+    switch (pDescr->elsize) {
+    case 4: return mxSINGLE_CLASS;
+    case 8: return mxDOUBLE_CLASS;
+    }
+    break;
+  case 'c':
+    switch (pDescr->elsize) {
+    case 8: return mxSINGLE_CLASS;
+    case 16: return mxDOUBLE_CLASS;
     }
+    break;
   }
-  
-  lRetval = (PyArrayObject *)PyArray_FromArray(t,NULL,NPY_C_CONTIGUOUS|NPY_ALIGNED|NPY_WRITEABLE);
-  Py_DECREF(t);
-  
-  return lRetval;
-  error_return:
-  return NULL;
+  return mxUNKNOWN_CLASS;
 }
 
-static PyArrayObject *mx2numericSingle(const mxArray *pArray)
+// Fills in the dimensions of `pArray` as numpy dims; returns their number.
+static int _mxDims2py(const mxArray *pArray, npy_intp *pDims)
+{
+  mwSize nd = mxGetNumberOfDimensions(pArray);
+  const mwSize *dims = mxGetDimensions(pArray);
+  for (mwSize i=0; i != nd; i++){
+    pDims[i] = static_cast<npy_intp>(dims[i]);
+  }
+  return static_cast<int>(nd);
+}
+
+// Fills in shape and (byte) strides of `pArray` for the copy kernels; returns
+// the number of dimensions.
+static int _arrayLayout(const PyArrayObject *pArray, mlabraw_kernels::index_t *pShape,
+                        mlabraw_kernels::index_t *pStrides)
+{
+  int nd = PyArray_NDIM(pArray);
+  for (int i = 0; i != nd; i++) {
+    pShape[i] = PyArray_DIM(pArray, i);
+    pStrides[i] = PyArray_STRIDE(pArray, i);
+  }
+  return nd;
+}
+
+#if MLABRAW_INTERLEAVED_COMPLEX
+// The (interleaved) data of a complex double or single mxArray.
+static inline void *_mxGetComplexData(const mxArray *pArray)
+{
+  if (mxIsDouble(pArray)) return mxGetComplexDoubles(pArray);
+  return mxGetComplexSingles(pArray);
+}
+#endif
+
+// Copies the data of the numeric mxArray `pSrc` (elements of type T) into
+// the (already allocated) array `pDst`, whatever its memory layout.
+template <class T>
+static void _mx2array(const mxArray *pSrc, PyArrayObject *pDst)
+{
+  mlabraw_kernels::index_t lShape[NPY_MAXDIMS], lStrides[NPY_MAXDIMS];
+  int nd = _arrayLayout(pDst, lShape, lStrides);
+  if (mxIsComplex(pSrc))
+#if MLABRAW_INTERLEAVED_COMPLEX
+    mlabraw_kernels::scatterF<mlabraw_kernels::Complex<T>, mlabraw_kernels::Complex<T> >(
+      (const mlabraw_kernels::Complex<T> *)_mxGetComplexData(pSrc), nd, lShape, lStrides,
+      PyArray_BYTES(pDst));
+#else
+    mlabraw_kernels::scatterMergeF<T, T>((const T *)mxGetData(pSrc), (const T *)mxGetImagData(pSrc),
+                                         nd, lShape, lStrides, PyArray_BYTES(pDst));
+#endif
+  else
+    mlabraw_kernels::scatterF<T, T>((const T *)mxGetData(pSrc), nd, lShape, lStrides,
+                                    PyArray_BYTES(pDst));
+}
+
+// The numpy type number for the elements of the numeric or logical mxArray
+// `pArray` (-1 if there is none).
+static int _mxArray2npy(const mxArray *pArray)
+{
+  mxClassID lClass = mxGetClassID(pArray);
+  if (!mxIsComplex(pArray)) return _mxClass2npy(lClass);
+  return (lClass == mxDOUBLE_CLASS ? NPY_CDOUBLE :
+          lClass == mxSINGLE_CLASS ? NPY_CFLOAT : -1);
+}
+
+// Converts numeric and logical arrays, keeping their type. The result is
+// created directly in the requested order and filled in a single pass (a
+// plain memcpy for fortran order).
+static PyArrayObject *mx2numeric(const mxArray *pArray, const Mx2PyOptions &pOpts)
 {
-  //current function returns PyArrayObject in c order currently
-  mwSize nd;
   npy_intp  pydims[NPY_MAXDIMS];
-  PyArrayObject *lRetval = NULL,*t=NULL;
-  const float *lPR;
-  const float *lPI;
+  int nd;
+  PyArrayObject *lRetval = NULL;
+  mxClassID lClass = mxGetClassID(pArray);
+  int lType = _mxArray2npy(pArray);
   pyassert(PyArray_API,
            "Unable to perform this function without NumPy installed");
-
-  nd = mxGetNumberOfDimensions(pArray);
-  {
-    const mwSize *dims;
-    dims = mxGetDimensions(pArray);
-    for (mwSize i=0; i != nd; i++){
-        pydims[i] = static_cast<npy_intp>(dims[i]);
-    }
+  if (lType < 0) {
+    PyErr_Format(PyExc_TypeError, "Unsupported Matlab type: %s%s",
+                 mxIsComplex(pArray) ? "complex " : "", mxGetClassName(pArray));
+    return NULL;
   }
- //this function creates a fortran array
-  t = (PyArrayObject *)
-    PyArray_New(&PyArray_Type,static_cast<npy_intp>(nd), pydims,
-                mxIsComplex(pArray) ? PyArray_CFLOAT : PyArray_FLOAT,
+
+  nd = _mxDims2py(pArray, pydims);
+  lRetval = (PyArrayObject *)
+    PyArray_New(&PyArray_Type, nd, pydims, lType,
                 NULL, // strides
                 NULL, // data
                 0,    //(ignored itemsize),
-                NPY_F_CONTIGUOUS, 
+                pOpts.fortranOrder ? NPY_F_CONTIGUOUS : 0,
                 NULL); //  obj
-  if (t == NULL) return NULL;
-  
-  lPR  = (float *)mxGetData(pArray);
-  if (mxIsComplex(pArray)) {
-    float *lDst = (float *)PyArray_DATA(t);
-    // AWMS unsigned int almost certainly can overflow on some platforms!
-    npy_intp numberOfElements = PyArray_SIZE(t);
-    lPI = (float *)mxGetImagData(pArray);
-    for (unsigned int i = 0; i != numberOfElements; i++) {
-      *lDst++ = *lPR++;
-      *lDst++ = *lPI++;
-    }
-  }
-  else {
-    float *lDst = (float *)PyArray_DATA(t);
-    npy_intp numberOfElements = PyArray_SIZE(t);
-    for (unsigned int i = 0; i != numberOfElements; i++) {
-      *lDst++ = *lPR++;
-    }
+  if (lRetval == NULL) return NULL;
+  if (PyArray_SIZE(lRetval) == 0) return lRetval;
+
+  switch (lClass) {
+  case mxLOGICAL_CLASS: _mx2array<npy_bool>(pArray, lRetval); break;
+  case mxINT8_CLASS:    _mx2array<npy_int8>(pArray, lRetval); break;
+  case mxUINT8_CLASS:   _mx2array<npy_uint8>(pArray, lRetval); break;
+  case mxINT16_CLASS:   _mx2array<npy_int16>(pArray, lRetval); break;
+  case mxUINT16_CLASS:  _mx2array<npy_uint16>(pArray, lRetval); break;
+  case mxINT32_CLASS:   _mx2array<npy_int32>(pArray, lRetval); break;
+  case mxUINT32_CLASS:  _mx2array<npy_uint32>(pArray, lRetval); break;
+  case mxINT64_CLASS:   _mx2array<npy_int64>(pArray, lRetval); break;
+  case mxUINT64_CLASS:  _mx2array<npy_uint64>(pArray, lRetval); break;
+  case mxSINGLE_CLASS:  _mx2array<npy_float32>(pArray, lRetval); break;
+  case mxDOUBLE_CLASS:  _mx2array<npy_float64>(pArray, lRetval); break;
+  default: break;               // can't happen, see above
   }
-  
-  lRetval = (PyArrayObject *)PyArray_FromArray(t,NULL,NPY_C_CONTIGUOUS|NPY_ALIGNED|NPY_WRITEABLE);
-  Py_DECREF(t);
-  
   return lRetval;
   error_return:
   return NULL;
 }
 
-//FIXME check complex case
-template <class T>
-static inline void copyNumericVector2Mx(T *pSrc, npy_intp pRows, double *pDst, npy_intp *pStrides)
+// Copies the array `pSrc` (elements, or for complex arrays components, of
+// type S) into the mxArray `pDst` (of type D), straight from `pSrc`'s
+// strides -- no intermediate fortran-ordered copy is made.
+template <class S, class D>
+static void _array2mx(const PyArrayObject *pSrc, mxArray *pDst)
 {
-  // this is a horrible HACK for 0-D arrays (which have no strides);
-  // it should also work for shape (1,) 1D arrays.
-  // XXX: check that 1Ds are always OK!
-  if (pRows == 1){
-    *pDst = *pSrc;
-  }
-  else {
-    npy_intp lRowDelta = pStrides[0]/sizeof(T);
-    for (npy_intp lRow=0; lRow != pRows; lRow++, pSrc += lRowDelta) {
-      *pDst++ = *pSrc;
-    }
-  }
+  mlabraw_kernels::index_t lShape[NPY_MAXDIMS], lStrides[NPY_MAXDIMS];
+  int nd = _arrayLayout(pSrc, lShape, lStrides);
+  if (PyArray_ISCOMPLEX(pSrc))
+#if MLABRAW_INTERLEAVED_COMPLEX
+    mlabraw_kernels::gatherF<mlabraw_kernels::Complex<S>, mlabraw_kernels::Complex<D> >(
+      PyArray_BYTES(pSrc), nd, lShape, lStrides,
+      (mlabraw_kernels::Complex<D> *)_mxGetComplexData(pDst));
+#else
+    mlabraw_kernels::gatherSplitF<S, D>(PyArray_BYTES(pSrc), nd, lShape, lStrides,
+                                        (D *)mxGetData(pDst), (D *)mxGetImagData(pDst));
+#endif
+  else
+    mlabraw_kernels::gatherF<S, D>(PyArray_BYTES(pSrc), nd, lShape, lStrides,
+                                   (D *)mxGetData(pDst));
 }
 
-template <class T>
-static inline void copyNumeric2Mx(T *p,int size,double * pRData)
-{
-  while(size --){
-    *pRData++ = *p++;
-  }
-}
-template <class T>
-static inline void copyCplxNumericVector2Mx(T *pSrc, npy_intp pRows, double *pRData,
-                              double *pIData, npy_intp *pStrides)
+// `_array2mx` for all supported element types; D_OF(T) gives the mxArray's
+// element type for arrays of T.
+#define MLABRAW_ARRAY2MX_CASES(D_OF, SRC, DST)                                    \
+  case NPY_BOOL:      _array2mx<npy_bool, D_OF(npy_bool)>(SRC, DST); break;           \
+  case NPY_BYTE:      _array2mx<npy_byte, D_OF(npy_byte)>(SRC, DST); break;           \
+  case NPY_UBYTE:     _array2mx<npy_ubyte, D_OF(npy_ubyte)>(SRC, DST); break;         \
+  case NPY_SHORT:     _array2mx<npy_short, D_OF(npy_short)>(SRC, DST); break;         \
+  case NPY_USHORT:    _array2mx<npy_ushort, D_OF(npy_ushort)>(SRC, DST); break;       \
+  case NPY_INT:       _array2mx<npy_int, D_OF(npy_int)>(SRC, DST); break;             \
+  case NPY_UINT:      _array2mx<npy_uint, D_OF(npy_uint)>(SRC, DST); break;           \
+  case NPY_LONG:      _array2mx<npy_long, D_OF(npy_long)>(SRC, DST); break;           \
+  case NPY_ULONG:     _array2mx<npy_ulong, D_OF(npy_ulong)>(SRC, DST); break;         \
+  case NPY_LONGLONG:  _array2mx<npy_longlong, D_OF(npy_longlong)>(SRC, DST); break;   \
+  case NPY_ULONGLONG: _array2mx<npy_ulonglong, D_OF(npy_ulonglong)>(SRC, DST); break; \
+  case NPY_FLOAT:                                                                 \
+  case NPY_CFLOAT:    _array2mx<npy_float, D_OF(npy_float)>(SRC, DST); break;         \
+  case NPY_DOUBLE:                                                                \
+  case NPY_CDOUBLE:   _array2mx<npy_double, D_OF(npy_double)>(SRC, DST); break;
+#define MLABRAW_AS_DOUBLE(T) double
+#define MLABRAW_AS_IS(T) T
+
+// True for the element types handled by `MLABRAW_ARRAY2MX_CASES`.
+static bool _isCopyableType(int pType)
 {
-  npy_intp lRowDelta = pStrides[0]/sizeof(T);
-  for (npy_intp lRow=0; lRow != pRows; lRow++, pSrc += lRowDelta) {
-    *pRData++ = pSrc[0];
-    *pIData++ = pSrc[1];
+  switch (pType) {
+  case NPY_BOOL: case NPY_BYTE: case NPY_UBYTE: case NPY_SHORT: case NPY_USHORT:
+  case NPY_INT: case NPY_UINT: case NPY_LONG: case NPY_ULONG:
+  case NPY_LONGLONG: case NPY_ULONGLONG:
+  case NPY_FLOAT: case NPY_DOUBLE: case NPY_CFLOAT: case NPY_CDOUBLE:
+    return true;
+  default:
+    return false;
   }
 }
 
-template <class T>
-static inline void copyCplxNumeric2Mx(T *p,int size,double *pRData,double *pIData)
+// Converts a numeric array to a double (or complex) mxArray or, if
+// ``pOpts.nativeTypes`` and matlab has a matching class (see `_npy2mxClass`),
+// to an mxArray of the same element type. 0D arrays become 1x1 and 1D arrays
+// column vectors.
+static mxArray *makeMxFromNumeric(const PyArrayObject *pSrc, const Py2MxOptions &pOpts)
 {
-    while(size--){
-      *pRData++ = *p++;
-      *pIData++ = *p++;
-    }
-}
-
-static mxArray *makeMxFromNumeric(const PyArrayObject *pSrc)
-{
-  npy_intp lRows=0, lCols=0;
-  bool lIsComplex;
-  bool lIsNotAMatrix = false;
-  double *lR = NULL;
-  double *lI = NULL;
-  mxArray *lRetval = NULL;
   mwSize dims[NPY_MAXDIMS];
-  mwSize nDims = pSrc->nd;
-  const PyArrayObject *ap=NULL;
+  mwSize nDims = 2;
+  bool lIsComplex = PyArray_ISCOMPLEX(pSrc);
+  mxClassID lClass = mxDOUBLE_CLASS;
+  PyArrayObject *ap = NULL;     // pSrc, or an aligned native-endian version of it
+  mxArray *lRetval = NULL;
 
-  switch (pSrc->nd) {
+  if (!PyArray_ISNUMBER(pSrc)) {
+    PyErr_SetString(PyExc_TypeError, "Non-numeric array types not supported");
+    return NULL;
+  }
+  switch (PyArray_NDIM(pSrc)) {
   case 0:                       // XXX the evil 0D
-    lRows = 1;
-    lCols = 1;
-    lIsNotAMatrix = true;
+    dims[0] = dims[1] = 1;
     break;
-  case 1:
-    lRows = pSrc->dimensions[0];
-    lCols = min(1, lRows); // for array([]): to avoid zeros((0,1)) !
-    lIsNotAMatrix = true;
+  case 1:                       // column vector, array([]) -> zeros((0,0))
+    dims[0] = PyArray_DIM(pSrc, 0);
+    dims[1] = min(1, dims[0]);
     break;
   default:
-      for (mwSize i = 0;i != nDims; i++) {
-        dims[i]=(mwSize)pSrc->dimensions[i];
-      }
-    break;
+    nDims = PyArray_NDIM(pSrc);
+    for (mwSize i = 0; i != nDims; i++) {
+      dims[i] = (mwSize)PyArray_DIM(pSrc, i);
+    }
   }
-  switch (pSrc->descr->type_num) {
-  case PyArray_OBJECT:
-    PyErr_SetString(PyExc_TypeError, "Non-numeric array types not supported");
-    return NULL;
-  case PyArray_CFLOAT:
-  case PyArray_CDOUBLE:
-    lIsComplex = true;
-    break;
-  default:
-    lIsComplex = false;
+  // the kernels read `pSrc` in place; only exotic types (half, long double),
+  // byte-swapped and misaligned arrays need to be converted first
+  if (!_isCopyableType(PyArray_TYPE(pSrc))) {
+    ap = (PyArrayObject *)PyArray_FromArray(const_cast<PyArrayObject *>(pSrc),
+                                            PyArray_DescrFromType(lIsComplex ? NPY_CDOUBLE : NPY_DOUBLE),
+                                            NPY_ALIGNED);
+  } else if (!PyArray_ISNOTSWAPPED(pSrc) || !PyArray_ISALIGNED(pSrc)) {
+    ap = (PyArrayObject *)PyArray_FromArray(const_cast<PyArrayObject *>(pSrc),
+                                            PyArray_DescrFromType(PyArray_TYPE(pSrc)),
+                                            NPY_ALIGNED);
+  } else {
+    ap = const_cast<PyArrayObject *>(pSrc);
+    Py_INCREF(ap);
   }
+  if (ap == NULL) return NULL;
 
-  // converts to fortran order if not already
-  if(!PyArray_ISFORTRAN(pSrc)){ 
-    ap = (PyArrayObject * const)PyArray_FromArray((PyArrayObject*)pSrc,NULL,NPY_ALIGNED|NPY_F_CONTIGUOUS);
+  if (pOpts.nativeTypes) {
+    lClass = _npy2mxClass(PyArray_DESCR(ap));
+    if (lClass == mxUNKNOWN_CLASS) lClass = mxDOUBLE_CLASS;
   }
-  else{
-    ap = pSrc;
-  }
-
-  if(lIsNotAMatrix)
-    lRetval = mxCreateDoubleMatrix(lRows, lCols, lIsComplex ? mxCOMPLEX : mxREAL);
+  if (lClass == mxLOGICAL_CLASS)
+    lRetval = mxCreateLogicalArray(nDims, dims);
   else
-    lRetval = mxCreateNumericArray(nDims,dims,mxDOUBLE_CLASS,lIsComplex ? mxCOMPLEX : mxREAL);
-
-  if (lRetval == NULL) return NULL;
-  lR = mxGetPr(lRetval);
-  lI = mxGetPi(lRetval);
-  if (lIsNotAMatrix) {
-    void *p = PyArray_DATA(ap);
-    switch (ap->descr->type_num) {
-    case PyArray_CHAR:
-      copyNumericVector2Mx((char *)(p), lRows, lR, pSrc->strides);
-      break;
-
-    case PyArray_UBYTE:
-      copyNumericVector2Mx((unsigned char *)(p), lRows, lR, pSrc->strides);
-      break;
-
-    case PyArray_SBYTE:
-      copyNumericVector2Mx((signed char *)(p), lRows, lR, pSrc->strides);
-      break;
-
-    case PyArray_SHORT:
-      copyNumericVector2Mx((short *)(p), lRows, lR, pSrc->strides);
-      break;
-
-    case PyArray_INT:
-      copyNumericVector2Mx((int *)(p), lRows, lR, pSrc->strides);
-      break;
-
-    case PyArray_LONG:
-      copyNumericVector2Mx((long *)(p), lRows, lR, pSrc->strides);
-      break;
-
-    case PyArray_FLOAT:
-      copyNumericVector2Mx((float *)(p), lRows, lR, pSrc->strides);
-      break;
-
-    case PyArray_DOUBLE:
-      copyNumericVector2Mx((double *)(p), lRows, lR, pSrc->strides);
-      break;
-
-    case PyArray_CFLOAT:
-      copyCplxNumericVector2Mx((float *)(p), lRows, lR, lI, pSrc->strides);
-      break;
-
-    case PyArray_CDOUBLE:
-      copyCplxNumericVector2Mx((double *)(p), lRows, lR, lI, pSrc->strides);
-      break;
-    }
-  } else {
-    void *p = PyArray_DATA(ap);
-    npy_intp size = PyArray_SIZE(pSrc);
-
-    switch (pSrc->descr->type_num) {
-    case PyArray_CHAR:
-      copyNumeric2Mx((char *)p,size,lR);
-      break;
-
-    case PyArray_UBYTE:
-      copyNumeric2Mx((unsigned char *)p,size,lR);
-      break;
-
-    case PyArray_SBYTE:
-      copyNumeric2Mx((signed char *)p,size,lR);
-      break;
-
-    case PyArray_SHORT:
-      copyNumeric2Mx((short *)p,size,lR);
-      break;
-
-    case PyArray_INT:
-      copyNumeric2Mx((int *)p,size,lR);
-      break;
-
-    case PyArray_LONG:
-      copyNumeric2Mx((long *)p,size,lR);
-      break;
-
-    case PyArray_FLOAT:
-      copyNumeric2Mx((float *)p,size,lR);
-      break;
-
-    case PyArray_DOUBLE:
-      copyNumeric2Mx((double *)p,size,lR);
-      break;
-
-    case PyArray_CFLOAT:
-      copyCplxNumeric2Mx((float *)p,size,lR,lI);
-      break;
-
-    case PyArray_CDOUBLE:
-      copyCplxNumeric2Mx((double *)p,size,lR,lI);
-      break;
-    }
+    lRetval = mxCreateNumericArray(nDims, dims, lClass, lIsComplex ? mxCOMPLEX : mxREAL);
+  if (lRetval == NULL) {
+    PyErr_SetString(PyExc_MemoryError, "Unable to create MATLAB(TM) array");
+    Py_DECREF(ap);
+    return NULL;
   }
-  
-  if(ap != pSrc){
-    Py_DECREF(const_cast<PyArrayObject *>(ap));
+  if (PyArray_SIZE(ap) != 0) {
+    if (lClass == mxDOUBLE_CLASS) {
+      switch (PyArray_TYPE(ap)) { MLABRAW_ARRAY2MX_CASES(MLABRAW_AS_DOUBLE, ap, lRetval) }
+    } else {
+      switch (PyArray_TYPE(ap)) { MLABRAW_ARRAY2MX_CASES(MLABRAW_AS_IS, ap, lRetval) }
+    }
   }
+  Py_DECREF(ap);
   return lRetval;
 }
 
@@ -561,25 +846,27 @@ static mxArray *makeMxFromSeq(const PyObject *pSrc)
     lArray = lNew;
   }
 
-  lRetval = makeMxFromNumeric(lArray);
+  lRetval = makeMxFromNumeric(lArray, Py2MxOptions());
   Py_DECREF(lArray);
 
   return lRetval;
 }
 
-static mxArray *numeric2mx(PyObject *pSrc)
+// Python scalars and sequences always become double (or complex) arrays; only
+// arrays, whose type is explicit, are affected by ``pOpts.nativeTypes``.
+static mxArray *numeric2mx(PyObject *pSrc, const Py2MxOptions &pOpts)
 {
   const char *__array__ = "__array__";
   mxArray *lDst = NULL;
 
   pyassert(PyArray_API, "Unable to perform this function without NumPy installed");
   if (PyArray_Check(pSrc)) {
-    lDst = makeMxFromNumeric((const PyArrayObject *)pSrc);
+    lDst = makeMxFromNumeric((const PyArrayObject *)pSrc, pOpts);
   } else if (PySequence_Check(pSrc)) {
     lDst = makeMxFromSeq(pSrc);
   } else if (PyObject_HasAttrString(pSrc, (char *)__array__)) {
     PyObject *arp = PyObject_CallMethod(pSrc, (char *)__array__, NULL);
-    lDst = makeMxFromNumeric((const PyArrayObject *)arp);
+    lDst = makeMxFromNumeric((const PyArrayObject *)arp, pOpts);
     Py_DECREF(arp);             // FIXME check this is correct;
   }
     else if (PyInt_Check(pSrc) || PyLong_Check(pSrc) ||
@@ -614,7 +901,7 @@ static mxArray *char2mx(const PyObject *pSrc)
   return lDst;
 }
 
-static mxArray *dict2mx( PyObject *obj)
+static mxArray *dict2mx( PyObject *obj, const Py2MxOptions &pOpts)
 {
   // taken from:
   // https://github.com/pv/pythoncall/blob/master/pythoncall.c
@@ -677,7 +964,7 @@ static mxArray *dict2mx( PyObject *obj)
     if (PyString_Check(o))
       mxSetFieldByNumber(r, 0, k, char2mx(o));
     else
-      mxSetFieldByNumber(r, 0, k, numeric2mx(o));
+      mxSetFieldByNumber(r, 0, k, numeric2mx(o, pOpts));
   }
 
   Py_DECREF(items);
@@ -689,10 +976,307 @@ static mxArray *dict2mx( PyObject *obj)
   if (items) {
     Py_DECREF(items);
   }
-  return r;
+  return r;
+}
+
+// Copies `pN` (nonnegative) indices between MATLAB(TM)'s and numpy's index
+// types, which usually have the same size, so this is a plain `memcpy`.
+template <class S, class D>
+static void _copyIndices(const S *pSrc, npy_intp pN, D *pDst)
+{
+  if (sizeof(S) == sizeof(D)) {
+    if (pN) memcpy(pDst, pSrc, pN * sizeof(S));
+  } else {
+    for (npy_intp i = 0; i != pN; i++) pDst[i] = static_cast<D>(pSrc[i]);
+  }
+}
+
+// Converts the MATLAB(TM) sparse matrix `pArray` to a
+// ``scipy.sparse.csc_matrix``, copying its (CSC) buffers in bulk.
+static PyObject *mx2sparse(const mxArray *pArray)
+{
+  PyObject *lModule = NULL, *lRetval = NULL;
+  PyArrayObject *lData = NULL, *lIndices = NULL, *lIndptr = NULL;
+  const mwSize lM = mxGetM(pArray), lN = mxGetN(pArray);
+  const mwIndex *lJc = mxGetJc(pArray);
+  npy_intp lNnz = static_cast<npy_intp>(lJc[lN]);
+  npy_intp lNcols1 = static_cast<npy_intp>(lN) + 1;
+  int lType;
+
+  if (mxIsLogical(pArray)) {
+    lType = NPY_BOOL;
+  } else if (mxIsDouble(pArray)) {
+    lType = mxIsComplex(pArray) ? NPY_CDOUBLE : NPY_DOUBLE;
+  } else {
+    PyErr_Format(PyExc_TypeError, "Unsupported sparse Matlab type: %s",
+                 mxGetClassName(pArray));
+    return NULL;
+  }
+  if ((lModule = PyImport_ImportModule("scipy.sparse")) == NULL) return NULL;
+  lData = (PyArrayObject *)PyArray_SimpleNew(1, &lNnz, lType);
+  lIndices = (PyArrayObject *)PyArray_SimpleNew(1, &lNnz, NPY_INTP);
+  lIndptr = (PyArrayObject *)PyArray_SimpleNew(1, &lNcols1, NPY_INTP);
+  if (lData == NULL || lIndices == NULL || lIndptr == NULL) goto error_return;
+  _copyIndices(mxGetIr(pArray), lNnz, (npy_intp *)PyArray_DATA(lIndices));
+  _copyIndices(lJc, lNcols1, (npy_intp *)PyArray_DATA(lIndptr));
+  if (lNnz == 0) {
+    // nothing to copy (and the data pointer may be NULL)
+  } else if (lType == NPY_CDOUBLE) {
+#if MLABRAW_INTERLEAVED_COMPLEX
+    memcpy(PyArray_DATA(lData), mxGetComplexDoubles(pArray),
+           lNnz * sizeof(mlabraw_kernels::Complex<double>));
+#else
+    mlabraw_kernels::index_t lStride = sizeof(mlabraw_kernels::Complex<double>);
+    mlabraw_kernels::index_t lShape = lNnz;
+    mlabraw_kernels::scatterMergeF<double, double>(mxGetPr(pArray), mxGetPi(pArray),
+                                                   1, &lShape, &lStride,
+                                                   PyArray_BYTES(lData));
+#endif
+  } else {
+    // (mxLogical and npy_bool are both single bytes)
+    memcpy(PyArray_DATA(lData), mxGetData(pArray), lNnz * PyArray_ITEMSIZE(lData));
+  }
+  lRetval = PyObject_CallMethod(lModule, (char *)"csc_matrix", (char *)"((OOO)(nn))",
+                                lData, lIndices, lIndptr,
+                                static_cast<Py_ssize_t>(lM), static_cast<Py_ssize_t>(lN));
+ error_return:
+  Py_DECREF(lModule);
+  Py_XDECREF(lData);
+  Py_XDECREF(lIndices);
+  Py_XDECREF(lIndptr);
+  return lRetval;
+}
+
+// True if `pSrc` is a scipy sparse matrix (without importing scipy: if it
+// hasn't been imported, nothing can be one); -1 on error.
+static int _isScipySparse(PyObject *pSrc)
+{
+  PyObject *lModule = PyDict_GetItemString(PyImport_GetModuleDict(), "scipy.sparse");
+  if (lModule == NULL) return 0;
+  PyObject *lRes = PyObject_CallMethod(lModule, (char *)"issparse", (char *)"(O)", pSrc);
+  if (lRes == NULL) return -1;
+  int lRetval = PyObject_IsTrue(lRes);
+  Py_DECREF(lRes);
+  return lRetval;
+}
+
+// Converts the scipy sparse matrix `pSrc` (of any format) to a MATLAB(TM)
+// sparse matrix: a logical one if it is boolean, else a (complex) double one.
+static mxArray *sparse2mx(PyObject *pSrc)
+{
+  PyObject *lCsc = NULL, *lAttr = NULL;
+  PyArrayObject *lData = NULL, *lIndices = NULL, *lIndptr = NULL;
+  mxArray *lRetval = NULL;
+  Py_ssize_t lM, lN;
+  npy_intp lNnz;
+  int lType, lCanonical;
+
+  if ((lCsc = PyObject_CallMethod(pSrc, (char *)"tocsc", NULL)) == NULL) return NULL;
+  // MATLAB(TM) needs sorted row indices without duplicates
+  if ((lAttr = PyObject_GetAttrString(lCsc, "has_canonical_format")) == NULL)
+    goto error_return;
+  lCanonical = PyObject_IsTrue(lAttr);
+  Py_CLEAR(lAttr);
+  if (lCanonical < 0) goto error_return;
+  if (! lCanonical) {
+    // (`tocsc` may have returned `pSrc` itself, which mustn't be modified)
+    PyObject *lCopy = PyObject_CallMethod(lCsc, (char *)"copy", NULL);
+    Py_DECREF(lCsc);
+    if ((lCsc = lCopy) == NULL) return NULL;
+    if ((lAttr = PyObject_CallMethod(lCsc, (char *)"sum_duplicates", NULL)) == NULL)
+      goto error_return;
+    Py_CLEAR(lAttr);
+  }
+  if ((lAttr = PyObject_GetAttrString(lCsc, "shape")) == NULL ||
+      ! PyArg_ParseTuple(lAttr, "nn", &lM, &lN))
+    goto error_return;
+  Py_CLEAR(lAttr);
+
+  if ((lAttr = PyObject_GetAttrString(lCsc, "data")) == NULL) goto error_return;
+  lType = NPY_DOUBLE;
+  if (PyArray_Check(lAttr)) {
+    if (PyArray_ISBOOL((PyArrayObject *)lAttr)) lType = NPY_BOOL;
+    else if (PyArray_ISCOMPLEX((PyArrayObject *)lAttr)) lType = NPY_CDOUBLE;
+  }
+  lData = (PyArrayObject *)PyArray_ContiguousFromObject(lAttr, lType, 1, 1);
+  Py_CLEAR(lAttr);
+  if (lData == NULL) goto error_return;
+  if ((lAttr = PyObject_GetAttrString(lCsc, "indices")) == NULL) goto error_return;
+  lIndices = (PyArrayObject *)PyArray_ContiguousFromObject(lAttr, NPY_INTP, 1, 1);
+  Py_CLEAR(lAttr);
+  if (lIndices == NULL) goto error_return;
+  if ((lAttr = PyObject_GetAttrString(lCsc, "indptr")) == NULL) goto error_return;
+  lIndptr = (PyArrayObject *)PyArray_ContiguousFromObject(lAttr, NPY_INTP, 1, 1);
+  Py_CLEAR(lAttr);
+  if (lIndptr == NULL) goto error_return;
+  lNnz = PyArray_DIM(lData, 0);
+  if (PyArray_DIM(lIndices, 0) != lNnz || PyArray_DIM(lIndptr, 0) != lN + 1) {
+    PyErr_SetString(PyExc_ValueError, "Inconsistent sparse matrix");
+    goto error_return;
+  }
+
+  if (lType == NPY_BOOL)
+    lRetval = mxCreateSparseLogicalMatrix(lM, lN, max(lNnz, 1));
+  else
+    lRetval = mxCreateSparse(lM, lN, max(lNnz, 1),
+                             lType == NPY_CDOUBLE ? mxCOMPLEX : mxREAL);
+  if (lRetval == NULL) {
+    PyErr_SetString(PyExc_MemoryError, "Unable to create MATLAB(TM) sparse matrix");
+    goto error_return;
+  }
+  _copyIndices((const npy_intp *)PyArray_DATA(lIndices), lNnz, mxGetIr(lRetval));
+  _copyIndices((const npy_intp *)PyArray_DATA(lIndptr), lN + 1, mxGetJc(lRetval));
+  if (lNnz == 0) {
+    // nothing to copy
+  } else if (lType == NPY_CDOUBLE) {
+#if MLABRAW_INTERLEAVED_COMPLEX
+    memcpy(mxGetComplexDoubles(lRetval), PyArray_DATA(lData),
+           lNnz * sizeof(mlabraw_kernels::Complex<double>));
+#else
+    mlabraw_kernels::index_t lStride = sizeof(mlabraw_kernels::Complex<double>);
+    mlabraw_kernels::index_t lShape = lNnz;
+    mlabraw_kernels::gatherSplitF<double, double>(PyArray_BYTES(lData), 1, &lShape,
+                                                  &lStride, mxGetPr(lRetval),
+                                                  mxGetPi(lRetval));
+#endif
+  } else {
+    memcpy(mxGetData(lRetval), PyArray_DATA(lData), lNnz * PyArray_ITEMSIZE(lData));
+  }
+
+ error_return:
+  Py_XDECREF(lAttr);
+  Py_XDECREF(lCsc);
+  Py_XDECREF(lData);
+  Py_XDECREF(lIndices);
+  Py_XDECREF(lIndptr);
+  return lRetval;
+}
+
+// Returns the stand-in for the part at ``pOpts.path`` that isn't converted
+// (NULL and an exception if there is no ``pOpts.leafHandler``).
+static PyObject *_leaf2py(const char *pWhy, const Mx2PyOptions &pOpts)
+{
+  if (pOpts.leafHandler == NULL) {
+    PyErr_SetString(PyExc_TypeError, pWhy);
+    return NULL;
+  }
+  return PyObject_CallFunction(pOpts.leafHandler, (char *)"s", pOpts.path.c_str());
+}
+
+// Converts `pArray` (an element of a cell or struct array, which is NULL if
+// it was never assigned) like `mx2py`.
+static PyObject *_element2py(mxArray *pArray, const Mx2PyOptions &pOpts)
+{
+  if (pArray == NULL) {
+    npy_intp lDims[2] = {0, 0};
+    return PyArray_SimpleNew(2, lDims, NPY_DOUBLE);
+  }
+  return mx2py(pArray, pOpts);
+}
+
+// Stores the new reference `pObj` (which is stolen) in the object slot at
+// `pSlot` of a numpy array, releasing what was there before.
+static void _setObjectSlot(char *pSlot, PyObject *pObj)
+{
+  PyObject *lOld;
+  memcpy(&lOld, pSlot, sizeof(PyObject *));
+  memcpy(pSlot, &pObj, sizeof(PyObject *));
+  Py_XDECREF(lOld);
+}
+
+// A new numpy array with the dimensions of `pArray` (minus dimension
+// `pDropDim`, unless that's -1) and the elements described by `pDescr`
+// (which is stolen), in the order `pOpts` asks for.
+static PyArrayObject *_newArrayLike(const mxArray *pArray, int pDropDim,
+                                    PyArray_Descr *pDescr, const Mx2PyOptions &pOpts)
+{
+  npy_intp lDims[NPY_MAXDIMS];
+  int nd = _mxDims2py(pArray, lDims);
+  if (pDropDim >= 0) {
+    for (int i = pDropDim + 1; i < nd; i++) lDims[i-1] = lDims[i];
+    nd--;
+  }
+  return (PyArrayObject *)PyArray_NewFromDescr(&PyArray_Type, pDescr, nd, lDims,
+                                               NULL, NULL,
+                                               pOpts.fortranOrder ? 1 : 0, NULL);
+}
+
+// Calls `pOp` for all elements of the numpy array `pArray` (see
+// `mlabraw_kernels::forEachF`).
+template <class Op>
+static void _forEachElement(PyArrayObject *pArray, Op &pOp)
+{
+  mlabraw_kernels::index_t lShape[NPY_MAXDIMS], lStrides[NPY_MAXDIMS];
+  int nd = _arrayLayout(pArray, lShape, lStrides);
+  mlabraw_kernels::forEachF(PyArray_BYTES(pArray), nd, lShape, lStrides, pOp);
+}
+
+// `forEachF` operations that fill numpy arrays from matlab arrays; `failed`
+// is set (with an exception) if a conversion fails.
+struct CellFiller {            // cell array -> object array
+  mxArray *cell;
+  const Mx2PyOptions *opts;
+  bool failed;
+  void operator()(char *p, mlabraw_kernels::index_t k) {
+    if (failed) return;
+    PathElement lPath(*opts, "{%lu}", k);
+    PyObject *lItem = _element2py(mxGetCell(cell, k), *opts);
+    if (lItem == NULL) failed = true;
+    else _setObjectSlot(p, lItem);
+  }
+};
+
+struct RecordFiller {          // struct array -> record array of objects
+  mxArray *array;
+  int nfields;
+  const Mx2PyOptions *opts;
+  bool failed;
+  void operator()(char *p, mlabraw_kernels::index_t k) {
+    for (int f = 0; f != nfields && ! failed; f++) {
+      PathElement lPath(*opts, "(%lu).", k, mxGetFieldNameByNumber(array, f));
+      PyObject *lItem = _element2py(mxGetFieldByNumber(array, k, f), *opts);
+      if (lItem == NULL) failed = true;
+      else _setObjectSlot(p + f * sizeof(PyObject *), lItem);
+    }
+  }
+};
+
+struct StringFiller {          // char array -> unicode array
+  const mxChar *chars;
+  mlabraw_kernels::index_t rows, len;
+  void operator()(char *p, mlabraw_kernels::index_t k) {
+    // the k-th string starts at row ``k % rows`` of page ``k / rows``
+    const mxChar *lSrc = chars + k % rows + (k / rows) * rows * len;
+    for (mlabraw_kernels::index_t j = 0; j != len; j++)
+      ((npy_uint32 *)p)[j] = lSrc[j * rows];
+  }
+};
+
+// Converts a char array of more than one row (or more than 2 dimensions) to
+// a numpy unicode array: as in matlab, strings run along the 2nd dimension,
+// so e.g. a MxN char matrix becomes M strings of length N (including any
+// padding).
+static PyObject *_charArray2py(const mxArray *pArray, const Mx2PyOptions &pOpts)
+{
+  const mwSize *lDims = mxGetDimensions(pArray);
+  PyArray_Descr *lDescr = PyArray_DescrNewFromType(NPY_UNICODE);
+  if (lDescr == NULL) return NULL;
+  // (numpy strings are at least one char long)
+  lDescr->elsize = static_cast<int>(max(lDims[1], 1) * 4);
+  PyArrayObject *lRetval = _newArrayLike(pArray, 1, lDescr, pOpts);
+  if (lRetval == NULL) return NULL;
+  memset(PyArray_DATA(lRetval), 0, PyArray_NBYTES(lRetval));
+  if (lDims[1] != 0) {
+    StringFiller lOp = {(const mxChar *)mxGetData(pArray),
+                        static_cast<mlabraw_kernels::index_t>(lDims[0]),
+                        static_cast<mlabraw_kernels::index_t>(lDims[1])};
+    _forEachElement(lRetval, lOp);
+  }
+  return (PyObject *)lRetval;
 }
 
-static PyObject *mx2dict( mxArray* arr)
+// Converts element `pIndex` of the struct array `arr` to a dict.
+static PyObject *mx2dict( mxArray* arr, mwIndex pIndex, const Mx2PyOptions &pOpts)
 {
   int nfields;
   int field_number;
@@ -701,43 +1285,133 @@ static PyObject *mx2dict( mxArray* arr)
   nfields = mxGetNumberOfFields(arr);
 
   obj = PyDict_New();
+  if (obj == NULL) return NULL;
 
   for (field_number = 0; field_number < nfields; ++field_number) {
     const char *name;
         
     name = mxGetFieldNameByNumber(arr, field_number);
 
-    mxArray *a;
-    a = mxGetFieldByNumber(arr, 0, field_number);
-
-    PyDict_SetItemString(obj, name, mx2py(a));
+    PathElement lPath(pOpts, "(%lu).", pIndex, name);
+    PyObject *lValue = _element2py(mxGetFieldByNumber(arr, pIndex, field_number), pOpts);
+    if (lValue == NULL || PyDict_SetItemString(obj, name, lValue) != 0) {
+      Py_XDECREF(lValue);
+      Py_DECREF(obj);
+      return NULL;
+    }
+    Py_DECREF(lValue);
   }
     
   return obj;
 }
 
-static PyObject* cell2list( mxArray* lArray )
+// Converts a struct array: a single struct becomes a dict, others become a
+// list of dicts (in matlab's element order) or, with ``pOpts.structAsRecords``,
+// a record array of the same shape with an object field per struct field.
+static PyObject *struct2py( mxArray *pArray, const Mx2PyOptions &pOpts )
+{
+  const Py_ssize_t lLen = static_cast<Py_ssize_t>(mxGetNumberOfElements(pArray));
+  const int lNfields = mxGetNumberOfFields(pArray);
+  if (lLen == 1) return mx2dict(pArray, 0, pOpts);
+
+  if (! pOpts.structAsRecords || lNfields == 0) {
+    PyObject *lList = PyList_New(lLen);
+    if (lList == NULL) return NULL;
+    for (Py_ssize_t i = 0; i != lLen; i++) {
+      PyObject *lItem = mx2dict(pArray, i, pOpts);
+      if (lItem == NULL) {
+        Py_DECREF(lList);
+        return NULL;
+      }
+      PyList_SET_ITEM(lList, i, lItem);
+    }
+    return lList;
+  }
+
+  PyArray_Descr *lDescr = NULL;
+  PyObject *lNames = PyList_New(lNfields);
+  PyObject *lFormats = PyList_New(lNfields);
+  PyObject *lOffsets = PyList_New(lNfields);
+  PyObject *lSpec = NULL;
+  if (lNames && lFormats && lOffsets) {
+    for (int f = 0; f != lNfields; f++) {
+      PyList_SET_ITEM(lNames, f, Py_BuildValue("s", mxGetFieldNameByNumber(pArray, f)));
+      PyList_SET_ITEM(lFormats, f, Py_BuildValue("s", "O"));
+      PyList_SET_ITEM(lOffsets, f, Py_BuildValue("n", static_cast<Py_ssize_t>(f * sizeof(PyObject *))));
+    }
+    lSpec = Py_BuildValue("{sOsOsO}", "names", lNames, "formats", lFormats,
+                          "offsets", lOffsets);
+  }
+  Py_XDECREF(lNames);
+  Py_XDECREF(lFormats);
+  Py_XDECREF(lOffsets);
+  if (lSpec == NULL) return NULL;
+  int lOk = PyArray_DescrConverter(lSpec, &lDescr);
+  Py_DECREF(lSpec);
+  if (! lOk) return NULL;
+
+  PyArrayObject *lRetval = _newArrayLike(pArray, -1, lDescr, pOpts);
+  if (lRetval == NULL) return NULL;
+  RecordFiller lOp = {pArray, lNfields, &pOpts, false};
+  _forEachElement(lRetval, lOp);
+  if (lOp.failed) {
+    Py_DECREF(lRetval);
+    return NULL;
+  }
+  return (PyObject *)lRetval;
+}
+
+// Converts a cell array: empty cells and vectors become lists, all others
+// object arrays of the same shape.
+static PyObject* cell2list( mxArray* lArray, const Mx2PyOptions &pOpts )
 {
   int d,nd;
   const mwSize *dims;
   PyObject* mylist;
   Py_ssize_t i;
+  int lNonSingleton = 0;
   
   nd = mxGetNumberOfDimensions(lArray);
   dims = mxGetDimensions(lArray);
-  int len = dims[0];
+  Py_ssize_t len = dims[0];
   for (d = 1; d < nd; d++)
     len *= dims[d];
+  for (d = 0; d < nd; d++)
+    lNonSingleton += dims[d] > 1;
+  if (pOpts.maxDepth >= 0 && pOpts.depth >= pOpts.maxDepth)
+    return _leaf2py("Cell array nested too deeply", pOpts);
+  if (pOpts.maxSize >= 0 && len > pOpts.maxSize)
+    return _leaf2py("Cell array too large", pOpts);
+
+  if (lNonSingleton > 1) {
+    PyArrayObject *lRetval = _newArrayLike(lArray, -1, PyArray_DescrFromType(NPY_OBJECT), pOpts);
+    if (lRetval == NULL) return NULL;
+    CellFiller lOp = {lArray, &pOpts, false};
+    _forEachElement(lRetval, lOp);
+    if (lOp.failed) {
+      Py_DECREF(lRetval);
+      return NULL;
+    }
+    return (PyObject *)lRetval;
+  }
   
   mylist = PyList_New(len);
+  if (mylist == NULL) return NULL;
     
-  for (i=0; i<len; i++ ) 
-    PyList_SetItem(mylist,i,mx2py(mxGetCell(lArray, i)));
+  for (i=0; i<len; i++ ) {
+    PathElement lPath(pOpts, "{%lu}", i);
+    PyObject *lItem = _element2py(mxGetCell(lArray, i), pOpts);
+    if (lItem == NULL) {
+      Py_DECREF(mylist);
+      return NULL;
+    }
+    PyList_SET_ITEM(mylist, i, lItem);
+  }
 
   return mylist; 
 }
 
-static mxArray *list2cell( PyObject *obj)
+static mxArray *list2cell( PyObject *obj, const Py2MxOptions &pOpts)
 {
   // taken from:
   // https://github.com/pv/pythoncall/blob/master/pythoncall.c
@@ -753,39 +1427,128 @@ static mxArray *list2cell( PyObject *obj)
       PyErr_WarnEx( NULL, "Couldn't get item in sequence", 1);
       PyErr_Clear();
     } else {
-      mxSetCell(r, k, py2mx(o));
+      mxSetCell(r, k, py2mx(o, pOpts));
       Py_DECREF(o);
     }
   }
   return r;  
 }
 
-static PyObject* mx2py( mxArray* lArray )
+static PyObject* mx2py( mxArray* lArray, const Mx2PyOptions &pOpts )
 {
   PyObject *lDest = NULL;
   
   if (mxIsChar(lArray)) {
-    lDest = (PyObject *)mx2char(lArray);
-  } else if (mxIsSingle(lArray) && !mxIsSparse(lArray)) {
-    lDest = (PyObject *)mx2numericSingle(lArray);    
-  } else if (mxIsDouble(lArray) && !mxIsSparse(lArray)) {
-    lDest = (PyObject *)mx2numericDouble(lArray);
+    if (mxGetM(lArray) > 1 || mxGetNumberOfDimensions(lArray) > 2)
+      lDest = _charArray2py(lArray, pOpts);
+    else
+      lDest = (PyObject *)mx2char(lArray);
+  } else if ((mxIsNumeric(lArray) || mxIsLogical(lArray)) && !mxIsSparse(lArray)) {
+    lDest = (PyObject *)mx2numeric(lArray, pOpts);
+  } else if (mxIsSparse(lArray)) {
+    lDest = mx2sparse(lArray);
+    if (lDest == NULL && pOpts.leafHandler && pOpts.depth &&
+        PyErr_ExceptionMatches(PyExc_ImportError)) {
+      // no scipy; proxy it, like a sparse matrix that isn't in a cell
+      PyErr_Clear();
+      lDest = _leaf2py("", pOpts);
+    }
   } else if (mxIsStruct(lArray)) {
-    lDest = (PyObject *)mx2dict(lArray);
+    lDest = struct2py(lArray, pOpts);
   } else if (mxIsCell(lArray)) {
-    lDest = (PyObject *)cell2list(lArray);
+    lDest = (PyObject *)cell2list(lArray, pOpts);
   }
   else {
     char msg[300];
     strcpy( msg, "Unsupported Matlab type: " );
-    strcat( msg, mxGetClassName(lArray) );
-    PyErr_SetString( PyExc_TypeError, msg );
+    strncat( msg, mxGetClassName(lArray), 200 );
+    lDest = _leaf2py(msg, pOpts);
   }
   
   return lDest;
 }
 
-static mxArray* py2mx( PyObject* lSource )
+static void _destroyMxCapsule(PyObject *pCapsule)
+{
+  mxDestroyArray((mxArray *)PyCapsule_GetPointer(pCapsule, NULL));
+}
+
+// Like `mx2py`, but takes over the ownership of `pArray`. Real numeric and
+// logical arrays (and, with the interleaved complex API, complex ones)
+// requested in fortran order aren't copied at all: the returned array uses
+// `pArray`'s data and keeps it alive via its base object.
+static PyObject* mx2pyOwned( mxArray* pArray, const Mx2PyOptions &pOpts )
+{
+  int lType = _mxArray2npy(pArray);
+  if (pOpts.fortranOrder && (MLABRAW_INTERLEAVED_COMPLEX || !mxIsComplex(pArray)) &&
+      !mxIsSparse(pArray) && lType >= 0 && mxGetData(pArray) != NULL) {
+    npy_intp pydims[NPY_MAXDIMS];
+    mwSize nd = mxGetNumberOfDimensions(pArray);
+    const mwSize *dims = mxGetDimensions(pArray);
+    for (mwSize i=0; i != nd; i++){
+      pydims[i] = static_cast<npy_intp>(dims[i]);
+    }
+    PyObject *lBase = PyCapsule_New(pArray, NULL, _destroyMxCapsule);
+    if (lBase == NULL) {
+      mxDestroyArray(pArray);
+      return NULL;
+    }
+    PyObject *lRetval =
+      PyArray_New(&PyArray_Type, static_cast<npy_intp>(nd), pydims,
+                  lType,
+                  NULL, // strides
+                  mxGetData(pArray),
+                  0,    //(ignored itemsize),
+                  NPY_F_CONTIGUOUS|NPY_ALIGNED|NPY_WRITEABLE,
+                  NULL); //  obj
+    if (lRetval == NULL) {
+      Py_DECREF(lBase);
+      return NULL;
+    }
+#if NPY_API_VERSION >= 0x00000007
+    if (PyArray_SetBaseObject((PyArrayObject *)lRetval, lBase) != 0) {
+      Py_DECREF(lRetval);
+      return NULL;
+    }
+#else
+    PyArray_BASE(lRetval) = lBase;
+#endif
+    return lRetval;
+  }
+  PyObject *lRetval = mx2py(pArray, pOpts);
+  mxDestroyArray(pArray);
+  return lRetval;
+}
+
+// Parses the `struct_as` argument of `get` and `call`.
+static bool _parseStructAs(const char *pStructAs, Mx2PyOptions &pOpts)
+{
+  if (pStructAs == NULL || strcmp(pStructAs, "dicts") == 0) {
+    pOpts.structAsRecords = false;
+  } else if (strcmp(pStructAs, "records") == 0) {
+    pOpts.structAsRecords = true;
+  } else {
+    PyErr_SetString(PyExc_ValueError, "struct_as must be 'dicts' or 'records'");
+    return false;
+  }
+  return true;
+}
+
+// Parses the `order` argument of `get` and `call`.
+static bool _parseOrder(const char *pOrder, Mx2PyOptions &pOpts)
+{
+  if (pOrder == NULL || strcmp(pOrder, "C") == 0) {
+    pOpts.fortranOrder = false;
+  } else if (strcmp(pOrder, "F") == 0) {
+    pOpts.fortranOrder = true;
+  } else {
+    PyErr_SetString(PyExc_ValueError, "order must be 'C' or 'F'");
+    return false;
+  }
+  return true;
+}
+
+static mxArray* py2mx( PyObject* lSource, const Py2MxOptions &pOpts )
 {
   mxArray* lArray;
   
@@ -799,11 +1562,13 @@ static mxArray* py2mx( PyObject* lSource )
     lArray = char2mx(lSource);
 #endif
   } else if (PyDict_Check(lSource)) {
-    lArray = dict2mx(lSource);
+    lArray = dict2mx(lSource, pOpts);
   } else if (PyList_Check(lSource)) {
-    lArray = list2cell(lSource);
+    lArray = list2cell(lSource, pOpts);
   } else {
-    lArray = numeric2mx(lSource);
+    int lIsSparse = _isScipySparse(lSource);
+    if (lIsSparse < 0) return NULL;
+    lArray = lIsSparse ? sparse2mx(lSource) : numeric2mx(lSource, pOpts);
   }
   
   return lArray;
@@ -837,18 +1602,42 @@ PyObject * mlabraw_open(PyObject *, PyObject *args)
 {
   Engine *ep;
   char *lStr;
+  MlabSession *lSession;
+  PyObject *lHandle;
   if (! PyArg_ParseTuple(args, "|s:open", &lStr)) return NULL;
 
+  // startup takes a while, let other threads run meanwhile
+  Py_BEGIN_ALLOW_THREADS
 #ifdef WIN32
   ep = engOpen(NULL);
 #else
   ep = engOpen(lStr);
 #endif
+  Py_END_ALLOW_THREADS
   if (ep == NULL) {
     PyErr_SetString(mlabraw_error, "Unable to start MATLAB(TM) engine");
     return NULL;
   }
-  return PyCapsule_New(ep, NULL, NULL);
+  lSession = new MlabSession;
+  lSession->ep = ep;
+  lSession->owner = 0;
+  lSession->depth = 0;
+  lSession->outputSize = DEFAULT_OUTPUT_SIZE;
+  lSession->outputUsed = 0;
+  lSession->lock = PyThread_allocate_lock();
+  if (lSession->lock == NULL) {
+    engClose(ep);
+    delete lSession;
+    PyErr_SetString(PyExc_MemoryError, "Unable to allocate session lock");
+    return NULL;
+  }
+  lHandle = PyCapsule_New(lSession, NULL, _destroySession);
+  if (lHandle == NULL) {
+    engClose(ep);
+    PyThread_free_lock(lSession->lock);
+    delete lSession;
+  }
+  return lHandle;
 }
 
 
@@ -864,10 +1653,19 @@ static char close_doc[] =
 PyObject * mlabraw_close(PyObject *, PyObject *args)
 {
   PyObject *lHandle;
+  MlabSession *lSession;
+  int lFailed;
 
   if (! PyArg_ParseTuple(args, "O:close", &lHandle)) return NULL;
-
-  if (engClose((Engine *)PyCapsule_GetPointer(lHandle, NULL)) != 0) {
+  if ((lSession = _getSession(lHandle)) == NULL) return NULL;
+  {
+    SessionLock lLock(lSession);
+    Py_BEGIN_ALLOW_THREADS
+    lFailed = engClose(lSession->ep);
+    Py_END_ALLOW_THREADS
+    lSession->ep = NULL;
+  }
+  if (lFailed != 0) {
     PyErr_SetString(mlabraw_error, "Unable to close session");
     return NULL;
   }
@@ -891,52 +1689,34 @@ static char eval_doc[] =
 
 PyObject * mlabraw_eval(PyObject *, PyObject *args)
 {
-  //XXX how large should this be? used to be 10000, but looks like matlab
-  // hangs when it gets bigger than ~9000 I'm not aware of some actual limit
-  // being documented anywhere; I don't want to make it too small since the
-  // high overhead of engine calls means that it can be potentially useful to
-  // eval large chunks.
-  const int  BUFSIZE=4096;
-  const char* fmt = "try, %s; MLABRAW_ERROR_=0; catch, MLABRAW_ERROR_=1; end;";
-  char buffer[BUFSIZE];
-  char cmd[BUFSIZE];
+  // (there used to be a fixed limit of 4096 bytes on commands and output;
+  // commands are now only limited by what matlab accepts and the output by
+  // the session's output buffer, see `set_output_size`)
+  std::string lCmd;
   char *lStr;
-  char *retStr = buffer;
+  const char *retStr;
   PyObject *ret;
   PyObject *lHandle;
+  MlabSession *lSession;
 
   if (! PyArg_ParseTuple(args, "Os:eval", &lHandle, &lStr)) return NULL;
-  if (! PyCapsule_CheckExact(lHandle)) {
-    PyErr_SetString(PyExc_TypeError, "Invalid object passed as mlabraw session handle");
-	return NULL;
-  }
-
-  bool ok = my_snprintf(cmd, BUFSIZE, fmt, lStr);
-  if (!ok) {
-	  PyErr_SetString(mlabraw_error,
-					  "String too long to evaluate.");
-	  return NULL;
-  }
-  engOutputBuffer((Engine *)PyCapsule_GetPointer(lHandle, NULL), retStr, BUFSIZE-1);
-  if (engEvalString((Engine *)PyCapsule_GetPointer(lHandle, NULL), cmd) != 0) {
-#ifdef PY3K
-    PyObject *u_ret_str = PyUnicode_DecodeFSDefault(retStr);
-    PyObject *encoded_ret_str = PyUnicode_AsUTF8String(u_ret_str);
-    PyErr_SetString(mlabraw_error, PyBytes_AsString(encoded_ret_str));
-    Py_DECREF(encoded_ret_str);
-    Py_DECREF(u_ret_str);
-#else
-    PyErr_SetString(mlabraw_error, retStr);
-#endif
+  if ((lSession = _getSession(lHandle)) == NULL) return NULL;
+  SessionLock lLock(lSession);
+
+  lCmd = "try, ";
+  lCmd += lStr;
+  lCmd += "; MLABRAW_ERROR_=0; catch, MLABRAW_ERROR_=1; end;";
+  _captureOutput(lSession);
+  if (_evalString(lSession, lCmd.c_str()) != 0) {
+    if ((retStr = _capturedOutput(lSession)) != NULL) _setMatlabError(retStr);
     return NULL;
   }
+  if ((retStr = _capturedOutput(lSession)) == NULL) return NULL;
   {
     mxArray *lArray = NULL;
-    char buffer2[BUFSIZE];
-    char *retStr2 = buffer2;
     bool __mlabraw_error;
     const char* MLABRAW_ERROR_ = "MLABRAW_ERROR_";
-    if (NULL == (lArray = _getMatlabVar(lHandle, MLABRAW_ERROR_)) ) {
+    if (NULL == (lArray = _getMatlabVar(lSession, MLABRAW_ERROR_)) ) {
       PyErr_SetString(mlabraw_error,
                       "Something VERY BAD happened whilst trying to evaluate string "
                       "in MATLAB(TM) workspace.");
@@ -945,54 +1725,73 @@ PyObject * mlabraw_eval(PyObject *, PyObject *args)
     __mlabraw_error = (bool)*mxGetPr(lArray);
     mxDestroyArray(lArray);
     if (__mlabraw_error) {
-      engOutputBuffer((Engine *)PyCapsule_GetPointer(lHandle, NULL), retStr2, BUFSIZE-1);
-      if (engEvalString((Engine *)PyCapsule_GetPointer(lHandle, NULL),
-                        "disp(subsref(lasterror(),struct('type','.','subs','message')))") != 0) {
+      // (this discards the output, which is of no interest in that case)
+      _captureOutput(lSession);
+      if (_evalString(lSession,
+                      "disp(subsref(lasterror(),struct('type','.','subs','message')))") != 0) {
+        engOutputBuffer(lSession->ep, NULL, 0);
         PyErr_SetString(mlabraw_error, "THIS SHOULD NOT HAVE HAPPENED!!!");
         return NULL;
       }
-#ifdef PY3K
-    u_ret_str = PyUnicode_DecodeFSDefault(retStr2 + ((strncmp(">> ", retStr2, 3) == 0) ?  3 : 0));
-    encoded_ret_str = PyUnicode_AsUTF8String(u_ret_str);
-    PyErr_SetString(mlabraw_error, PyBytes_AsString(encoded_ret_str));
-    Py_DECREF(encoded_ret_str);
-    Py_DECREF(u_ret_str);
-#else
-      PyErr_SetString(mlabraw_error, retStr2 + ((strncmp(">> ", retStr2, 3) == 0) ?  3 : 0));
-#endif
+      if ((retStr = _capturedOutput(lSession)) != NULL) _setMatlabError(retStr);
       return NULL;
     }
   }
-  if (strncmp(">> ", retStr, 3) == 0) { retStr += 3; } //FIXME
-#ifdef PY3K
-    ret = PyUnicode_DecodeFSDefault(retStr);
-#else
-  ret = (PyObject *)PyString_FromString(retStr);
-#endif
+  ret = _matlabOutput2py(retStr);
   return ret;
 }
 
+static char set_output_size_doc[] =
+"set_output_size(handle, nbytes) -> int\n"
+"\n"
+"Sets how many bytes of output the MATLAB(TM) session keeps per command\n"
+"(1MB by default; output beyond that is lost, with a RuntimeWarning) and\n"
+"returns the previous size.\n"
+;
+
+PyObject * mlabraw_set_output_size(PyObject *, PyObject *args)
+{
+  PyObject *lHandle;
+  Py_ssize_t lSize;
+  size_t lOldSize;
+  MlabSession *lSession;
+
+  if (! PyArg_ParseTuple(args, "On:set_output_size", &lHandle, &lSize))
+    return NULL;
+  if (lSize < 1) {
+    PyErr_SetString(PyExc_ValueError, "nbytes must be positive");
+    return NULL;
+  }
+  if ((lSession = _getSession(lHandle)) == NULL) return NULL;
+  SessionLock lLock(lSession);
+  lOldSize = lSession->outputSize;
+  lSession->outputSize = static_cast<size_t>(lSize);
+  // reallocated on the next use
+  std::vector<char>().swap(lSession->output);
+  lSession->outputUsed = 0;
+  return Py_BuildValue("n", static_cast<Py_ssize_t>(lOldSize));
+}
+
 PyObject * mlabraw_oldeval(PyObject *, PyObject *args)
 {
-  //XXX how large should this be?
-  const int BUFSIZE = 10000;
-  char buffer[BUFSIZE];
   char *lStr;
-  char *retStr = buffer;
+  const char *retStr;
   PyObject *ret;
   PyObject *lHandle;
 
+  MlabSession *lSession;
+
   if (! PyArg_ParseTuple(args, "Os:eval", &lHandle, &lStr)) return NULL;
-  if (! PyCapsule_CheckExact(lHandle)) {
-    PyErr_SetString(PyExc_TypeError, "Invalid object passed as mlabraw session handle");
-    return NULL;
-  }
-  engOutputBuffer((Engine *)PyCapsule_GetPointer(lHandle, NULL), retStr, BUFSIZE-1);
-  if (engEvalString((Engine *)PyCapsule_GetPointer(lHandle, NULL), lStr) != 0) {
+  if ((lSession = _getSession(lHandle)) == NULL) return NULL;
+  SessionLock lLock(lSession);
+  _captureOutput(lSession);
+  if (_evalString(lSession, lStr) != 0) {
+    engOutputBuffer(lSession->ep, NULL, 0);
     PyErr_SetString(mlabraw_error,
                    "Unable to evaluate string in MATLAB(TM) workspace");
     return NULL;
   }
+  if ((retStr = _capturedOutput(lSession)) == NULL) return NULL;
   // skip the prompt if there is one
   if (strncmp(">> ", retStr, 3) == 0) {
     retStr += 3;
@@ -1019,7 +1818,8 @@ PyObject * mlabraw_oldeval(PyObject *, PyObject *args)
 }
 
 static char get_doc[] =
-"get(handle, name) -> array\n"
+"get(handle, name[, order[, struct_as[, leaf[, max_depth[, max_size]]]]])\n"
+"  -> array\n"
 "\n"
 "Gets a matrix from the MATLAB(TM) session\n"
 "\n"
@@ -1030,40 +1830,65 @@ static char get_doc[] =
 "only double-precision floating point arrays (real or complex) are supported.\n"
 "1-D character strings are supported on UNIX platforms.\n"
 "\n"
-"Only 2-dimensional arrays are currently supported. Cell\n"
-"arrays, structure arrays, etc. are not yet supported.\n"
+"Char arrays of more than one row become NumPy unicode arrays (of the rows).\n"
+"Cell arrays become lists (vectors) or object arrays (all others). A single\n"
+"struct becomes a dict; struct arrays become lists of dicts or, if\n"
+"`struct_as` is 'records', record arrays.\n"
+"\n"
+"Parts of cells and structs that can't be converted, as well as cell arrays\n"
+"nested more than `max_depth` levels deep or with more than `max_size`\n"
+"elements, are replaced by the result of calling `leaf` with their MATLAB(TM)\n"
+"expression (e.g. 'x{2}.a'); without `leaf`, they raise a TypeError.\n"
+"\n"
+"Sparse (double or logical) matrices are returned as scipy.sparse.csc_matrix.\n"
 "\n"
 "The return value is a NumPy array with the same shape and elements as the\n"
-"MATLAB(TM) array.\n"
+"MATLAB(TM) array. It is in C order, unless `order` is 'F', in which case\n"
+"MATLAB(TM)'s own (Fortran) order is kept; this saves a copy and, for real\n"
+"arrays, the returned array even shares the memory of the fetched array.\n"
 ;
-PyObject * mlabraw_get(PyObject *, PyObject *args)
+PyObject * mlabraw_get(PyObject *, PyObject *args, PyObject *kwargs)
 {
+  static const char *kwlist[] = {"handle", "name", "order", "struct_as", "leaf",
+                                 "max_depth", "max_size", NULL};
   char *lName;
+  char *lOrder = NULL;
+  char *lStructAs = NULL;
   PyObject *lHandle;
   mxArray *lArray = NULL;
   PyObject *lDest = NULL;
+  MlabSession *lSession;
+  Mx2PyOptions lOpts;
 
-  if (! PyArg_ParseTuple(args, "Os:get", &lHandle, &lName)) return NULL;
-  if (! PyCapsule_CheckExact(lHandle)) {
-    PyErr_SetString(PyExc_TypeError, "Invalid object passed as mlabraw session handle");
+  if (! PyArg_ParseTupleAndKeywords(args, kwargs, "Os|ssOii:get", (char **)kwlist,
+                                    &lHandle, &lName, &lOrder, &lStructAs,
+                                    &lOpts.leafHandler, &lOpts.maxDepth,
+                                    &lOpts.maxSize))
     return NULL;
-  }
-
-  lArray = _getMatlabVar(lHandle, lName);
+  if ((lSession = _getSession(lHandle)) == NULL) return NULL;
+  if (! _parseOrder(lOrder, lOpts) || ! _parseStructAs(lStructAs, lOpts)) return NULL;
+  if (lOpts.leafHandler == Py_None) lOpts.leafHandler = NULL;
+  lOpts.path = lName;
+
+  // (held during the conversion, too, as the leaf handler may well use the
+  // session)
+  SessionLock lLock(lSession);
+  lArray = _getMatlabVar(lSession, lName);
   if (lArray == NULL) {
     PyErr_SetString(mlabraw_error,
                    "Unable to get matrix from MATLAB(TM) workspace");
     return NULL;
   }
 
-  lDest = (PyObject *)mx2py(lArray);
-  
-  mxDestroyArray(lArray);
+  {
+    StopWatch lWatch(lSession->stats.mx2pySeconds);
+    lDest = mx2pyOwned(lArray, lOpts);
+  }
   return lDest;
 }
 
 static char put_doc[] =
-"put(handle, name, array).\n"
+"put(handle, name, array[, native]).\n"
 "\n"
 "Places a matrix into the MATLAB(TM) session.\n"
 "This function places the given array into a MATLAB(TM) workspace under the\n"
@@ -1073,41 +1898,50 @@ static char put_doc[] =
 "The 'array' parameter must be either a NumPy array, list, or tuple\n"
 "containing numbers, or a number, or a string. The MATLAB(TM) \n"
 "array will have the same shape and values, with the following\n"
-"exceptions: the element type will always double or complex and the\n"
-"array-rank will always be 2 (i.e. a matrix).\n"
+"exceptions: the element type will always double or complex (unless\n"
+"`native` is true, in which case NumPy arrays of integer, boolean and single\n"
+"type keep their type) and the array-rank will always be >= 2.\n"
 "\n"
 "A string parameter is converted to a MATLAB char-valued array.\n"
+"\n"
+"A scipy.sparse matrix is converted to a MATLAB(TM) sparse matrix (logical if\n"
+"it is boolean, else double or complex).\n"
 ;
-PyObject * mlabraw_put(PyObject *, PyObject *args)
+PyObject * mlabraw_put(PyObject *, PyObject *args, PyObject *kwargs)
 {
+  static const char *kwlist[] = {"handle", "name", "array", "native", NULL};
   char *lName;
+  int lNative = 0;
   PyObject *lHandle;
   PyObject *lSource;
   mxArray *lArray = NULL;
+  MlabSession *lSession;
+  Py2MxOptions lOpts;
+  int lFailed;
   //FIXME should make these objects const
-  if (! PyArg_ParseTuple(args, "OsO:put", &lHandle, &lName, &lSource)) return NULL;
-  if (! PyCapsule_CheckExact(lHandle)) {
-    PyErr_SetString(PyExc_TypeError, "Invalid object passed as mlabraw session handle");
+  if (! PyArg_ParseTupleAndKeywords(args, kwargs, "OsO|i:put", (char **)kwlist,
+                                    &lHandle, &lName, &lSource, &lNative))
     return NULL;
-  }
+  lOpts.nativeTypes = lNative != 0;
+  if ((lSession = _getSession(lHandle)) == NULL) return NULL;
   Py_INCREF(lSource);
 
-  lArray = (mxArray*)py2mx(lSource);
-  
+  {
+    StopWatch lWatch(lSession->stats.py2mxSeconds);
+    lArray = (mxArray*)py2mx(lSource, lOpts);
+  }
+
   Py_DECREF(lSource);
 
   if (lArray == NULL) {
     return NULL;   // Above converter already set error message
   }
 
-
-// for matlab version >= 6.5 (FIXME UNTESTED)
-#ifdef _V6_5_OR_LATER
-  if (engPutVariable((Engine *)PyCapsule_GetPointer(lHandle, NULL), lName, lArray) != 0) {
-#else
-  mxSetName(lArray, lName);
-  if (engPutArray((Engine *)PyCapsule_GetPointer(lHandle, NULL), lArray) != 0) {
-#endif
+  {
+    SessionLock lLock(lSession);
+    lFailed = _putMatlabVar(lSession, lName, lArray);
+  }
+  if (lFailed != 0) {
     PyErr_SetString(mlabraw_error,
                    "Unable to put matrix into MATLAB(TM) workspace");
     mxDestroyArray(lArray);
@@ -1118,7 +1952,603 @@ PyObject * mlabraw_put(PyObject *, PyObject *args)
   return Py_None;
 }
 
-static const char * DOC = 
+// Returns the contents of the python string `pObj` (NULL and an exception
+// if it isn't one).
+static const char *_asCString(PyObject *pObj)
+{
+#ifdef PY3K
+  return PyUnicode_AsUTF8(pObj);
+#else
+  return PyString_AsString(pObj);
+#endif
+}
+
+// Appends `pSeq` (a python sequence of strings) to `pDst`, quoting each
+// item as a matlab string literal if `pQuote` and separating them by `pSep`.
+static bool _joinStrings(std::string &pDst, PyObject *pSeq, const char *pSep,
+                         bool pQuote)
+{
+  PyObject *lSeq = PySequence_Fast(pSeq, "expected a sequence of strings");
+  if (lSeq == NULL) return false;
+  for (Py_ssize_t i = 0; i != PySequence_Fast_GET_SIZE(lSeq); i++) {
+    const char *lStr = _asCString(PySequence_Fast_GET_ITEM(lSeq, i));
+    if (lStr == NULL) {
+      Py_DECREF(lSeq);
+      return false;
+    }
+    if (i) pDst += pSep;
+    if (pQuote) {
+      pDst += '\'';
+      for (; *lStr; lStr++) {
+        if (*lStr == '\'') pDst += '\'';
+        pDst += *lStr;
+      }
+      pDst += '\'';
+    } else {
+      pDst += lStr;
+    }
+  }
+  Py_DECREF(lSeq);
+  return true;
+}
+
+// Whether `pName` is a valid MATLAB(TM) variable name.
+static bool _isVarName(const char *pName)
+{
+  if (! isalpha((unsigned char)*pName)) return false;
+  for (const char *p = pName; *p; p++) {
+    if (! isalnum((unsigned char)*p) && *p != '_') return false;
+  }
+  return true;
+}
+
+static char put_many_doc[] =
+"put_many(handle, variables[, native])\n"
+"\n"
+"Places several variables into the MATLAB(TM) session at once.\n"
+"\n"
+"`variables` is a dict (or a sequence of (name, value) pairs); the values\n"
+"are converted as for `put` and shipped in a single cell array, which is\n"
+"dealt out to the names in the MATLAB(TM) workspace, so that this costs two\n"
+"engine transactions however many variables there are.\n"
+;
+PyObject * mlabraw_put_many(PyObject *, PyObject *args, PyObject *kwargs)
+{
+  static const char *kwlist[] = {"handle", "variables", "native", NULL};
+  int lNative = 0;
+  PyObject *lHandle;
+  PyObject *lVariables;
+  PyObject *lItems = NULL;
+  PyObject *lSeq = NULL;
+  mxArray *lCell = NULL;
+  MlabSession *lSession;
+  Py2MxOptions lOpts;
+  Py_ssize_t lN;
+  std::string lCmd = "[";
+
+  if (! PyArg_ParseTupleAndKeywords(args, kwargs, "OO|i:put_many", (char **)kwlist,
+                                    &lHandle, &lVariables, &lNative))
+    return NULL;
+  lOpts.nativeTypes = lNative != 0;
+  if ((lSession = _getSession(lHandle)) == NULL) return NULL;
+  if (PyDict_Check(lVariables)) {
+    lItems = PyDict_Items(lVariables);
+  } else {
+    Py_INCREF(lVariables);
+    lItems = lVariables;
+  }
+  if (lItems == NULL) return NULL;
+  lSeq = PySequence_Fast(lItems, "variables must be a dict or a sequence of "
+                         "(name, value) pairs");
+  Py_DECREF(lItems);
+  if (lSeq == NULL) return NULL;
+  lN = PySequence_Fast_GET_SIZE(lSeq);
+  if (lN == 0) {
+    Py_DECREF(lSeq);
+    Py_INCREF(Py_None);
+    return Py_None;
+  }
+
+  {
+    mwSize lDims[2] = {1, static_cast<mwSize>(lN)};
+    lCell = mxCreateCellArray(2, lDims);
+  }
+  if (lCell == NULL) {
+    PyErr_SetString(PyExc_MemoryError, "Unable to create variable cell");
+    goto error_return;
+  }
+  for (Py_ssize_t i = 0; i != lN; i++) {
+    PyObject *lPair = PySequence_Fast_GET_ITEM(lSeq, i);
+    const char *lName;
+    mxArray *lItem;
+    if (! PyTuple_Check(lPair) || PyTuple_GET_SIZE(lPair) != 2) {
+      PyErr_SetString(PyExc_TypeError,
+                      "variables must be a dict or a sequence of "
+                      "(name, value) pairs");
+      goto error_return;
+    }
+    if ((lName = _asCString(PyTuple_GET_ITEM(lPair, 0))) == NULL)
+      goto error_return;
+    if (! _isVarName(lName)) {
+      PyErr_Format(PyExc_ValueError, "Invalid variable name: '%s'", lName);
+      goto error_return;
+    }
+    {
+      StopWatch lWatch(lSession->stats.py2mxSeconds);
+      lItem = py2mx(PyTuple_GET_ITEM(lPair, 1), lOpts);
+    }
+    if (lItem == NULL) {
+      if (! PyErr_Occurred())
+        PyErr_Format(PyExc_TypeError, "Can't convert variable '%s'", lName);
+      goto error_return;
+    }
+    mxSetCell(lCell, i, lItem);
+    if (i) lCmd += ",";
+    lCmd += lName;
+  }
+  lCmd += "]=MLABRAW_MANY__{:}; clear MLABRAW_MANY__;";
+
+  {
+    SessionLock lLock(lSession);
+    if (_putMatlabVar(lSession, "MLABRAW_MANY__", lCell) != 0) {
+      PyErr_SetString(mlabraw_error,
+                      "Unable to put variables into MATLAB(TM) workspace");
+      goto error_return;
+    }
+    if (_evalString(lSession, lCmd.c_str()) != 0) {
+      PyErr_SetString(mlabraw_error,
+                      "Unable to evaluate string in MATLAB(TM) workspace");
+      goto error_return;
+    }
+  }
+  mxDestroyArray(lCell);
+  Py_DECREF(lSeq);
+  Py_INCREF(Py_None);
+  return Py_None;
+
+ error_return:
+  if (lCell) mxDestroyArray(lCell);
+  Py_DECREF(lSeq);
+  return NULL;
+}
+
+static char get_many_doc[] =
+"get_many(handle, names[, order[, struct_as[, leaf[, max_depth[, max_size]]]]])\n"
+"  -> list\n"
+"\n"
+"Gets several variables from the MATLAB(TM) session at once.\n"
+"\n"
+"The variables named in the sequence `names` are collected in a single cell\n"
+"array, which is fetched and taken apart, so that this costs three engine\n"
+"transactions however many variables there are. The other arguments and the\n"
+"conversion are as for `get` (with the expressions for `leaf` starting with\n"
+"the variable names). Returns the list of values, in the order of `names`.\n"
+"\n"
+"If a variable doesn't exist a `mlabraw.error` is raised.\n"
+;
+PyObject * mlabraw_get_many(PyObject *, PyObject *args, PyObject *kwargs)
+{
+  static const char *kwlist[] = {"handle", "names", "order", "struct_as", "leaf",
+                                 "max_depth", "max_size", NULL};
+  const char *MANY_NAME = "MLABRAW_MANY__";
+  char *lOrder = NULL;
+  char *lStructAs = NULL;
+  PyObject *lHandle;
+  PyObject *lNames;
+  PyObject *lSeq = NULL;
+  PyObject *lValues = NULL;
+  mxArray *lOut = NULL;
+  mxArray *lCell;
+  MlabSession *lSession;
+  Mx2PyOptions lOpts;
+  Py_ssize_t lN;
+  std::string lCmd, lClear;
+
+  if (! PyArg_ParseTupleAndKeywords(args, kwargs, "OO|ssOii:get_many", (char **)kwlist,
+                                    &lHandle, &lNames, &lOrder, &lStructAs,
+                                    &lOpts.leafHandler, &lOpts.maxDepth,
+                                    &lOpts.maxSize))
+    return NULL;
+  if ((lSession = _getSession(lHandle)) == NULL) return NULL;
+  if (! _parseOrder(lOrder, lOpts) || ! _parseStructAs(lStructAs, lOpts)) return NULL;
+  if (lOpts.leafHandler == Py_None) lOpts.leafHandler = NULL;
+  lSeq = PySequence_Fast(lNames, "names must be a sequence of strings");
+  if (lSeq == NULL) return NULL;
+  lN = PySequence_Fast_GET_SIZE(lSeq);
+  if (lN == 0) {
+    Py_DECREF(lSeq);
+    return PyList_New(0);
+  }
+  for (Py_ssize_t i = 0; i != lN; i++) {
+    const char *lName = _asCString(PySequence_Fast_GET_ITEM(lSeq, i));
+    if (lName == NULL) goto error_return;
+    if (! _isVarName(lName)) {
+      PyErr_Format(PyExc_ValueError, "Invalid variable name: '%s'", lName);
+      goto error_return;
+    }
+  }
+  lCmd = "try, ";
+  lCmd += MANY_NAME;
+  lCmd += "={0,{";
+  if (! _joinStrings(lCmd, lSeq, ",", false)) goto error_return;
+  lCmd += "}}; catch, ";
+  lCmd += MANY_NAME;
+  lCmd += "={1,lasterr}; end;";
+  lClear = "clear ";
+  lClear += MANY_NAME;
+  lClear += ";";
+
+  {
+    // (held during the conversion, too, as for `get`)
+    SessionLock lLock(lSession);
+    if (_evalString(lSession, lCmd.c_str()) != 0) {
+      PyErr_SetString(mlabraw_error,
+                      "Unable to evaluate string in MATLAB(TM) workspace");
+      goto error_return;
+    }
+    lOut = _getMatlabVar(lSession, MANY_NAME);
+    _evalString(lSession, lClear.c_str());
+    if (lOut == NULL || ! mxIsCell(lOut)) {
+      PyErr_SetString(mlabraw_error,
+                      "Unable to get variables from MATLAB(TM) workspace");
+      goto error_return;
+    }
+    if (mxGetScalar(mxGetCell(lOut, 0)) != 0) {
+      char *lMsg = mxArrayToString(mxGetCell(lOut, 1));
+      PyErr_SetString(mlabraw_error, lMsg ? lMsg : "Unknown MATLAB(TM) error");
+      mxFree(lMsg);
+      goto error_return;
+    }
+    lCell = mxGetCell(lOut, 1);
+    if ((lValues = PyList_New(lN)) == NULL) goto error_return;
+    for (Py_ssize_t i = 0; i != lN; i++) {
+      mxArray *lVal = mxGetCell(lCell, i);
+      PyObject *lValue;
+      // detach the value, so that it can be handed over without copying
+      mxSetCell(lCell, i, NULL);
+      lOpts.path = _asCString(PySequence_Fast_GET_ITEM(lSeq, i));
+      lOpts.depth = 0;
+      {
+        StopWatch lWatch(lSession->stats.mx2pySeconds);
+        lValue = mx2pyOwned(lVal, lOpts);
+      }
+      if (lValue == NULL) goto error_return;
+      PyList_SET_ITEM(lValues, i, lValue);
+    }
+  }
+  mxDestroyArray(lOut);
+  Py_DECREF(lSeq);
+  return lValues;
+
+ error_return:
+  if (lOut) mxDestroyArray(lOut);
+  Py_DECREF(lSeq);
+  Py_XDECREF(lValues);
+  return NULL;
+}
+
+static char call_doc[] =
+"call(handle, fname, args, nout[, argnames[, convert[, clear_args[, order\n"
+"     [, native[, maxbytes[, struct_as[, leaf[, max_depth[, max_size\n"
+"     [, prologue]]]]]]]]]]])\n"
+"  -> (output, classes, values)\n"
+"\n"
+"Calls the MATLAB(TM) function `fname` with `args` and fetches the results\n"
+"in as few engine transactions as possible.\n"
+"\n"
+"All of `args` are shipped in a single cell array and bound to the\n"
+"temporaries 'arg0__', 'arg1__', ... in the MATLAB(TM) workspace. The\n"
+"function is called with these temporaries as arguments, unless the sequence\n"
+"of argument expressions `argnames` is given (e.g. to pass variables that\n"
+"already live in the workspace). If there are no `args` and `argnames` is\n"
+"None, `fname` is evaluated as is (e.g. 'pi' or 'class(x)').\n"
+"\n"
+"`nout` results are assigned to 'RES0__', 'RES1__', ... and classified in\n"
+"the same evaluation. Those whose class (with a '-sparse' suffix for sparse\n"
+"matrices) is in the sequence `convert` are fetched together, converted and\n"
+"cleared; the others are left in the workspace for the caller to deal with.\n"
+"If `maxbytes` is non-negative, numeric and logical results that take up\n"
+"more than `maxbytes` bytes get a '-large' suffix (and thus are left, too).\n"
+"Unless `clear_args` is false the argument temporaries are cleared, too.\n"
+"`order`, `struct_as`, `leaf`, `max_depth` and `max_size` are as for `get`\n"
+"(with the expressions for `leaf` starting with 'RES0__', ...) and `native`\n"
+"as for `put`.\n"
+"\n"
+"The MATLAB(TM) code `prologue` (e.g. clearing variables that are no longer\n"
+"needed) is run first, in the same evaluation.\n"
+"\n"
+"Returns the output of the command, the list of result classes and the list\n"
+"of converted results (with None for results that were not converted).\n"
+"\n"
+"If there is an error a `mlabraw.error` with the error description is raised.\n"
+;
+PyObject * mlabraw_call(PyObject *, PyObject *args, PyObject *kwargs)
+{
+  static const char *kwlist[] = {"handle", "fname", "args", "nout", "argnames",
+                                 "convert", "clear_args", "order", "native",
+                                 "maxbytes", "struct_as", "leaf", "max_depth",
+                                 "max_size", "prologue", NULL};
+  const char *OUT_NAME = "MLABRAW_OUT__";
+  const char *lOutStr;
+  char numBuf[32];
+  char *lFname;
+  char *lOrder = NULL;
+  char *lStructAs = NULL;
+  char *lPrologue = NULL;
+  int lNout;
+  int lClearArgs = 1;
+  int lNative = 0;
+  long lMaxBytes = -1;
+  PyObject *lHandle;
+  PyObject *lArgs;
+  PyObject *lArgNames = Py_None;
+  PyObject *lConvert = Py_None;
+  PyObject *lArgSeq = NULL;
+  PyObject *lOutput = NULL;
+  PyObject *lClasses = NULL;
+  PyObject *lValues = NULL;
+  mxArray *lOut = NULL;
+  MlabSession *lSession;
+  Py_ssize_t lNargs;
+  Mx2PyOptions lOpts;
+  Py2MxOptions lArgOpts;
+  std::string lCmd, lConv, lTemps, lResults, lAllResults, lClear;
+
+  if (! PyArg_ParseTupleAndKeywords(args, kwargs, "OsOi|OOisilsOiis:call", (char **)kwlist,
+                                    &lHandle, &lFname, &lArgs, &lNout,
+                                    &lArgNames, &lConvert, &lClearArgs, &lOrder,
+                                    &lNative, &lMaxBytes, &lStructAs,
+                                    &lOpts.leafHandler, &lOpts.maxDepth,
+                                    &lOpts.maxSize, &lPrologue))
+    return NULL;
+  lArgOpts.nativeTypes = lNative != 0;
+  if ((lSession = _getSession(lHandle)) == NULL) return NULL;
+  if (lNout < 0) {
+    PyErr_SetString(PyExc_ValueError, "nout must be >= 0");
+    return NULL;
+  }
+  if (! _parseOrder(lOrder, lOpts) || ! _parseStructAs(lStructAs, lOpts))
+    return NULL;
+  if (lOpts.leafHandler == Py_None) lOpts.leafHandler = NULL;
+  // the workspace temporaries must not be clobbered by other threads
+  SessionLock lLock(lSession);
+  lArgSeq = PySequence_Fast(lArgs, "args must be a sequence");
+  if (lArgSeq == NULL) return NULL;
+  lNargs = PySequence_Fast_GET_SIZE(lArgSeq);
+
+  // 1. ship all arguments at once
+  if (lNargs) {
+    mwSize lDims[2] = {1, static_cast<mwSize>(lNargs)};
+    mxArray *lCell = mxCreateCellArray(2, lDims);
+    if (lCell == NULL) {
+      PyErr_SetString(PyExc_MemoryError, "Unable to create argument cell");
+      goto error_return;
+    }
+    for (Py_ssize_t i = 0; i != lNargs; i++) {
+      mxArray *lItem;
+      {
+        StopWatch lWatch(lSession->stats.py2mxSeconds);
+        lItem = py2mx(PySequence_Fast_GET_ITEM(lArgSeq, i), lArgOpts);
+      }
+      if (lItem == NULL) {
+        if (! PyErr_Occurred())
+          PyErr_Format(PyExc_TypeError, "Can't convert argument %d", (int)i);
+        mxDestroyArray(lCell);
+        goto error_return;
+      }
+      mxSetCell(lCell, i, lItem);
+      sprintf(numBuf, "%sarg%d__", i ? "," : "", (int)i);
+      lTemps += numBuf;
+    }
+    int lPutFailed = _putMatlabVar(lSession, "MLABRAW_ARGS__", lCell);
+    mxDestroyArray(lCell);
+    if (lPutFailed) {
+      PyErr_SetString(mlabraw_error,
+                      "Unable to put arguments into MATLAB(TM) workspace");
+      goto error_return;
+    }
+  }
+
+  // 2. call, classify and pack the results in a single evaluation
+  for (int i = 0; i != lNout; i++) {
+    sprintf(numBuf, "%sRES%d__", i ? "," : "", i);
+    lResults += numBuf;
+    sprintf(numBuf, " RES%d__", i);
+    lAllResults += numBuf;
+  }
+  // (the convert list goes straight into the tests below, so that nothing
+  // but the arguments is in the workspace while `fname` runs)
+  lConv = "{";
+  if (lConvert != Py_None && ! _joinStrings(lConv, lConvert, ",", true))
+    goto error_return;
+  lConv += "}";
+  if (lPrologue) {
+    lCmd = lPrologue;
+    lCmd += " ";
+  }
+  lCmd += "try, ";
+  if (lNargs) {
+    lCmd += "[" + lTemps + "]=MLABRAW_ARGS__{:}; clear MLABRAW_ARGS__; ";
+  }
+  if (lNout) lCmd += "[" + lResults + "]=";
+  lCmd += lFname;
+  if (lArgNames != Py_None) {
+    lCmd += "(";
+    if (! _joinStrings(lCmd, lArgNames, ",", false)) goto error_return;
+    lCmd += ")";
+  } else if (lNargs) {
+    lCmd += "(" + lTemps + ")";
+  }
+  lCmd += "; MLABRAW_CLS__=cell(1,";
+  sprintf(numBuf, "%d", lNout);
+  lCmd += numBuf;
+  lCmd += "); MLABRAW_VAL__=MLABRAW_CLS__; ";
+  for (int i = 0; i != lNout; i++) {
+    char lClassify[512];
+    sprintf(lClassify,
+            "MLABRAW_CLS__{%d}=class(RES%d__); "
+            "if issparse(RES%d__), MLABRAW_CLS__{%d}=[MLABRAW_CLS__{%d} '-sparse']; ",
+            i + 1, i, i, i + 1, i + 1);
+    lCmd += lClassify;
+    if (lMaxBytes >= 0) {
+      sprintf(lClassify,
+              "elseif isnumeric(RES%d__) || islogical(RES%d__), "
+              "MLABRAW_W__=whos('RES%d__'); "
+              "if MLABRAW_W__.bytes > %ld, MLABRAW_CLS__{%d}=[MLABRAW_CLS__{%d} '-large']; end; ",
+              i, i, i, lMaxBytes, i + 1, i + 1);
+      lCmd += lClassify;
+    }
+    sprintf(lClassify, "end; if any(strcmp(MLABRAW_CLS__{%d},", i + 1);
+    lCmd += lClassify;
+    lCmd += lConv;
+    sprintf(lClassify, ")), MLABRAW_VAL__{%d}=RES%d__; end; ", i + 1, i);
+    lCmd += lClassify;
+  }
+  lCmd += "MLABRAW_OUT__={0,MLABRAW_CLS__,MLABRAW_VAL__}; "
+          "catch, MLABRAW_OUT__={1,lasterr}; end; "
+          "clear MLABRAW_ARGS__ MLABRAW_CLS__ MLABRAW_VAL__ MLABRAW_W__";
+  if (lClearArgs && lNargs) {
+    for (Py_ssize_t i = 0; i != lNargs; i++) {
+      sprintf(numBuf, " arg%d__", (int)i);
+      lCmd += numBuf;
+    }
+  }
+  lCmd += ";";
+
+  _captureOutput(lSession);
+  if (_evalString(lSession, lCmd.c_str()) != 0) {
+    engOutputBuffer(lSession->ep, NULL, 0);
+    PyErr_SetString(mlabraw_error,
+                    "Unable to evaluate string in MATLAB(TM) workspace");
+    goto error_return;
+  }
+  if ((lOutStr = _capturedOutput(lSession)) == NULL) goto clear_return;
+  lOutput = _matlabOutput2py(lOutStr);
+  if (lOutput == NULL) goto clear_return;
+
+  // 3. fetch and convert everything
+  lOut = _getMatlabVar(lSession, OUT_NAME);
+  if (lOut == NULL || ! mxIsCell(lOut)) {
+    PyErr_SetString(mlabraw_error,
+                    "Something VERY BAD happened whilst trying to evaluate string "
+                    "in MATLAB(TM) workspace.");
+    goto error_return;
+  }
+  lClear = "clear ";
+  lClear += OUT_NAME;
+  if (mxGetScalar(mxGetCell(lOut, 0)) != 0) {
+    char *lMsg = mxArrayToString(mxGetCell(lOut, 1));
+    PyErr_SetString(mlabraw_error, lMsg ? lMsg : "Unknown MATLAB(TM) error");
+    mxFree(lMsg);
+    goto clear_return;
+  }
+  lClasses = PyList_New(lNout);
+  lValues = PyList_New(lNout);
+  if (lClasses == NULL || lValues == NULL) goto clear_return;
+  for (int i = 0; i != lNout; i++) {
+    mxArray *lVal = mxGetCell(mxGetCell(lOut, 2), i);
+    PyObject *lClass = mx2char(mxGetCell(mxGetCell(lOut, 1), i));
+    PyObject *lValue = NULL;
+    if (lClass == NULL) goto clear_return;
+    PyList_SET_ITEM(lClasses, i, lClass);
+    int lConverted = lConvert == Py_None ? 0 : PySequence_Contains(lConvert, lClass);
+    if (lConverted < 0) goto clear_return;
+    if (lConverted) {
+      if (lVal == NULL) { // unassigned cell element
+        npy_intp lDims[2] = {0, 0};
+        lValue = PyArray_SimpleNew(2, lDims, PyArray_DOUBLE);
+      } else {
+        // detach the value, so that it can be handed over without copying
+        mxSetCell(mxGetCell(lOut, 2), i, NULL);
+        sprintf(numBuf, "RES%d__", i);
+        lOpts.path = numBuf;
+        StopWatch lWatch(lSession->stats.mx2pySeconds);
+        lValue = mx2pyOwned(lVal, lOpts);
+      }
+      if (lValue == NULL) goto clear_return;
+      sprintf(numBuf, " RES%d__", i);
+      lClear += numBuf;
+    } else {
+      Py_INCREF(Py_None);
+      lValue = Py_None;
+    }
+    PyList_SET_ITEM(lValues, i, lValue);
+  }
+  lClear += ";";
+  mxDestroyArray(lOut);
+  lOut = NULL;
+  if (_evalString(lSession, lClear.c_str()) != 0) {
+    PyErr_SetString(mlabraw_error,
+                    "Unable to evaluate string in MATLAB(TM) workspace");
+    goto error_return;
+  }
+  Py_DECREF(lArgSeq);
+  return Py_BuildValue("(NNN)", lOutput, lClasses, lValues);
+
+ clear_return:
+  // don't leave the results lying around
+  lClear = "clear ";
+  lClear += OUT_NAME + lAllResults + ";";
+  _evalString(lSession, lClear.c_str());
+ error_return:
+  if (lOut) mxDestroyArray(lOut);
+  Py_XDECREF(lArgSeq);
+  Py_XDECREF(lOutput);
+  Py_XDECREF(lClasses);
+  Py_XDECREF(lValues);
+  return NULL;
+}
+
+static char stats_doc[] =
+"stats(handle) -> dict\n"
+"\n"
+"Returns the counters of the session: the number of engine round-trips\n"
+"('evals', 'gets' and 'puts'), the bytes of data sent and received\n"
+"('bytes_put', 'bytes_got') and the seconds spent waiting for the engine\n"
+"('eval_seconds', 'get_seconds', 'put_seconds') and converting arguments\n"
+"and results ('py2mx_seconds', 'mx2py_seconds'; including the time spent in\n"
+"the `leaf` handlers of `get` and `call`) since the session was opened or\n"
+"`reset_stats` was last called.\n"
+;
+
+PyObject * mlabraw_stats(PyObject *, PyObject *args)
+{
+  PyObject *lHandle;
+  MlabSession *lSession;
+
+  if (! PyArg_ParseTuple(args, "O:stats", &lHandle)) return NULL;
+  if ((lSession = _getSession(lHandle)) == NULL) return NULL;
+  const MlabStats &lStats = lSession->stats;
+  return Py_BuildValue("{s:k,s:k,s:k,s:L,s:L,s:d,s:d,s:d,s:d,s:d}",
+                       "evals", lStats.evals, "gets", lStats.gets,
+                       "puts", lStats.puts, "bytes_put", lStats.bytesPut,
+                       "bytes_got", lStats.bytesGot,
+                       "eval_seconds", lStats.evalSeconds,
+                       "get_seconds", lStats.getSeconds,
+                       "put_seconds", lStats.putSeconds,
+                       "py2mx_seconds", lStats.py2mxSeconds,
+                       "mx2py_seconds", lStats.mx2pySeconds);
+}
+
+static char reset_stats_doc[] =
+"reset_stats(handle)\n"
+"\n"
+"Sets all counters of the session (see `stats`) to zero.\n"
+;
+
+PyObject * mlabraw_reset_stats(PyObject *, PyObject *args)
+{
+  PyObject *lHandle;
+  MlabSession *lSession;
+
+  if (! PyArg_ParseTuple(args, "O:reset_stats", &lHandle)) return NULL;
+  if ((lSession = _getSession(lHandle)) == NULL) return NULL;
+  lSession->stats.reset();
+  Py_INCREF(Py_None);
+  return Py_None;
+}
+
+static const char * DOC =
     "Mlabraw -- Low-level MATLAB(tm) Engine Interface\n"
     "\n"
     "  open  - Open a MATLAB(tm) engine session\n"
@@ -1126,6 +2556,15 @@ static const char * DOC =
     "  eval  - Evaluates a string in the MATLAB(tm) session\n"
     "  get   - Gets a matrix from the MATLAB(tm) session\n"
     "  put   - Places a matrix into the MATLAB(tm) session\n"
+    "  put_many, get_many - Place and get several variables at once\n"
+    "  call  - Calls a function and fetches its results in one go\n"
+    "  set_output_size - Sets how much output a session keeps per command\n"
+    "  stats - Returns a session's round-trip, transfer and timing counters\n"
+    "  reset_stats - Resets those\n"
+    "\n"
+    "The GIL is released while waiting for MATLAB(tm), so several sessions can\n"
+    "work in parallel threads; the use of a single session by several threads\n"
+    "is serialized.\n"
     "\n"
     "The Numeric package must be installed for this module to be used.\n"
     "\n"
@@ -1160,8 +2599,14 @@ static PyMethodDef MlabrawMethods[] = {
   { "close",      mlabraw_close,      METH_VARARGS, close_doc },
   { "oldeval",    mlabraw_oldeval,    METH_VARARGS, ""       },
   { "eval",       mlabraw_eval,       METH_VARARGS, eval_doc },  //FIXME doc
-  { "get",        mlabraw_get,        METH_VARARGS, get_doc },
-  { "put",        mlabraw_put,        METH_VARARGS, put_doc },
+  { "get",        (PyCFunction)mlabraw_get, METH_VARARGS|METH_KEYWORDS, get_doc },
+  { "put",        (PyCFunction)mlabraw_put, METH_VARARGS|METH_KEYWORDS, put_doc },
+  { "put_many",   (PyCFunction)mlabraw_put_many, METH_VARARGS|METH_KEYWORDS, put_many_doc },
+  { "get_many",   (PyCFunction)mlabraw_get_many, METH_VARARGS|METH_KEYWORDS, get_many_doc },
+  { "call",       (PyCFunction)mlabraw_call, METH_VARARGS|METH_KEYWORDS, call_doc },
+  { "set_output_size", mlabraw_set_output_size, METH_VARARGS, set_output_size_doc },
+  { "stats",      mlabraw_stats,      METH_VARARGS, stats_doc },
+  { "reset_stats", mlabraw_reset_stats, METH_VARARGS, reset_stats_doc },
   { NULL,         NULL,               0           , NULL}, // sentinel
 };
 
@@ -1214,12 +2659,15 @@ PyMODINIT_FUNC initmlabraw(void)
 
   /* This macro, defined in arrayobject.h, loads the Numeric API interface */
   import_array();
+  // we release the GIL around engine calls
+  PyEval_InitThreads();
   const char *__version__ = "__version__";
   PyModule_AddStringConstant(module, __version__, MLABRAW_VERSION);
   const char *mlabraw_error_str = "mlabraw.error";
   mlabraw_error = PyErr_NewException((char *)mlabraw_error_str, NULL, NULL);
   Py_INCREF(mlabraw_error);
   PyModule_AddObject(module, "error", mlabraw_error);
+  PyModule_AddIntConstant(module, "interleaved_complex", MLABRAW_INTERLEAVED_COMPLEX);
 
 #ifdef PY3K
   return module;
@@ -0,0 +1,229 @@
+/* -*- c-basic-offset: 2 -*-
+  mlabraw_kernels -- bulk copy kernels used by mlabraw to move array data
+  between NumPy's and MATLAB(TM)'s memory layouts.
+
+  All kernels traverse the (possibly strided) N-d side in MATLAB(TM)'s
+  (i.e. fortran) element order and the other side densely; they have no
+  dependencies beyond the C++ standard library so that they can also be
+  benchmarked stand-alone (see ``benchmarks/bench_kernels.cpp``).
+
+  - Notes:
+    * all sizes, indices and strides are 64 bit (on 64 bit platforms); the
+      old per-element loops used ``unsigned int`` counters, which overflow
+      for more than 4G elements.
+    * strides are in bytes and may be negative (e.g. for ``a[::-1]``).
+    * before traversing, dimensions of extent 1 are dropped and dimensions
+      that are contiguous with respect to each other are merged, so any
+      fortran-contiguous array ends up as a single run (a ``memcpy`` if no
+      type conversion is needed) and a C-contiguous matrix as a 2D
+      transposition, which is done in cache-sized blocks.
+*/
+#ifndef MLABRAW_KERNELS_H
+#define MLABRAW_KERNELS_H
+
+#include <cstddef>
+#include <cstring>
+
+namespace mlabraw_kernels {
+
+typedef std::ptrdiff_t index_t;
+
+// A complex number stored as a pair of real and imaginary part (numpy's and
+// the interleaved complex API's layout).
+template <class T>
+struct Complex {
+  T re, im;
+  Complex() {}
+  template <class S>
+  explicit Complex(const Complex<S> &pZ)
+    : re(static_cast<T>(pZ.re)), im(static_cast<T>(pZ.im)) {}
+};
+
+// the same as NPY_MAXDIMS
+const int MAXDIMS = 32;
+// edge length (in elements) of the blocks used for transpositions
+const index_t BLOCK = 32;
+
+// Drops dimensions of extent 1 and merges dimensions that are contiguous with
+// respect to each other; returns the new number of dimensions or -1 if the
+// array is empty.
+inline int simplifyDims(int pNd, const index_t *pShape, const index_t *pStrides,
+                        index_t *pNewShape, index_t *pNewStrides)
+{
+  int lNd = 0;
+  for (int i = 0; i != pNd; i++) {
+    if (pShape[i] == 0) return -1;
+    if (pShape[i] == 1) continue;
+    if (lNd && pStrides[i] == pNewStrides[lNd-1] * pNewShape[lNd-1]) {
+      pNewShape[lNd-1] *= pShape[i];
+    } else {
+      pNewShape[lNd] = pShape[i];
+      pNewStrides[lNd] = pStrides[i];
+      lNd++;
+    }
+  }
+  return lNd;
+}
+
+// Calls ``pOp(p, k)`` for every element of the strided N-d array at `pData`,
+// where ``p`` points at the element and ``k`` is its fortran-order linear
+// index. Returns the number of elements.
+template <class Op>
+inline index_t forEachF(char *pData, int pNd, const index_t *pShape,
+                        const index_t *pStrides, Op &pOp)
+{
+  index_t lShape[MAXDIMS], lStrides[MAXDIMS];
+  int lNd = simplifyDims(pNd, pShape, pStrides, lShape, lStrides);
+  if (lNd < 0) return 0;
+  if (lNd == 0) {
+    pOp(pData, 0);
+    return 1;
+  }
+  if (lNd == 1) {
+    const index_t lStride = lStrides[0];
+    for (index_t i = 0; i != lShape[0]; i++) pOp(pData + i * lStride, i);
+    return lShape[0];
+  }
+  if (lNd == 2) {
+    // blocked, so that neither side walks through memory with huge strides
+    // for long (which matters for transpositions)
+    const index_t lRows = lShape[0], lCols = lShape[1];
+    const index_t lS0 = lStrides[0], lS1 = lStrides[1];
+    for (index_t jj = 0; jj < lCols; jj += BLOCK) {
+      const index_t lJEnd = jj + BLOCK < lCols ? jj + BLOCK : lCols;
+      for (index_t ii = 0; ii < lRows; ii += BLOCK) {
+        const index_t lIEnd = ii + BLOCK < lRows ? ii + BLOCK : lRows;
+        for (index_t j = jj; j != lJEnd; j++) {
+          char *lCol = pData + j * lS1;
+          for (index_t i = ii; i != lIEnd; i++) pOp(lCol + i * lS0, i + j * lRows);
+        }
+      }
+    }
+    return lRows * lCols;
+  }
+  // general case: innermost loop along the first dimension
+  index_t lIdx[MAXDIMS] = {0};
+  index_t k = 0;
+  char *p = pData;
+  for (;;) {
+    for (index_t i = 0; i != lShape[0]; i++) pOp(p + i * lStrides[0], k++);
+    int d = 1;
+    for (; d != lNd; d++) {
+      p += lStrides[d];
+      if (++lIdx[d] != lShape[d]) break;
+      p -= lStrides[d] * lShape[d];
+      lIdx[d] = 0;
+    }
+    if (d == lNd) return k;
+  }
+}
+
+// element operations for `forEachF`
+template <class S, class D>
+struct Gather {            // strided S -> dense D
+  D *dst;
+  void operator()(const char *p, index_t k) { dst[k] = static_cast<D>(*(const S *)p); }
+};
+
+template <class S, class D>
+struct Scatter {           // dense S -> strided D
+  const S *src;
+  void operator()(char *p, index_t k) { *(D *)p = static_cast<D>(src[k]); }
+};
+
+template <class S, class D>
+struct GatherSplit {       // strided interleaved complex S -> dense D planes
+  D *re, *im;
+  void operator()(const char *p, index_t k) {
+    re[k] = static_cast<D>(((const S *)p)[0]);
+    im[k] = static_cast<D>(((const S *)p)[1]);
+  }
+};
+
+template <class S, class D>
+struct ScatterMerge {      // dense S planes -> strided interleaved complex D
+  const S *re, *im;
+  void operator()(char *p, index_t k) {
+    ((D *)p)[0] = static_cast<D>(re[k]);
+    ((D *)p)[1] = static_cast<D>(im[k]);
+  }
+};
+
+// dense -> dense with conversion
+template <class S, class D>
+inline void convert(const S *pSrc, index_t pN, D *pDst)
+{
+  for (index_t i = 0; i != pN; i++) pDst[i] = static_cast<D>(pSrc[i]);
+}
+
+template <class T>
+inline void convert(const T *pSrc, index_t pN, T *pDst)
+{
+  if (pN) std::memcpy(pDst, pSrc, pN * sizeof(T));
+}
+
+// True if the array is fortran-contiguous for elements of `pElSize` bytes.
+inline bool isFortranContiguous(int pNd, const index_t *pShape,
+                                const index_t *pStrides, index_t pElSize)
+{
+  index_t lShape[MAXDIMS], lStrides[MAXDIMS];
+  int lNd = simplifyDims(pNd, pShape, pStrides, lShape, lStrides);
+  return lNd <= 0 || (lNd == 1 && lStrides[0] == pElSize);
+}
+
+// Copies the strided N-d array of S at `pSrc` into the dense fortran-ordered
+// array `pDst`.
+template <class S, class D>
+inline void gatherF(const char *pSrc, int pNd, const index_t *pShape,
+                    const index_t *pStrides, D *pDst)
+{
+  if (isFortranContiguous(pNd, pShape, pStrides, sizeof(S))) {
+    index_t n = 1;
+    for (int i = 0; i != pNd; i++) n *= pShape[i];
+    convert((const S *)pSrc, n, pDst);
+  } else {
+    Gather<S, D> lOp = {pDst};
+    forEachF(const_cast<char *>(pSrc), pNd, pShape, pStrides, lOp);
+  }
+}
+
+// Copies the dense fortran-ordered array `pSrc` into the strided N-d array
+// of D at `pDst`.
+template <class S, class D>
+inline void scatterF(const S *pSrc, int pNd, const index_t *pShape,
+                     const index_t *pStrides, char *pDst)
+{
+  if (isFortranContiguous(pNd, pShape, pStrides, sizeof(D))) {
+    index_t n = 1;
+    for (int i = 0; i != pNd; i++) n *= pShape[i];
+    convert(pSrc, n, (D *)pDst);
+  } else {
+    Scatter<S, D> lOp = {pSrc};
+    forEachF(pDst, pNd, pShape, pStrides, lOp);
+  }
+}
+
+// Deinterleaves the strided N-d complex array at `pSrc` (pairs of S) into the
+// dense fortran-ordered planes `pRe` and `pIm`.
+template <class S, class D>
+inline void gatherSplitF(const char *pSrc, int pNd, const index_t *pShape,
+                         const index_t *pStrides, D *pRe, D *pIm)
+{
+  GatherSplit<S, D> lOp = {pRe, pIm};
+  forEachF(const_cast<char *>(pSrc), pNd, pShape, pStrides, lOp);
+}
+
+// Interleaves the dense fortran-ordered planes `pRe` and `pIm` into the
+// strided N-d complex array at `pDst` (pairs of D).
+template <class S, class D>
+inline void scatterMergeF(const S *pRe, const S *pIm, int pNd,
+                          const index_t *pShape, const index_t *pStrides,
+                          char *pDst)
+{
+  ScatterMerge<S, D> lOp = {pRe, pIm};
+  forEachF(pDst, pNd, pShape, pStrides, lOp);
+}
+
+} // namespace mlabraw_kernels
+
+#endif // MLABRAW_KERNELS_H
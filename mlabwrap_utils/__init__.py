@@ -65,7 +65,7 @@ def find_matlab_root():
                 path_dir = os.path.split(path_dir)[0]
             return path_dir
         except: # Eat exception and continue
-            print 'WARNING: Failed to parse PATH variable containing Matlab'
+            print('WARNING: Failed to parse PATH variable containing Matlab')
 
     # Otherwise loop over the given base paths
     for base_path in base_paths:
@@ -23,6 +23,7 @@ from mlabwrap_utils import isWindows, find_matlab_root
 VERSION_6_5 = [6.0, 5.0, 0.0, 0.0]
 VERSION_7_0 = [7.0, 0.0, 0.0, 0.0]
 VERSION_7_3 = [7.0, 3.0, 0.0, 0.0]
+VERSION_9_4 = [9.0, 4.0, 0.0, 0.0]  # R2018a: interleaved complex API
 VALID_ARCHS = ['GLNX86', 'GLNXI64', 'GLNXA64', 'PCWIN',
                'PCWIN64', 'MAC', 'MACI', 'MACI64']
 
@@ -207,6 +208,10 @@ def main(args):
     # Version >= 7.3
     if cmp(MATLAB_VERSION, VERSION_7_3) >= 0:
         DEFINE_MACROS.append(('_V7_3_OR_LATER', 1))
+    # Version >= 9.4: store complex arrays interleaved like numpy does, so
+    # they can be copied in one go (unless the old split layout is requested)
+    if cmp(MATLAB_VERSION, VERSION_9_4) >= 0 and not args.split_complex:
+        DEFINE_MACROS.append(('MATLAB_DEFAULT_RELEASE', 'R2018a'))
 
     setup(
         name="mlabwrap",
@@ -232,6 +237,10 @@ if __name__ == '__main__':
                         help='The full path to the Matlab root '
                              'e.g. /usr/local/MATLAB/R2013a/',
                         default=find_matlab_root())
+    parser.add_argument('--split-complex', action='store_true',
+                        help='Build against the separate real/imaginary '
+                             'complex API even if Matlab supports the '
+                             'interleaved one (R2018a and later)')
     args = parser.parse_known_args()[0]
 
     main(args)
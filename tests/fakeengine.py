@@ -0,0 +1,2792 @@
+##############################################################################
+############ fakeengine: a stand-in for mlabraw without matlab(tm) ###########
+##############################################################################
+##
+## o keywords: matlab wrapper, testing
+## o license: MIT
+
+"""
+fakeengine
+==========
+
+A pure-python stand-in for ``mlabraw`` that needs no matlab(tm), so that
+mlabwrap's own overhead (round-trips, conversions, leaks) can be measured and
+regression-tested on any box. It lives with the tests, not in the package:
+``mlabwrap`` imports it (from ``sys.path``) instead of ``mlabraw`` if the
+environment variable ``MLABWRAP_ENGINE`` is set to 'fake' when it is
+imported:
+
+$ PYTHONPATH=tests MLABWRAP_ENGINE=fake python tests/test_fakeengine.py
+
+It has the functions of ``mlabraw`` that mlabwrap uses (``open``, ``eval``,
+``get``, ``put``, ``call`` ...) plus ``stats``, and converts values the same
+way; ``call`` even evaluates the very same matlab code, so the round-trips
+that ``stats`` counts match those of the real thing. ``tests/runfake.py``
+runs all the unittests on it.
+
+The "engine" only understands what mlabwrap, its tests and the benchmarks
+send, and nothing more: assignments with one ``()`` or ``{}`` subscript and
+``.`` fields (and growing vectors), ``if``/``elseif``, ``for`` and ``try``,
+command syntax (``clear a b``), ``+``, ``-``, comparisons, ``~``, ``&&``,
+``||``, ``'`` and ``a:b``, and the builtins registered below (``class``,
+``size``, ``clear``, ``whos``, ``struct``, ``cell``, ``sum`` ...). Results
+are never displayed, ``disp`` only lays out text, real matrices and struct
+arrays and ``sprintf`` only knows the escapes. Anything else gives matlab's
+"Undefined function" error, a parse error or an error saying what the fake
+engine can't do.
+
+Every engine round-trip (what ``engEvalString``, ``engGetVariable`` and
+``engPutVariable`` are for the real thing) takes an artificial latency:
+``MLABWRAP_FAKE_LATENCY`` seconds (none if that isn't set), or whatever was
+set for the session with ``set_latency``.
+"""
+
+import io
+import os
+import re
+import sys
+import threading
+import time
+import warnings
+
+import numpy
+
+try:
+    basestring
+except NameError: # python 3
+    basestring = str
+    long = int
+
+__version__ = "1.0.1"
+"""The version of ``mlabraw`` this mimics."""
+
+interleaved_complex = 0
+"""(Results never share memory with the engine, as with the separate complex
+API.)"""
+
+is_fake = True
+"""So that callers can tell this from the real ``mlabraw``."""
+
+DEFAULT_OUTPUT_SIZE = 1 << 20
+
+MATLAB_VERSION = "0.0.0 (fakeengine)"
+"""What ``version`` returns."""
+
+
+class error(Exception):
+    """Matlab errors, as ``mlabraw.error``."""
+    pass
+
+
+class MatlabError(Exception):
+    """An error raised (and possibly caught) in the interpreted code."""
+
+    def __init__(self, message, identifier=''):
+        Exception.__init__(self, message)
+        self.message = message
+        self.identifier = identifier
+
+
+##############################################################################
+# values
+#
+# Numeric, logical and char arrays are numpy arrays of (at least) two
+# dimensions, in matlab's shape (char arrays have 'U1' elements, cell arrays
+# are object arrays of values). Values are never modified in place, so they
+# can be shared freely; assignments build new ones.
+##############################################################################
+
+class Struct(object):
+    """A struct array: the field names (in order) and an object array of
+    dicts, one per element."""
+
+    def __init__(self, fields, elems):
+        self.fields = list(fields)
+        self.elems = elems
+
+    @property
+    def shape(self):
+        return self.elems.shape
+
+    @classmethod
+    def scalar(cls, items):
+        elems = numpy.empty((1, 1), object)
+        elems[0, 0] = dict(items)
+        return cls([name for name, _ in items], elems)
+
+
+class Sparse(object):
+    """A sparse matrix (the data is kept dense, only the class differs)."""
+
+    def __init__(self, data):
+        self.data = data
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+
+class FuncHandle(object):
+    """A handle of the function `name`."""
+
+    def __init__(self, name):
+        self.name = name
+
+    shape = (1, 1)
+
+
+class ProxyTest(object):
+    """An object of the class in ``tests/@proxyTest``, which wraps its
+    `data` (built in, as the fake engine doesn't run m-files)."""
+
+    def __init__(self, data):
+        self.data = data
+
+    @property
+    def shape(self):
+        # (its ``size`` is that of the data)
+        return self.data.shape
+
+
+_INT_TYPES = {'int8': numpy.int8, 'uint8': numpy.uint8,
+              'int16': numpy.int16, 'uint16': numpy.uint16,
+              'int32': numpy.int32, 'uint32': numpy.uint32,
+              'int64': numpy.int64, 'uint64': numpy.uint64}
+
+_NUMERIC_CLASSES = ('double', 'single') + tuple(sorted(_INT_TYPES))
+
+
+def mclass(x):
+    """The matlab class of `x`."""
+    if isinstance(x, Struct):
+        return 'struct'
+    if isinstance(x, Sparse):
+        return mclass(x.data)
+    if isinstance(x, FuncHandle):
+        return 'function_handle'
+    if isinstance(x, ProxyTest):
+        return 'proxyTest'
+    kind = x.dtype.kind
+    if kind == 'O':
+        return 'cell'
+    if kind == 'U':
+        return 'char'
+    if kind == 'b':
+        return 'logical'
+    if kind in 'fc':
+        return 'single' if x.dtype in (numpy.float32,
+                                       numpy.complex64) else 'double'
+    return x.dtype.name
+
+
+def _numel(x):
+    return int(numpy.prod(x.shape))
+
+
+def _norm_shape(shape):
+    """Matlab's form of `shape`: at least 2D, no trailing singletons."""
+    shape = tuple(int(d) for d in shape)
+    if len(shape) < 2:
+        shape = ((1,) + shape + (1,))[-2:] if shape else (1, 1)
+    while len(shape) > 2 and shape[-1] == 1:
+        shape = shape[:-1]
+    return shape
+
+
+def _arr(a):
+    """`a` as a matlab-shaped numpy array (1D arrays become rows)."""
+    a = numpy.asarray(a)
+    if a.ndim < 2:
+        return a.reshape(1, a.size)
+    shape = _norm_shape(a.shape)
+    return a if shape == a.shape else a.reshape(shape)
+
+
+def _empty(dtype=numpy.float64):
+    return numpy.zeros((0, 0), dtype)
+
+
+def _scalar(v):
+    return numpy.array([[v]], numpy.float64)
+
+
+def _bool(v):
+    return numpy.array([[bool(v)]])
+
+
+def _row(values):
+    return numpy.array(values, numpy.float64).reshape(1, len(values))
+
+
+def _text(s):
+    """`s` as a unicode string."""
+    if isinstance(s, bytes):
+        try:
+            return s.decode('utf-8')
+        except UnicodeDecodeError:
+            return s.decode('latin-1')
+    return s
+
+
+def _native(s):
+    """The unicode string `s` as a native string."""
+    if sys.version_info[0] < 3:
+        return s.encode('utf-8')
+    return s
+
+
+def _str(s):
+    """A char row vector (or the 0x0 char array for an empty string)."""
+    s = _text(s)
+    if not s:
+        return numpy.zeros((0, 0), 'U1')
+    return numpy.array(list(s), 'U1').reshape(1, len(s))
+
+
+def _codes(x):
+    """The character codes of the char array `x` (as uint32)."""
+    return numpy.ascontiguousarray(x, 'U1').view(numpy.uint32).reshape(
+        x.shape)
+
+
+def _is_char(x):
+    return isinstance(x, numpy.ndarray) and x.dtype.kind == 'U'
+
+
+def _is_cell(x):
+    return isinstance(x, numpy.ndarray) and x.dtype.kind == 'O'
+
+
+def _is_numeric(x):
+    """Numeric or logical (but not char), including sparse."""
+    if isinstance(x, Sparse):
+        return True
+    return isinstance(x, numpy.ndarray) and x.dtype.kind in 'biufc'
+
+
+def _to_str(x, what="argument"):
+    """The contents of the char row vector `x` as a unicode string."""
+    if not _is_char(x):
+        raise MatlabError("Expected %s to be a string." % what)
+    if x.size == 0:
+        return u''
+    if x.ndim != 2 or x.shape[0] != 1:
+        raise MatlabError("Expected %s to be a string (a row vector)." %
+                          what)
+    return u''.join(x[0])
+
+
+def _flat(x):
+    """The elements of `x` in matlab's order, as a 1D array."""
+    if isinstance(x, Struct):
+        return x.elems.ravel(order='F')
+    if isinstance(x, Sparse):
+        return x.data.ravel(order='F')
+    return x.ravel(order='F')
+
+
+def _rebuild(x, flat, shape):
+    """A value of the same kind as `x` with the elements `flat` (in
+    matlab's order) and the shape `shape`."""
+    data = numpy.asarray(flat).reshape(_norm_shape(shape), order='F')
+    if isinstance(x, Struct):
+        return Struct(x.fields, data)
+    if isinstance(x, Sparse):
+        return Sparse(data)
+    return data
+
+
+def _new_elements(x, n):
+    """`n` default elements (in a 1D array) for growing `x`."""
+    if isinstance(x, Struct) or _is_cell(x):
+        elems = numpy.empty(n, object)
+        for i in range(n):
+            elems[i] = (dict((f, _empty()) for f in x.fields)
+                        if isinstance(x, Struct) else _empty())
+        return elems
+    return numpy.zeros(n, x.dtype)
+
+
+def _cell(values, shape=None):
+    """A cell array of `values` (a row, unless `shape` is given)."""
+    values = list(values)
+    res = numpy.empty(len(values), object)
+    for i, v in enumerate(values):
+        res[i] = v
+    if shape is None:
+        shape = (1, len(values)) if values else (0, 0)
+    return res.reshape(shape, order='F')
+
+
+def _mx_bytes(x):
+    """The size of the data of `x` as mlabraw's ``stats`` count it."""
+    if isinstance(x, Struct):
+        return sum([_mx_bytes(e[f]) for e in x.elems.flat for f in x.fields])
+    if _is_cell(x):
+        return sum([_mx_bytes(e) for e in x.flat])
+    if isinstance(x, Sparse):
+        nzmax = max(int(numpy.count_nonzero(x.data)), 1)
+        return (nzmax * x.data.dtype.itemsize +
+                8 * (nzmax + x.shape[1] + 1))
+    if isinstance(x, FuncHandle):
+        return 0
+    if isinstance(x, ProxyTest):
+        return _mx_bytes(x.data)
+    if x.dtype.kind == 'U':
+        return 2 * x.size
+    return x.dtype.itemsize * x.size
+
+
+##############################################################################
+# the lexer
+##############################################################################
+
+_KEYWORDS = frozenset(['if', 'elseif', 'end', 'for', 'try', 'catch'])
+
+_TOKEN_RE = re.compile(r"""
+    (?P<ws>[ \t]+|\.\.\.[^\n]*(?:\n|$)|%[^\n]*)
+  | (?P<nl>\r?\n)
+  | (?P<num>(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?)
+  | (?P<id>[A-Za-z_]\w*)
+  | (?P<op>==|~=|&&|\|\||[-+<>=~:,;()\[\]{}.@'])
+""", re.X)
+
+_COMMAND_RE = re.compile(
+    # one of _COMMAND_FUNCS followed by blanks and something that doesn't
+    # make it an assignment, a call or a binary operation
+    r"([A-Za-z_]\w*)[ \t]+(?![=(]|[-+<>=~&|:.]+[ \t]|[;,\n%])")
+
+_COMMAND_FUNCS = frozenset(['clear', 'diary', 'disp', 'cd', 'addpath',
+                            'help', 'who', 'whos', 'pause'])
+"""What is used with command syntax (``clear a b``) if followed by a word;
+for other names there is none."""
+
+
+class _Token(object):
+    __slots__ = ('kind', 'value', 'space')
+
+    def __init__(self, kind, value, space):
+        self.kind = kind
+        self.value = value
+        self.space = space
+
+
+def _quoted_string(src, pos):
+    """The matlab string starting with the quote at `pos` and the position
+    after it."""
+    end = pos + 1
+    text = []
+    while True:
+        if end >= len(src) or src[end] in '\r\n':
+            raise MatlabError("String is not terminated properly.",
+                              'MATLAB:m_improper_string')
+        if src[end] == "'":
+            if src[end + 1:end + 2] != "'":
+                return ''.join(text), end + 1
+            end += 1
+        text.append(src[end])
+        end += 1
+
+
+def _command_args(src, pos):
+    """Parses the arguments of a command syntax call starting at `pos`;
+    returns them and the position after them."""
+    args = []
+    cur = None
+    while pos < len(src) and src[pos] not in ';,\n%':
+        c = src[pos]
+        if c in ' \t':
+            if cur is not None:
+                args.append(cur)
+                cur = None
+            pos += 1
+        elif c == "'":
+            text, pos = _quoted_string(src, pos)
+            cur = (cur or '') + text
+        else:
+            cur = (cur or '') + c
+            pos += 1
+    if cur is not None:
+        args.append(cur)
+    return args, pos
+
+
+def _tokenize(src):
+    toks = []
+    brackets = []
+    pos = 0
+    space = False
+    stmt_start = True
+    while pos < len(src):
+        if stmt_start and not brackets:
+            m = _COMMAND_RE.match(src, pos)
+            if m and m.group(1) in _COMMAND_FUNCS:
+                args, pos = _command_args(src, m.end())
+                toks.append(_Token('cmd', (m.group(1), args), space))
+                stmt_start = space = False
+                continue
+        if src[pos] == "'":
+            prev = toks[-1] if toks else None
+            if (prev is not None and
+                (prev.kind in ('id', 'num') or
+                 prev.kind == 'op' and prev.value in (')', ']', '}', "'") or
+                 prev.kind == 'kw' and prev.value == 'end' and brackets) and
+                not (space and brackets and brackets[-1] in '[{')):
+                toks.append(_Token('op', "'", space))
+                pos += 1
+            else:
+                text, pos = _quoted_string(src, pos)
+                toks.append(_Token('str', text, space))
+            stmt_start = space = False
+            continue
+        m = _TOKEN_RE.match(src, pos)
+        if m is None:
+            raise MatlabError("Parse error at '%s': usage might be invalid "
+                              "MATLAB syntax." % src[pos:pos + 10],
+                              'MATLAB:m_invalid_character')
+        pos = m.end()
+        kind = m.lastgroup
+        value = m.group(kind)
+        if kind == 'ws':
+            space = True
+            continue
+        if kind == 'nl':
+            kind, value = 'op', ';' if brackets else '\n'
+        if kind == 'id' and value in _KEYWORDS:
+            kind = 'kw'
+        elif kind == 'op':
+            if value in '([{':
+                brackets.append(value)
+            elif value in ')]}' and brackets:
+                brackets.pop()
+        toks.append(_Token(kind, value, space))
+        stmt_start = not brackets and (
+            kind == 'op' and value in (';', ',', '\n') or
+            kind == 'kw' and value == 'try')
+        space = False
+    return toks
+
+
+##############################################################################
+# the parser
+#
+# Expressions are tuples: ('num', value), ('str', text), ('id', name),
+# ('end',), ('colon',), ('binop', op, left, right), ('not', x),
+# ('transpose', x), ('andand', l, r), ('oror', l, r), ('range', start,
+# stop), ('matrix', rows), ('cell', rows), ('index', base, subs) (with subs
+# like ('()', args), ('{}', args), ('.', name), ('.()', expr)) and
+# ('fhandle', name).
+##############################################################################
+
+_EOF = _Token('eof', None, False)
+
+_BINARY_LEVELS = [('==', '~=', '<', '>'), None, ('+', '-')]
+"""The binary operators by increasing precedence (None: ranges)."""
+
+
+class _Parser(object):
+
+    def __init__(self, toks):
+        self.toks = toks
+        self.i = 0
+        self.matrix = [False]
+
+    def peek(self, k=0):
+        i = self.i + k
+        return self.toks[i] if i < len(self.toks) else _EOF
+
+    def next(self):
+        tok = self.peek()
+        self.i += 1
+        return tok
+
+    def is_op(self, value, k=0):
+        tok = self.peek(k)
+        return tok.kind == 'op' and tok.value == value
+
+    def expect_op(self, value):
+        tok = self.next()
+        if tok.kind != 'op' or tok.value != value:
+            self.fail(tok, value)
+
+    def expect_kw(self, *values):
+        tok = self.next()
+        if tok.kind != 'kw' or tok.value not in values:
+            self.fail(tok, values[-1])
+        return tok.value
+
+    def fail(self, tok, expected=None):
+        what = "end of input" if tok.kind == 'eof' else "'%s'" % (
+            tok.value if tok.kind != 'cmd' else tok.value[0])
+        if expected:
+            msg = "Parse error at %s: expected '%s'." % (what, expected)
+        else:
+            msg = ("Parse error at %s: usage might be invalid MATLAB "
+                   "syntax." % what)
+        raise MatlabError(msg, 'MATLAB:m_parse_error')
+
+    # statements
+
+    def program(self):
+        body = self.block(())
+        if self.peek().kind != 'eof':
+            self.fail(self.peek())
+        return body
+
+    def block(self, terminators):
+        stmts = []
+        while True:
+            tok = self.peek()
+            if tok.kind == 'eof' or (tok.kind == 'kw' and
+                                     tok.value in terminators):
+                return stmts
+            if tok.kind == 'op' and tok.value in (';', ',', '\n'):
+                self.i += 1
+                continue
+            stmts.append(self.statement())
+
+    def end_of_statement(self):
+        """Consumes the separator after a statement (results are never
+        displayed)."""
+        tok = self.peek()
+        if tok.kind == 'op' and tok.value in (';', ',', '\n'):
+            self.i += 1
+        elif tok.kind not in ('eof', 'kw'):
+            self.fail(tok)
+
+    def statement(self):
+        tok = self.peek()
+        if tok.kind == 'kw':
+            self.i += 1
+            return getattr(self, 'parse_' + tok.value, self.fail)(tok)
+        if tok.kind == 'cmd':
+            self.i += 1
+            stmt = ('cmd', tok.value[0], tok.value[1])
+        elif tok.kind == 'op' and tok.value == '[' and self.multi_lhs():
+            stmt = ('assign', self.multi_lhs(True), self.expr())
+        else:
+            start = self.i
+            lhs = self.lhs()
+            if lhs is not None and self.is_op('='):
+                self.i += 1
+                stmt = ('assign', [lhs], self.expr())
+            else:
+                self.i = start
+                stmt = ('expr', self.expr())
+        self.end_of_statement()
+        return stmt
+
+    def lhs(self):
+        """Parses ``name`` followed by subscripts (or returns None)."""
+        tok = self.next()
+        if tok.kind != 'id':
+            return None
+        subs = []
+        while True:
+            if self.is_op('(') or self.is_op('{'):
+                close = ')' if self.next().value == '(' else '}'
+                subs.append(('()' if close == ')' else '{}',
+                             self.args(close)))
+            elif self.is_op('.') and self.peek(1).kind == 'id':
+                subs.append(('.', self.peek(1).value))
+                self.i += 2
+            else:
+                return ('lhs', tok.value, subs)
+
+    def multi_lhs(self, parse=False):
+        """Whether ``[a, b(1)] =`` follows; parses it if `parse`."""
+        depth = k = 0
+        while True:
+            tok = self.peek(k)
+            if tok.kind == 'eof':
+                return False
+            if tok.kind == 'op' and tok.value in '([{':
+                depth += 1
+            elif tok.kind == 'op' and tok.value in ')]}':
+                depth -= 1
+                if depth == 0:
+                    break
+            k += 1
+        if not parse:
+            return self.is_op('=', k + 1)
+        self.i += 1
+        targets = []
+        while not self.is_op(']'):
+            if self.is_op(','):
+                self.i += 1
+            else:
+                lhs = self.lhs()
+                if lhs is None:
+                    self.fail(self.peek(-1))
+                targets.append(lhs)
+        self.i += 2 # ']' and '='
+        return targets
+
+    def parse_if(self, tok):
+        clauses = [(self.expr(), self.block(('elseif', 'end')))]
+        while self.expect_kw('elseif', 'end') == 'elseif':
+            clauses.append((self.expr(), self.block(('elseif', 'end'))))
+        self.end_of_statement()
+        return ('if', clauses)
+
+    def parse_for(self, tok):
+        var = self.next()
+        if var.kind != 'id':
+            self.fail(var)
+        self.expect_op('=')
+        values = self.expr()
+        body = self.block(('end',))
+        self.expect_kw('end')
+        self.end_of_statement()
+        return ('for', var.value, values, body)
+
+    def parse_try(self, tok):
+        body = self.block(('catch', 'end'))
+        handler = []
+        if self.expect_kw('catch', 'end') == 'catch':
+            handler = self.block(('end',))
+            self.expect_kw('end')
+        self.end_of_statement()
+        return ('try', body, handler)
+
+    # expressions
+
+    def nested(self, parse, *args):
+        """Runs `parse` outside of any matrix brackets."""
+        self.matrix.append(False)
+        try:
+            return parse(*args)
+        finally:
+            self.matrix.pop()
+
+    def expr(self):
+        left = self.andand()
+        while self.is_op('||'):
+            self.i += 1
+            left = ('oror', left, self.andand())
+        return left
+
+    def andand(self):
+        left = self.binary(0)
+        while self.is_op('&&'):
+            self.i += 1
+            left = ('andand', left, self.binary(0))
+        return left
+
+    def binary(self, level):
+        if level == len(_BINARY_LEVELS):
+            return self.unary()
+        ops = _BINARY_LEVELS[level]
+        if ops is None:
+            return self.range(level)
+        left = self.binary(level + 1)
+        while (self.peek().kind == 'op' and self.peek().value in ops and
+               not self.splits()):
+            op = self.next().value
+            left = ('binop', op, left, self.binary(level + 1))
+        return left
+
+    def range(self, level):
+        start = self.binary(level + 1)
+        if not self.is_op(':') or self.splits():
+            return start
+        self.i += 1
+        return ('range', start, self.binary(level + 1))
+
+    def splits(self):
+        """Whether the (binary) operator ahead separates two elements of a
+        matrix (``[a -b]``) rather than joining them."""
+        tok = self.peek()
+        return (self.matrix[-1] and tok.space and
+                not self.peek(1).space and tok.value in ('+', '-'))
+
+    def unary(self):
+        if self.is_op('~'):
+            self.i += 1
+            return ('not', self.unary())
+        return self.postfix()
+
+    def postfix(self):
+        node = self.primary()
+        subs = []
+        while self.peek().kind == 'op':
+            tok = self.peek()
+            if tok.value in ('(', '{') and not (self.matrix[-1] and
+                                                tok.space):
+                self.i += 1
+                close = ')' if tok.value == '(' else '}'
+                subs.append((tok.value + close, self.args(close)))
+            elif tok.value == '.' and self.peek(1).kind in ('id', 'kw'):
+                subs.append(('.', self.peek(1).value))
+                self.i += 2
+            elif tok.value == '.' and self.is_op('(', 1):
+                self.i += 2
+                subs.append(('.()', self.nested(self.expr)))
+                self.expect_op(')')
+            elif tok.value == "'":
+                self.i += 1
+                if subs:
+                    node, subs = ('index', node, subs), []
+                node = ('transpose', node)
+            else:
+                break
+        return ('index', node, subs) if subs else node
+
+    def args(self, close):
+        """Parses the arguments of a call or index up to `close`."""
+        args = []
+        if self.is_op(close):
+            self.i += 1
+            return args
+        while True:
+            if self.is_op(':') and (self.is_op(',', 1) or
+                                    self.is_op(close, 1)):
+                self.i += 1
+                args.append(('colon',))
+            else:
+                args.append(self.nested(self.expr))
+            tok = self.next()
+            if tok.kind == 'op' and tok.value == close:
+                return args
+            if tok.kind != 'op' or tok.value != ',':
+                self.fail(tok, close)
+
+    def primary(self):
+        tok = self.next()
+        if tok.kind == 'num':
+            return ('num', float(tok.value))
+        if tok.kind in ('str', 'id'):
+            return (tok.kind, tok.value)
+        if tok.kind == 'kw' and tok.value == 'end':
+            return ('end',)
+        if tok.kind == 'op' and tok.value in ('[', '{'):
+            close = ']' if tok.value == '[' else '}'
+            return ('matrix' if close == ']' else 'cell',
+                    self.matrix_rows(close))
+        if tok.kind == 'op' and tok.value == '@' and self.peek().kind == 'id':
+            return ('fhandle', self.next().value)
+        self.fail(tok)
+
+    def matrix_rows(self, close):
+        rows = [[]]
+        self.matrix.append(True)
+        try:
+            while True:
+                tok = self.peek()
+                if tok.kind == 'eof':
+                    self.fail(tok, close)
+                if tok.kind == 'op' and tok.value in (close, ';', '\n', ','):
+                    self.i += 1
+                    if tok.value == close:
+                        break
+                    if tok.value != ',':
+                        rows.append([])
+                    continue
+                rows[-1].append(self.expr())
+        finally:
+            self.matrix.pop()
+        return [row for row in rows if row]
+
+
+def _parse(src):
+    return _Parser(_tokenize(src)).program()
+
+
+##############################################################################
+# operations on values
+##############################################################################
+
+class _Colon(object):
+    """A ``:`` subscript."""
+
+    def __repr__(self):
+        return ':'
+
+COLON = _Colon()
+
+
+def _is_colon(sub):
+    return sub is COLON or (_is_char(sub) and sub.size == 1 and
+                            sub.flat[0] == u':')
+
+
+def _undefined_operator(op, x):
+    return MatlabError("Undefined function or method '%s' for input "
+                       "arguments of type '%s'." % (op, mclass(x)),
+                       'MATLAB:UndefinedFunction')
+
+
+def _operand(x, op='plus'):
+    """`x` as a float (or complex) numpy array for arithmetic."""
+    if isinstance(x, Sparse):
+        x = x.data
+    if isinstance(x, (Struct, FuncHandle)) or x.dtype.kind == 'O':
+        raise _undefined_operator(op, x)
+    if x.dtype.kind == 'U':
+        return _codes(x).astype(numpy.float64)
+    return x.astype(numpy.complex128 if x.dtype.kind == 'c' else
+                    numpy.float64)
+
+
+def _result_class(a, b, op='plus'):
+    """The class of the result of an arithmetic operation on `a` and `b`."""
+    ca, cb = mclass(a), mclass(b)
+    for x, c in ((a, ca), (b, cb)):
+        if c in ('cell', 'struct', 'function_handle'):
+            raise _undefined_operator(op, x)
+    ia, ib = ca in _INT_TYPES, cb in _INT_TYPES
+    if ia and ib and ca != cb:
+        raise MatlabError("Integers can only be combined with integers of "
+                          "the same class, or scalar doubles.",
+                          'MATLAB:mixedClasses')
+    if ia or ib:
+        return ca if ia else cb
+    return 'single' if 'single' in (ca, cb) else 'double'
+
+
+def _cast(r, cls):
+    """The float/complex array `r` converted to the class `cls`."""
+    complex_ = numpy.iscomplexobj(r)
+    if cls == 'double':
+        return r.astype(numpy.complex128 if complex_ else numpy.float64)
+    if cls == 'single':
+        return r.astype(numpy.complex64 if complex_ else numpy.float32)
+    if cls == 'logical':
+        return r != 0
+    itype = _INT_TYPES[cls]
+    info = numpy.iinfo(itype)
+    with numpy.errstate(all='ignore'):
+        r = numpy.where(numpy.isnan(r.real), 0, r.real)
+        # round half away from zero and saturate, as matlab does
+        r = numpy.sign(r) * numpy.floor(numpy.abs(r) + 0.5)
+        r = numpy.clip(r, float(info.min), float(info.max))
+    return r.astype(itype)
+
+
+def _result(r, cls):
+    """The result `r` of an arithmetic operation as a value of class
+    `cls` (complex results with no imaginary part become real)."""
+    r = numpy.asarray(r)
+    if numpy.iscomplexobj(r) and not r.imag.any():
+        r = r.real
+    return _arr(_cast(r, cls))
+
+
+def _as_class(x, cls):
+    """The numeric, logical or char array `x` converted to `cls`."""
+    if isinstance(x, Sparse):
+        x = x.data
+    if mclass(x) == cls:
+        return x
+    return _cast(_operand(x, cls), cls)
+
+
+def _expand(a, b):
+    """`a` and `b` with matching numbers of dimensions, checking that
+    matlab's implicit expansion applies."""
+    n = max(a.ndim, b.ndim)
+    a = a.reshape(a.shape + (1,) * (n - a.ndim))
+    b = b.reshape(b.shape + (1,) * (n - b.ndim))
+    for da, db in zip(a.shape, b.shape):
+        if da != db and da != 1 and db != 1:
+            raise MatlabError("Matrix dimensions must agree.",
+                              'MATLAB:dimagree')
+    return a, b
+
+
+_ARITHMETIC = {'+': (numpy.add, 'plus'), '-': (numpy.subtract, 'minus'),
+               '.*': (numpy.multiply, 'times')}
+
+_RELATIONAL = {'==': numpy.equal, '~=': numpy.not_equal, '<': numpy.less,
+               '>': numpy.greater}
+
+
+def _logical(x, op='and'):
+    """`x` as a boolean array (for ``~``, ``if`` ...)."""
+    if isinstance(x, numpy.ndarray) and x.dtype.kind == 'b':
+        return x
+    return _operand(x, op) != 0
+
+
+def _truth(x):
+    """Whether `x` counts as true in an ``if``."""
+    return _numel(x) > 0 and bool(_logical(x).all())
+
+
+def _scalar_truth(x, op):
+    """The truth of an operand of ``&&`` or ``||``."""
+    if _numel(x) != 1:
+        raise MatlabError("Operands to the || and && operators must be "
+                          "convertible to logical scalar values.",
+                          'MATLAB:nonLogicalConversion')
+    return bool(_logical(x, op).flat[0])
+
+
+def _binop(op, a, b):
+    """Applies the binary operator `op` to `a` and `b`."""
+    if op in _ARITHMETIC:
+        fn, name = _ARITHMETIC[op]
+        cls = _result_class(a, b, name)
+        A, B = _expand(_operand(a, name), _operand(b, name))
+        with numpy.errstate(all='ignore'):
+            return _result(fn(A, B), cls)
+    A, B = _expand(_operand(a, 'eq'), _operand(b, 'eq'))
+    if op not in ('==', '~='):
+        A, B = A.real, B.real
+    return _arr(_RELATIONAL[op](A, B))
+
+
+def _transpose(x):
+    if not isinstance(x, numpy.ndarray) or len(x.shape) > 2:
+        raise MatlabError("The fake engine only transposes 2-D arrays.")
+    r = x.T.copy()
+    return r.conj() if x.dtype.kind == 'c' else r
+
+
+def _colon(start, stop):
+    """``start:stop``."""
+    if _numel(start) == 0 or _numel(stop) == 0:
+        return numpy.zeros((1, 0))
+    s = _operand(start).flat[0].real
+    e = _operand(stop).flat[0].real
+    return _row(s + numpy.arange(max(int(numpy.floor(e - s)) + 1, 0)))
+
+
+def _concat(values, axis):
+    """Concatenates `values` along `axis` (0 for ``[a; b]``, 1 for
+    ``[a, b]``)."""
+    if len(values) == 1:
+        return values[0]
+    values = [v.data if isinstance(v, Sparse) else v for v in values]
+    if any(isinstance(v, (Struct, FuncHandle)) for v in values):
+        raise MatlabError("The fake engine doesn't concatenate structs or "
+                          "function handles.")
+    if any(_is_cell(v) for v in values):
+        parts = [v if _is_cell(v) else _cell([v], (1, 1)) for v in values
+                 if _is_cell(v) or _numel(v)]
+        return _join([v for v in parts if v.size], axis) if any(
+            v.size for v in parts) else _cell([])
+    nonempty = [v for v in values if v.size]
+    if not nonempty:
+        return values[0]
+    classes = set(mclass(v) for v in nonempty)
+    if len(classes) == 1:
+        return _join(nonempty, axis)
+    if 'char' in classes:
+        raise MatlabError("The fake engine doesn't concatenate text with "
+                          "other classes.")
+    return _join([_as_class(v, 'double') for v in nonempty], axis)
+
+
+def _join(parts, axis):
+    n = max(max(p.ndim for p in parts), axis + 1)
+    parts = [p.reshape(p.shape + (1,) * (n - p.ndim)) for p in parts]
+    for p in parts[1:]:
+        if any(a != b for k, (a, b) in enumerate(zip(p.shape,
+                                                     parts[0].shape))
+               if k != axis):
+            raise MatlabError("Dimensions of matrices being concatenated "
+                              "are not consistent.",
+                              'MATLAB:catenate:dimensionMismatch')
+    return _arr(numpy.concatenate(parts, axis))
+
+
+# indexing
+
+def _subscript(sub, extent):
+    """The 0-based indices (in matlab's order) that the subscript `sub`
+    selects from a dimension of length `extent` (None: no bounds check)
+    and the shape of the subscript (the fake engine has no logical
+    masks)."""
+    if _is_colon(sub):
+        return numpy.arange(extent), (extent, 1)
+    if not isinstance(sub, numpy.ndarray) or sub.dtype.kind not in 'iuf':
+        raise MatlabError("Subscript indices must either be real positive "
+                          "integers or logicals.", 'MATLAB:badsubscript')
+    values = sub.ravel(order='F')
+    if (values < 1).any() or (values != numpy.floor(values)).any():
+        raise MatlabError("Subscript indices must either be real "
+                          "positive integers or logicals.",
+                          'MATLAB:badsubscript')
+    idx = values.astype(numpy.intp) - 1
+    if extent is not None and idx.size and idx.max() >= extent:
+        raise MatlabError("Index exceeds matrix dimensions.",
+                          'MATLAB:badsubscript')
+    return idx, sub.shape
+
+
+def _index_dims(shape, n):
+    """The dimensions that `n` subscripts index (the trailing ones are
+    merged into the last)."""
+    dims = list(shape) + [1] * (n - len(shape))
+    if len(dims) > n:
+        dims = dims[:n - 1] + [int(numpy.prod(dims[n - 1:]))]
+    return tuple(dims)
+
+
+def _index(x, args):
+    """``x(args...)``."""
+    if not args:
+        return x
+    shape = x.shape
+    flat = _flat(x)
+    if len(args) == 1:
+        if _is_colon(args[0]):
+            return _rebuild(x, flat, (flat.size, 1))
+        idx, ishape = _subscript(args[0], flat.size)
+        k = idx.size
+        vector = len(shape) == 2 and (shape[0] == 1) != (shape[1] == 1)
+        if vector and len(ishape) == 2 and 1 in ishape:
+            # (vectors indexed by vectors keep their orientation)
+            ishape = (1, k) if len(shape) == 2 and shape[0] == 1 else (k, 1)
+        return _rebuild(x, flat[idx], ishape)
+    dims = _index_dims(shape, len(args))
+    data = flat.reshape(dims, order='F')
+    res = data[numpy.ix_(*[_subscript(sub, dims[k])[0]
+                           for k, sub in enumerate(args)])]
+    return _rebuild(x, res.ravel(order='F'), res.shape)
+
+
+def _fill(target, idx, values):
+    """Stores `values` (one, or one per index) at `idx` in `target`."""
+    if target.dtype == object:
+        for j, i in enumerate(idx):
+            target[i] = values[0 if values.size == 1 else j]
+    else:
+        target[idx] = values
+
+
+def _unify(x, rhs):
+    """`x` and `rhs` converted for ``x(...) = rhs``."""
+    if x is None or isinstance(x, (Sparse, FuncHandle)) or isinstance(
+            rhs, (Sparse, FuncHandle)):
+        raise MatlabError("The fake engine only assigns parts of existing "
+                          "full arrays, cells and structs.")
+    if isinstance(x, Struct) or isinstance(rhs, Struct):
+        if not (isinstance(x, Struct) and isinstance(rhs, Struct) and
+                sorted(x.fields) == sorted(rhs.fields)):
+            raise MatlabError("Subscripted assignment between dissimilar "
+                              "structures.",
+                              'MATLAB:heterogeneousStrucAssignment')
+        return x, rhs
+    if _is_cell(x) != _is_cell(rhs):
+        raise MatlabError("Conversion to %s from %s is not possible." %
+                          (mclass(x), mclass(rhs)),
+                          'MATLAB:invalidConversion')
+    if _is_cell(x):
+        return x, rhs
+    return x, _as_class(rhs, mclass(x))
+
+
+def _assign(x, args, rhs):
+    """``x(args...) = rhs`` (`x` None if it doesn't exist yet)."""
+    if len(args) != 1:
+        raise MatlabError("The fake engine only assigns with a single "
+                          "subscript.")
+    x, rhs = _unify(x, rhs)
+    values = _flat(rhs)
+    shape = x.shape
+    flat = _flat(x)
+    idx = (numpy.arange(flat.size) if _is_colon(args[0]) else
+           _subscript(args[0], None)[0])
+    need = int(idx.max()) + 1 if idx.size else 0
+    if need > flat.size:
+        if len(shape) == 2 and (shape[0] == 1 or shape[1] == 1 and
+                                flat.size):
+            shape = (1, need) if shape[0] == 1 else (need, 1)
+        elif flat.size == 0:
+            shape = (1, need)
+        else:
+            raise MatlabError("In an assignment  A(I) = B, a matrix A "
+                              "cannot be resized.",
+                              'MATLAB:indexed_matrix_cannot_be_resized')
+        flat = numpy.concatenate([flat, _new_elements(x, need -
+                                                      flat.size)])
+    else:
+        flat = flat.copy()
+    if values.size != 1 and values.size != idx.size:
+        raise MatlabError("In an assignment  A(I) = B, the number of "
+                          "elements in B and I must be the same.",
+                          'MATLAB:index_assign_element_count_mismatch')
+    _fill(flat, idx, values)
+    return _rebuild(x, flat, shape)
+
+
+def _get_field(x, name):
+    """The values of the field `name` of the struct array `x` (a list)."""
+    if not isinstance(x, Struct):
+        raise MatlabError("Attempt to reference field of non-structure "
+                          "array.", 'MATLAB:structRefFromNonStruct')
+    if name not in x.fields:
+        raise MatlabError("Reference to non-existent field '%s'." % name,
+                          'MATLAB:nonExistentField')
+    return [e[name] for e in _flat(x)]
+
+
+_NAME_RE = re.compile(r'[A-Za-z]\w*\Z')
+
+
+def _set_field(x, name, value):
+    """``x.name = value`` (`x` None if it doesn't exist yet)."""
+    if x is None or (_is_numeric(x) and _numel(x) == 0):
+        x = Struct.scalar([])
+    if not isinstance(x, Struct) or _numel(x) > 1:
+        raise MatlabError("The fake engine only assigns fields of scalar "
+                          "structs.", 'MATLAB:nonStrucReference')
+    if not _NAME_RE.match(name):
+        raise MatlabError("Invalid field name '%s'." % name,
+                          'MATLAB:AddField:InvalidFieldName')
+    elem = dict(x.elems.flat[0]) if _numel(x) else dict(
+        (f, _empty()) for f in x.fields)
+    elem[name] = value
+    return Struct(x.fields + [name] * (name not in x.fields),
+                  _cell([elem], (1, 1)))
+
+
+##############################################################################
+# display
+##############################################################################
+
+def _disp_text(x):
+    """What ``disp(x)`` prints (the fake engine only lays out struct
+    arrays, text and real matrices; anything else is summarized)."""
+    if isinstance(x, Struct) and _numel(x) != 1:
+        lines = ['%s struct array with fields:' % 'x'.join(
+            [str(d) for d in x.shape])] + [
+                '    ' + f for f in x.fields] + ['']
+    elif not isinstance(x, numpy.ndarray) or len(x.shape) > 2:
+        lines = ['[%s %s]' % ('x'.join([str(d) for d in x.shape]),
+                              mclass(x))]
+    elif _is_char(x):
+        lines = [u''.join(row) for row in x]
+    elif x.dtype.kind in 'biuf':
+        lines = ['  ' + ''.join(['  %g' % v for v in row]) for row in x]
+    else:
+        lines = ['[%s %s]' % ('x'.join([str(d) for d in x.shape]),
+                              mclass(x))]
+    return ''.join([line + '\n' for line in lines])
+
+
+##############################################################################
+# the interpreter
+##############################################################################
+
+_ANS = 'ans'
+
+
+class _Interpreter(object):
+    """Runs matlab code on a workspace (`vars`, a dict)."""
+
+    max_cached = 256
+    """How many parsed statements to keep."""
+
+    def __init__(self):
+        self.vars = {}
+        self.out = []
+        self.diary = None
+        self.diary_file = 'diary'
+        self.last_error = MatlabError('')
+        self.cwd = os.getcwd()
+        self.path = []
+        self.files = {}
+        self.ends = []
+        self.cache = {}
+        self.current = None
+
+    def write(self, text):
+        text = _text(text)
+        self.out.append(text)
+        if self.diary is not None:
+            self.diary.write(text.encode('utf-8'))
+            self.diary.flush()
+
+    def take_output(self):
+        out = u''.join(self.out)
+        self.out = []
+        return out
+
+    def run(self, src):
+        """Runs `src`, reporting errors in the output as the engine
+        does."""
+        try:
+            program = self.cache.get(src)
+            if program is None:
+                program = _parse(src)
+                if len(self.cache) >= self.max_cached:
+                    self.cache.clear()
+                self.cache[src] = program
+            self.exec_block(program)
+        except MatlabError as e:
+            self.last_error = e
+            self.write(u"??? %s\n\n" % e.message)
+
+    def resolve(self, path):
+        return os.path.join(self.cwd, os.path.expanduser(path))
+
+    # statements
+
+    def exec_block(self, stmts):
+        for stmt in stmts:
+            getattr(self, 'exec_' + stmt[0])(stmt)
+
+    def exec_cmd(self, stmt):
+        _, name, args = stmt
+        self.set_ans(self.call(name, [_str(a) for a in args], 0))
+
+    def set_ans(self, outs):
+        if outs:
+            self.vars[_ANS] = outs[0]
+
+    def exec_expr(self, stmt):
+        _, node = stmt
+        if node[0] == 'id' and node[1] in self.vars:
+            return
+        if node[0] == 'id':
+            outs = self.call(node[1], [], 0)
+        elif node[0] == 'index':
+            outs = self.eval_index(node, 0)
+        else:
+            outs = [self.eval(node)]
+        self.set_ans(outs)
+
+    def exec_assign(self, stmt):
+        _, targets, rhs = stmt
+        n = len(targets)
+        values = (self.eval_index(rhs, n) if n > 1 and rhs[0] == 'index'
+                  else [self.eval(rhs)])
+        if len(values) < n:
+            raise MatlabError("Too many output arguments.",
+                              'MATLAB:TooManyOutputs')
+        for target, value in zip(targets, values):
+            self.assign_to(target, value)
+
+    def exec_if(self, stmt):
+        for cond, body in stmt[1]:
+            if _truth(self.eval(cond)):
+                self.exec_block(body)
+                return
+
+    def exec_for(self, stmt):
+        _, var, node, body = stmt
+        values = self.eval(node)
+        shape = values.shape
+        for k in range(_numel(values) // shape[0] if shape[0] else 0):
+            self.vars[var] = _index(values, [COLON, _scalar(k + 1)])
+            self.exec_block(body)
+
+    def exec_try(self, stmt):
+        _, body, handler = stmt
+        try:
+            self.exec_block(body)
+        except MatlabError as e:
+            self.last_error = e
+            self.exec_block(handler)
+
+    # assignments
+
+    def assign_to(self, target, value):
+        _, name, subs = target
+        self.vars[name] = (self.assign_path(self.vars.get(name), subs, value)
+                           if subs else value)
+
+    def assign_path(self, x, subs, value):
+        """`x` with the part that `subs` address set to `value`."""
+        (kind, arg), rest = subs[0], subs[1:]
+        if isinstance(x, ProxyTest):
+            # (as its subsasgn.m: ``{}`` is ``()`` with a number given as
+            # a string)
+            if kind in ('()', '{}'):
+                arg = _Values(self.index_args(x.data, arg))
+            if kind == '{}':
+                kind, value = '()', _scalar(float(_to_str(value)))
+            return ProxyTest(self.assign_path(x.data, [(kind, arg)] + rest,
+                                              value))
+        if kind == '.':
+            if rest:
+                cur = None
+                if (isinstance(x, Struct) and _numel(x) == 1 and
+                    arg in x.fields):
+                    cur = x.elems.flat[0][arg]
+                value = self.assign_path(cur, rest, value)
+            return _set_field(x, arg, value)
+        args = self.index_args(x, arg)
+        if kind == '()':
+            if rest:
+                raise MatlabError("The fake engine can't assign to parts "
+                                  "of indexed elements.")
+            return _assign(x, args, value)
+        if x is None or (_is_numeric(x) and _numel(x) == 0):
+            x = numpy.empty((0, 0), object)
+        if not _is_cell(x):
+            raise MatlabError("Cell contents assignment to a non-cell array "
+                              "object.", 'MATLAB:cellAssToNonCell')
+        if rest:
+            cur = None
+            try:
+                part = _index(x, args)
+                if part.size == 1:
+                    cur = part.flat[0]
+            except MatlabError:
+                pass
+            value = self.assign_path(cur, rest, value)
+        return _assign(x, args, _cell([value], (1, 1)))
+
+    # expressions
+
+    def eval(self, node):
+        """The value of the expression `node`."""
+        kind = node[0]
+        if kind == 'id':
+            value = self.vars.get(node[1])
+            if value is not None:
+                return value
+            return self.call(node[1], [], 1)[0]
+        if kind == 'num':
+            return _scalar(node[1])
+        if kind == 'str':
+            return _str(node[1])
+        if kind == 'index':
+            values = self.eval_index(node, 1)
+            if not values:
+                raise MatlabError("Insufficient number of outputs from "
+                                  "right hand side of equal sign to "
+                                  "satisfy assignment.")
+            return values[0]
+        if kind == 'binop':
+            # (long chains like ``a+b+c+...`` nest to the left; they are
+            # evaluated iteratively, so as not to exhaust the stack)
+            chain = []
+            while node[0] == 'binop':
+                chain.append(node)
+                node = node[2]
+            value = self.eval(node)
+            for node in reversed(chain):
+                value = _binop(node[1], value, self.eval(node[3]))
+            return value
+        if kind == 'not':
+            return _arr(~_logical(self.eval(node[1]), 'not'))
+        if kind == 'transpose':
+            return _transpose(self.eval(node[1]))
+        if kind in ('andand', 'oror'):
+            op = 'and' if kind == 'andand' else 'or'
+            left = _scalar_truth(self.eval(node[1]), op)
+            if left == (kind == 'oror'):
+                return _bool(left)
+            return _bool(_scalar_truth(self.eval(node[2]), op))
+        if kind == 'range':
+            return _colon(self.eval(node[1]), self.eval(node[2]))
+        if kind in ('matrix', 'cell'):
+            rows = []
+            for row in node[1]:
+                items = []
+                for e in row:
+                    items.extend(self.eval_list(e))
+                if kind == 'cell':
+                    items = [_cell([v], (1, 1)) for v in items]
+                if items:
+                    rows.append(_concat(items, 1))
+            if not rows:
+                return _empty() if kind == 'matrix' else _cell([])
+            return _concat(rows, 0)
+        if kind == 'end':
+            x, k, n = self.ends[-1]
+            shape = (0, 0) if x is None else x.shape
+            return _scalar(numpy.prod(shape) if n == 1 else
+                           _index_dims(shape, n)[k])
+        if kind == 'fhandle':
+            return FuncHandle(node[1])
+        raise MatlabError("Can't evaluate %r." % (node,))
+
+    def eval_list(self, node):
+        """The values of `node`, which can be a comma separated list (like
+        ``c{:}``)."""
+        if node[0] == 'index':
+            return self.eval_index(node, 1)
+        return [self.eval(node)]
+
+    def eval_args(self, nodes):
+        args = []
+        for node in nodes:
+            args.extend(self.eval_list(node))
+        return args
+
+    def index_args(self, x, nodes):
+        """The subscripts `nodes` (``end`` refers to `x`) evaluated."""
+        if isinstance(nodes, _Values):
+            return nodes
+        args = []
+        for k, node in enumerate(nodes):
+            if node[0] == 'colon':
+                args.append(COLON)
+                continue
+            self.ends.append((x, k, len(nodes)))
+            try:
+                args.extend(self.eval_list(node))
+            finally:
+                self.ends.pop()
+        return args
+
+    def eval_index(self, node, nargout):
+        """The values of ``base(...)...`` (a list)."""
+        _, base, subs = node
+        if base[0] == 'id' and base[1] not in self.vars:
+            if subs[0][0] == '()':
+                args, rest = self.eval_args(subs[0][1]), subs[1:]
+            else:
+                args, rest = [], subs
+            outs = self.call(base[1], args, nargout if not rest else 1)
+            if not rest:
+                return outs[:max(nargout, 1)]
+            values = outs[:1]
+        else:
+            values, rest = [self.eval(base)], subs
+        return self.apply_subs(values, rest, nargout)
+
+    def apply_subs(self, values, subs, nargout=1):
+        for kind, arg in subs:
+            if len(values) != 1:
+                raise MatlabError("Field reference for multiple structure "
+                                  "elements that is followed by more "
+                                  "reference blocks is an error."
+                                  if values else
+                                  "Index exceeds matrix dimensions.")
+            x = values[0]
+            if isinstance(x, ProxyTest):
+                values = self.proxy_test_subsref(x, kind, arg)
+            elif kind == '()':
+                values = [_index(x, self.index_args(x, arg))]
+            elif kind == '{}':
+                if not _is_cell(x):
+                    raise MatlabError("Cell contents reference from a "
+                                      "non-cell array object.",
+                                      'MATLAB:cellRefFromNonCell')
+                values = list(_flat(_index(x, self.index_args(x, arg))))
+            else:
+                values = _get_field(x, arg if kind == '.' else _to_str(
+                    self.eval(arg), "the field name"))
+        return values
+
+    def proxy_test_subsref(self, x, kind, arg):
+        """Indexes the proxyTest object `x` as its subsref.m does."""
+        if kind not in ('()', '{}'):
+            return self.apply_subs([x.data], [(kind, arg)])
+        args = self.index_args(x.data, arg)
+        if len(args) == 1 and _is_char(args[0]) and not _is_colon(args[0]):
+            return [_str(u"you %s-indexed with the string <<%s>>" %
+                         (kind, _to_str(args[0])))]
+        part = _index(x.data, args)
+        if kind == '{}':
+            # (num2str)
+            part = _str(u'  '.join([u'%g' % v for v in _flat(part)]))
+        return [part]
+
+    def call(self, name, args, nargout):
+        """Calls the builtin `name`; returns a list of the results."""
+        fn = _BUILTINS.get(name)
+        if fn is None:
+            raise MatlabError("Undefined function or variable '%s'." % name,
+                              'MATLAB:UndefinedFunction')
+        self.current = name
+        outs = fn(self, args, nargout)
+        if outs is None:
+            outs = []
+        elif isinstance(outs, tuple):
+            outs = list(outs)
+        else:
+            outs = [outs]
+        if nargout > len(outs):
+            raise MatlabError("Too many output arguments.",
+                              'MATLAB:TooManyOutputs')
+        return outs
+
+
+class _Values(list):
+    """Subscripts that have already been evaluated (see ``subsref``)."""
+    pass
+
+
+def _error_struct(e):
+    return Struct.scalar([
+        ('message', _str(e.message)),
+        ('identifier', _str(e.identifier)),
+        ('stack', Struct(['file', 'name', 'line'],
+                         numpy.empty((0, 1), object)))])
+
+
+##############################################################################
+# builtins
+#
+# Each takes the interpreter, a list of the argument values and the number
+# of outputs asked for, and returns a value, a tuple of values or None.
+##############################################################################
+
+_BUILTINS = {}
+
+_NARGOUT = {}
+"""What ``nargout`` says for each builtin (-1 for varargout)."""
+
+
+def _builtin(*names, **kwargs):
+    nargout = kwargs.get('nargout', 1)
+
+    def register(fn):
+        for name in names:
+            _BUILTINS[name] = fn
+            _NARGOUT[name] = nargout
+        return fn
+    return register
+
+
+def _nargin(args, lo, hi=None):
+    if len(args) < lo:
+        raise MatlabError("Not enough input arguments.", 'MATLAB:minrhs')
+    if hi is not None and len(args) > hi:
+        raise MatlabError("Too many input arguments.", 'MATLAB:maxrhs')
+
+
+def _int(x, what="argument"):
+    """The scalar `x` as an int."""
+    if not _is_numeric(x) or _numel(x) != 1:
+        raise MatlabError("Expected %s to be a scalar." % what)
+    return int(_operand(x).flat[0].real)
+
+
+def _ints(x):
+    return [int(v) for v in _operand(x).real.ravel(order='F')]
+
+
+def _dims(args):
+    """The dimensions given to ``zeros``, ``cell``... as ``(n)``, ``(m, n,
+    ...)`` or ``([m n ...])``."""
+    if not args:
+        return (1, 1)
+    dims = _ints(args[0]) if len(args) == 1 else [_int(a) for a in args]
+    return _norm_shape([max(d, 0) for d in dims * (3 - len(dims)
+                                                   if len(dims) == 1
+                                                   else 1)])
+
+
+def _first_dim(x):
+    """The first non-singleton dimension of `x` (0-based)."""
+    for k, d in enumerate(x.shape):
+        if d != 1:
+            return k
+    return 0
+
+
+def _sum_class(x):
+    c = mclass(x)
+    return c if c in _INT_TYPES or c == 'single' else 'double'
+
+
+def _float_class(x):
+    return 'single' if mclass(x) == 'single' else 'double'
+
+
+# math
+
+@_builtin('sum')
+def _sum(interp, args, nargout):
+    _nargin(args, 1, 1)
+    x = args[0]
+    A = _operand(x)
+    return _result(A.sum(axis=_first_dim(A), keepdims=True), _sum_class(x))
+
+
+@_builtin('any')
+def _any(interp, args, nargout):
+    _nargin(args, 1, 1)
+    B = _logical(args[0], 'any')
+    if B.shape == (0, 0):
+        return _bool(False)
+    return _arr(B.any(axis=_first_dim(B), keepdims=True))
+
+
+@_builtin('max', nargout=2)
+def _max(interp, args, nargout):
+    _nargin(args, 1, 2)
+    x = args[0]
+    if len(args) > 1:
+        cls = _result_class(x, args[1], 'max')
+        return _result(numpy.fmax(*_expand(_operand(x).real,
+                                           _operand(args[1]).real)), cls)
+    A = _operand(x)
+    axis = _first_dim(A)
+    key = abs(A) if numpy.iscomplexobj(A) else A
+    idx = numpy.expand_dims(numpy.nanargmax(key, axis=axis) if not
+                            numpy.isnan(key).all() else
+                            numpy.zeros(key.shape[:axis] +
+                                        key.shape[axis + 1:], int), axis)
+    values = numpy.take_along_axis(A, idx, axis)
+    return _result(values, _sum_class(x)), _result(idx + 1., 'double')
+
+
+@_builtin('sort')
+def _sort(interp, args, nargout):
+    _nargin(args, 1, 1)
+    x = args[0]
+    A = _operand(x)
+    return _result(numpy.sort(A, axis=_first_dim(A)), _sum_class(x))
+
+
+@_builtin('svd')
+def _svd(interp, args, nargout):
+    _nargin(args, 1, 1)
+    if _is_char(args[0]):
+        raise _undefined_operator('svd', args[0])
+    A = _operand(args[0], 'svd')
+    return _result(numpy.linalg.svd(A, compute_uv=False).reshape(-1, 1),
+                   'double')
+
+
+@_builtin('nnz')
+def _nnz(interp, args, nargout):
+    _nargin(args, 1, 1)
+    return _scalar(numpy.count_nonzero(_operand(args[0])))
+
+
+def _elementwise(names, fn, cls_of):
+    """Registers `names` as elementwise functions computing `fn` in double
+    precision; the result class is ``cls_of(x)``."""
+    def builtin(interp, args, nargout):
+        _nargin(args, 1, 1)
+        x = args[0]
+        with numpy.errstate(all='ignore'):
+            r = _result(fn(_operand(x, interp.current)), cls_of(x))
+        return Sparse(r) if isinstance(x, Sparse) else r
+    _builtin(*names)(builtin)
+
+
+_elementwise(('sin',), numpy.sin, _float_class)
+_elementwise(('cos',), numpy.cos, _float_class)
+for _names, _fn in [(('conj',), numpy.conj), (('real',), numpy.real),
+                    (('imag',), numpy.imag),
+                    (('round',), lambda r: numpy.sign(r) * numpy.floor(
+                        numpy.abs(r) + 0.5))]:
+    _elementwise(_names, _fn, lambda x: 'double' if mclass(x) in (
+        'char', 'logical') else mclass(x))
+
+
+@_builtin('complex')
+def _complex(interp, args, nargout):
+    _nargin(args, 1, 2)
+    re_ = _operand(args[0]).real
+    im = _operand(args[1]).real if len(args) > 1 else numpy.zeros(re_.shape)
+    re_, im = _expand(re_, im)
+    cls = _result_class(*args) if len(args) > 1 else _float_class(args[0])
+    return _arr((re_ + 1j * im).astype(
+        numpy.complex64 if cls == 'single' else numpy.complex128))
+
+
+@_builtin('isreal')
+def _isreal(interp, args, nargout):
+    _nargin(args, 1, 1)
+    x = args[0].data if isinstance(args[0], Sparse) else args[0]
+    return _bool(isinstance(x, numpy.ndarray) and x.dtype.kind not in 'cO')
+
+
+_OPERATORS = {'plus': '+', 'minus': '-', 'times': '.*'}
+
+
+@_builtin(*sorted(_OPERATORS))
+def _operator(interp, args, nargout):
+    _nargin(args, 2, 2)
+    return _binop(_OPERATORS[interp.current], args[0], args[1])
+
+
+# constructors and shapes
+
+@_builtin('zeros')
+def _zeros(interp, args, nargout):
+    return numpy.zeros(_dims(args))
+
+
+@_builtin('cell')
+def _cell_builtin(interp, args, nargout):
+    res = numpy.empty(_dims(args), object)
+    for i in range(res.size):
+        res.flat[i] = _empty()
+    return res
+
+
+@_builtin('struct')
+def _struct(interp, args, nargout):
+    if len(args) % 2:
+        raise MatlabError("Field and value input arguments must come in "
+                          "pairs.", 'MATLAB:struct:FieldAndValue')
+    names = [_to_str(a, "the field name") for a in args[::2]]
+    values = args[1::2]
+    shape = (1, 1)
+    for v in values:
+        if _is_cell(v) and v.size != 1:
+            if shape != (1, 1) and v.shape != shape:
+                raise MatlabError("Array dimensions of input must match.",
+                                  'MATLAB:struct:cellArrayDims')
+            shape = v.shape
+    elems = numpy.empty(int(numpy.prod(shape)), object)
+    for i in range(elems.size):
+        elems[i] = dict((name, _flat(v)[i if v.size != 1 else 0]
+                         if _is_cell(v) else v)
+                        for name, v in zip(names, values))
+    fields = []
+    for name in names:
+        if not _NAME_RE.match(name):
+            raise MatlabError("Invalid field name \"%s\"" % name)
+        if name not in fields:
+            fields.append(name)
+    return Struct(fields, elems.reshape(shape, order='F'))
+
+
+@_builtin('repmat')
+def _repmat(interp, args, nargout):
+    _nargin(args, 2)
+    x = args[0]
+    reps = _ints(args[1]) if len(args) == 2 else [_int(a) for a in args[1:]]
+    reps *= 3 - len(reps) if len(reps) == 1 else 1
+    data = x.elems if isinstance(x, Struct) else (
+        x.data if isinstance(x, Sparse) else x)
+    n = max(len(reps), data.ndim)
+    data = data.reshape(data.shape + (1,) * (n - data.ndim))
+    res = numpy.tile(data, reps + [1] * (n - len(reps)))
+    return _rebuild(x, res.ravel(order='F'), res.shape)
+
+
+@_builtin('reshape')
+def _reshape(interp, args, nargout):
+    _nargin(args, 2)
+    dims = _ints(args[1]) if len(args) == 2 else [_int(a) for a in args[1:]]
+    if int(numpy.prod(dims)) != _numel(args[0]):
+        raise MatlabError("To RESHAPE the number of elements must not "
+                          "change.", 'MATLAB:getReshapeDims:notSameNumel')
+    return _rebuild(args[0], _flat(args[0]), dims)
+
+
+@_builtin('fliplr')
+def _fliplr(interp, args, nargout):
+    _nargin(args, 1, 1)
+    x = args[0]
+    return _index(x, [COLON, _row(range(x.shape[1], 0, -1))])
+
+
+@_builtin('horzcat')
+def _horzcat(interp, args, nargout):
+    return _concat(args, 1) if args else _empty()
+
+
+@_builtin('num2cell')
+def _num2cell(interp, args, nargout):
+    _nargin(args, 1, 1)
+    x = args[0]
+    flat = _flat(x)
+    return _cell([_rebuild(x, flat[i:i + 1], (1, 1))
+                  for i in range(flat.size)], x.shape)
+
+
+@_builtin('sparse')
+def _sparse(interp, args, nargout):
+    _nargin(args, 1, 1)
+    x = args[0]
+    if isinstance(x, Sparse):
+        return x
+    if mclass(x) not in ('double', 'logical'):
+        raise MatlabError("Undefined function 'sparse' for input "
+                          "arguments of type '%s'." % mclass(x))
+    return Sparse(x)
+
+
+@_builtin('full')
+def _full(interp, args, nargout):
+    _nargin(args, 1, 1)
+    return args[0].data if isinstance(args[0], Sparse) else args[0]
+
+
+@_builtin('size')
+def _size(interp, args, nargout):
+    _nargin(args, 1, 2)
+    shape = list(_norm_shape(args[0].shape))
+    if len(args) > 1:
+        d = _int(args[1], "the dimension")
+        return _scalar(shape[d - 1] if d <= len(shape) else 1)
+    return _row(shape)
+
+
+@_builtin('numel')
+def _numel_builtin(interp, args, nargout):
+    _nargin(args, 1, 1)
+    return _scalar(_numel(args[0]))
+
+
+@_builtin('fieldnames')
+def _fieldnames(interp, args, nargout):
+    _nargin(args, 1, 1)
+    s = args[0]
+    if not isinstance(s, Struct):
+        raise MatlabError("Invalid input argument of type '%s'. Input must "
+                          "be a structure or a Java or COM object." %
+                          mclass(s), 'MATLAB:fieldnames:InvalidInput')
+    return _cell([_str(f) for f in s.fields], (len(s.fields), 1))
+
+
+# classes and conversions
+
+@_builtin('class')
+def _class(interp, args, nargout):
+    _nargin(args, 1, 1)
+    return _str(mclass(args[0]))
+
+
+@_builtin('double', 'logical', 'int8', 'uint8')
+def _convert(interp, args, nargout):
+    _nargin(args, 1, 1)
+    x = args[0]
+    if not _is_numeric(x) and not _is_char(x) or isinstance(x, Sparse):
+        raise MatlabError("Conversion to %s from %s is not possible." %
+                          (interp.current, mclass(x)),
+                          'MATLAB:invalidConversion')
+    return _as_class(x, interp.current)
+
+
+def _class_test(name, test):
+    def builtin(interp, args, nargout):
+        _nargin(args, 1, 1)
+        return _bool(test(args[0]))
+    _builtin(name)(builtin)
+
+
+for _name, _test in [
+        ('isnumeric', lambda x: mclass(x) in _NUMERIC_CLASSES),
+        ('islogical', lambda x: mclass(x) == 'logical'),
+        ('isstruct', lambda x: isinstance(x, Struct)),
+        ('issparse', lambda x: isinstance(x, Sparse)),
+        ('isobject', lambda x: isinstance(x, ProxyTest))]:
+    _class_test(_name, _test)
+
+
+@_builtin('proxyTest')
+def _proxy_test(interp, args, nargout):
+    _nargin(args, 1, 1)
+    return ProxyTest(args[0])
+
+
+@_builtin('func2str')
+def _func2str(interp, args, nargout):
+    _nargin(args, 1, 1)
+    if not isinstance(args[0], FuncHandle):
+        raise MatlabError("FUNC2STR only takes function handle arguments.")
+    return _str(args[0].name)
+
+
+@_builtin('subsref', nargout=-1)
+def _subsref(interp, args, nargout):
+    _nargin(args, 2, 2)
+    if not isinstance(args[1], Struct):
+        raise MatlabError("Expected the subscripts to be a struct.")
+    subs = []
+    for elem in _flat(args[1]):
+        kind, arg = _to_str(elem['type']), elem['subs']
+        if kind == '.':
+            subs.append(('.', _to_str(arg, "the field name")))
+        elif kind in ('()', '{}') and _is_cell(arg):
+            subs.append((kind, _Values([COLON if _is_colon(a) else a
+                                        for a in _flat(arg)])))
+        else:
+            raise MatlabError("Invalid subscript type '%s'." % kind)
+    return tuple(interp.apply_subs([args[0]], subs, max(nargout, 1)))
+
+
+# strings and output
+
+@_builtin('strcmp')
+def _strcmp(interp, args, nargout):
+    _nargin(args, 2, 2)
+
+    def text(x):
+        if _is_char(x) and (x.size == 0 or x.ndim == 2 and x.shape[0] == 1):
+            return u''.join(x.flat)
+    a, b = args
+    if _is_cell(b) and not _is_cell(a):
+        a, b = b, a
+    if _is_cell(a):
+        others = (list(b.flat) if _is_cell(b) and b.size != 1 else
+                  [b.flat[0] if _is_cell(b) else b] * a.size)
+        if len(others) != a.size:
+            raise MatlabError("Inputs must be the same size or either one "
+                              "can be a scalar.")
+        return numpy.array([text(x) is not None and text(x) == text(y)
+                            for x, y in zip(a.flat, others)],
+                           bool).reshape(a.shape)
+    return _bool(text(a) is not None and text(a) == text(b))
+
+
+_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', '\\': '\\', None: '%'}
+
+
+def _sprintf(fmt):
+    """Matlab's ``sprintf`` of just a format (the fake engine only knows
+    the escapes and ``%%``)."""
+    return re.sub(r'\\([ntr\\])|%%', lambda m: _ESCAPES[m.group(1)], fmt)
+
+
+@_builtin('sprintf')
+def _sprintf_builtin(interp, args, nargout):
+    _nargin(args, 1, 1)
+    return _str(_sprintf(_to_str(args[0], "the format")))
+
+
+@_builtin('fprintf', nargout=0)
+def _fprintf(interp, args, nargout):
+    _nargin(args, 1, 1)
+    interp.write(_sprintf(_to_str(args[0], "the format")))
+
+
+@_builtin('disp', nargout=0)
+def _disp(interp, args, nargout):
+    _nargin(args, 1, 1)
+    interp.write(_disp_text(args[0]))
+
+
+# errors
+
+@_builtin('error', nargout=0)
+def _error(interp, args, nargout):
+    # (``error(message)`` or ``error(identifier, message)``, unformatted)
+    _nargin(args, 1, 2)
+    message = _to_str(args[-1], "the message")
+    if message:
+        raise MatlabError(message, _to_str(args[0]) if len(args) > 1 else
+                          u'')
+
+
+@_builtin('lasterr', nargout=2)
+def _lasterr(interp, args, nargout):
+    _nargin(args, 0, 0)
+    e = interp.last_error
+    return _str(e.message), _str(e.identifier)
+
+
+@_builtin('lasterror')
+def _lasterror(interp, args, nargout):
+    _nargin(args, 0, 0)
+    return _error_struct(interp.last_error)
+
+
+# the workspace
+
+@_builtin('clear', nargout=0)
+def _clear(interp, args, nargout):
+    names = [_to_str(a) for a in args]
+    if not names or 'all' in names or '-all' in names:
+        interp.vars.clear()
+    for name in names:
+        interp.vars.pop(name, None)
+
+
+@_builtin('who', nargout=1)
+def _who(interp, args, nargout):
+    """WHO lists the variables in the current workspace."""
+    names = sorted(interp.vars, key=lambda n: n.lower())
+    return _cell([_str(n) for n in names], (len(names), 1))
+
+
+@_builtin('whos', nargout=1)
+def _whos(interp, args, nargout):
+    names = sorted(interp.vars, key=lambda n: n.lower())
+    if args:
+        wanted = [_to_str(a) for a in args]
+        names = [n for n in names if n in wanted]
+    elems = numpy.empty((len(names), 1), object)
+    for i, name in enumerate(names):
+        x = interp.vars[name]
+        elems[i, 0] = {'name': _str(name),
+                       'size': _row(_norm_shape(x.shape)),
+                       'bytes': _scalar(_mx_bytes(x)),
+                       'class': _str(mclass(x)),
+                       'sparse': _bool(isinstance(x, Sparse)),
+                       'complex': _bool(isinstance(x, numpy.ndarray) and
+                                        x.dtype.kind == 'c')}
+    return Struct(['name', 'size', 'bytes', 'class', 'sparse', 'complex'],
+                  elems)
+
+
+@_builtin('exist')
+def _exist(interp, args, nargout):
+    _nargin(args, 1, 1)
+    # (only for files and directories)
+    path = interp.resolve(_to_str(args[0], "the name"))
+    return _scalar(7 if os.path.isdir(path) else
+                   2 if os.path.isfile(path) else 0)
+
+
+@_builtin('which')
+def _which(interp, args, nargout):
+    _nargin(args, 1, 1)
+    name = _to_str(args[0], "the name")
+    return _str(u'built-in (fakeengine/%s)' % name if name in _BUILTINS
+                else u'')
+
+
+@_builtin('nargout')
+def _nargout(interp, args, nargout):
+    _nargin(args, 1, 1)
+    f = args[0]
+    name = f.name if isinstance(f, FuncHandle) else _to_str(
+        f, "the function name")
+    if name not in _NARGOUT:
+        raise MatlabError("Function %s does not exist." % name,
+                          'MATLAB:narginout:notValidMfile')
+    return _scalar(_NARGOUT[name])
+
+
+@_builtin('help', nargout=1)
+def _help(interp, args, nargout):
+    _nargin(args, 0, 1)
+    name = _to_str(args[0]) if args else u''
+    if name in _BUILTINS:
+        # (the builtin's docstring, if it has one, is its help text)
+        text = u" %s\n" % (_BUILTINS[name].__doc__ or
+                            u"%s is a builtin of the fake engine." %
+                            name.upper())
+    else:
+        text = u"\n%s not found.\n\n" % name if name else u''
+    return _str(text)
+
+
+@_builtin('version', nargout=2)
+def _version(interp, args, nargout):
+    return _str(MATLAB_VERSION), _str(u'')
+
+
+@_builtin('pause', nargout=0)
+def _pause(interp, args, nargout):
+    if args and _is_numeric(args[0]):
+        time.sleep(max(float(_operand(args[0]).flat[0].real), 0.))
+
+
+@_builtin('pwd')
+def _pwd(interp, args, nargout):
+    return _str(interp.cwd)
+
+
+@_builtin('cd')
+def _cd(interp, args, nargout):
+    _nargin(args, 0, 1)
+    old = interp.cwd
+    if args:
+        path = interp.resolve(_to_str(args[0], "the directory"))
+        if not os.path.isdir(path):
+            raise MatlabError("Cannot CD to %s (Name is nonexistent or not "
+                              "a directory)." % _to_str(args[0]),
+                              'MATLAB:cd:NonExistentDirectory')
+        interp.cwd = os.path.normpath(path)
+    if nargout:
+        return _str(old)
+
+
+@_builtin('addpath', nargout=1)
+def _addpath(interp, args, nargout):
+    old = os.pathsep.join(interp.path)
+    for a in args:
+        for d in _to_str(a).split(os.pathsep):
+            if d in interp.path:
+                interp.path.remove(d)
+            interp.path.insert(0, d)
+    if nargout:
+        return _str(old)
+
+
+@_builtin('diary', nargout=0)
+def _diary(interp, args, nargout):
+    _nargin(args, 0, 1)
+    arg = _to_str(args[0]) if args else None
+    if arg == 'off' or arg is None and interp.diary is not None:
+        if interp.diary is not None:
+            interp.diary.close()
+            interp.diary = None
+        return
+    if arg not in (None, 'on'):
+        interp.diary_file = arg
+        if interp.diary is None:
+            return
+        interp.diary.close()
+    interp.diary = io.open(interp.resolve(interp.diary_file), 'ab')
+
+
+# files (as mlabwrap's shared memory transport uses them)
+
+_PRECISIONS = {'logical': numpy.uint8, 'double': numpy.float64,
+               'single': numpy.float32}
+_PRECISIONS.update(_INT_TYPES)
+
+
+def _precision(x):
+    return _PRECISIONS[_to_str(x, "the precision")]
+
+
+def _file(interp, fid):
+    f = interp.files.get(fid)
+    if f is None:
+        raise MatlabError("Invalid file identifier.  Use fopen to generate "
+                          "a valid file identifier.", 'MATLAB:badfid_mx')
+    return f
+
+
+@_builtin('fopen', nargout=2)
+def _fopen(interp, args, nargout):
+    _nargin(args, 1, 2)
+    mode = _to_str(args[1]) if len(args) > 1 else u'r'
+    f = io.open(interp.resolve(_to_str(args[0], "the file name")),
+                _native(mode.replace('t', '').replace('b', '') + 'b'))
+    fid = max([2] + list(interp.files)) + 1
+    interp.files[fid] = f
+    return _scalar(fid), _str('')
+
+
+@_builtin('fclose', nargout=1)
+def _fclose(interp, args, nargout):
+    _nargin(args, 1, 1)
+    fid = _int(args[0], "the file identifier")
+    _file(interp, fid).close()
+    del interp.files[fid]
+
+
+@_builtin('fwrite', nargout=1)
+def _fwrite(interp, args, nargout):
+    _nargin(args, 2, 3)
+    f = _file(interp, _int(args[0], "the file identifier"))
+    dtype = numpy.dtype(_precision(args[2]) if len(args) > 2 else
+                        numpy.uint8)
+    data = _operand(args[1]).real.ravel(order='F')
+    data.astype(dtype).tofile(f)
+
+
+@_builtin('memmapfile')
+def _memmapfile(interp, args, nargout):
+    # (only with a 'Format' of {class, size, field; ...}; the data is read
+    # right away, as mlabwrap removes the file right after mapping it)
+    _nargin(args, 3, 3)
+    name = _to_str(args[0], "the file name")
+    fmt = args[2]
+    path = interp.resolve(name)
+    f = io.open(path, 'rb')
+    items = []
+    try:
+        for k in range(fmt.shape[0]):
+            cls, shape, field = [fmt[k, i] for i in range(3)]
+            shape = _ints(shape)
+            part = numpy.fromfile(f, _precision(cls), int(numpy.prod(shape)))
+            items.append((_to_str(field),
+                          _arr(part.reshape(shape, order='F'))))
+    finally:
+        f.close()
+    return Struct.scalar([('Filename', _str(path)), ('Format', fmt),
+                          ('Data', Struct.scalar(items))])
+
+
+##############################################################################
+# conversion between python objects and values (as mlabraw's py2mx and mx2py)
+##############################################################################
+
+def _is_scipy_sparse(obj):
+    # (without importing scipy: if it hasn't been imported, nothing can be
+    # a sparse matrix)
+    module = sys.modules.get('scipy.sparse')
+    return module is not None and module.issparse(obj)
+
+
+def _numeric_class(dtype, native):
+    """The numpy type of the matlab array a numpy array of type `dtype`
+    becomes (see ``makeMxFromNumeric``)."""
+    complex_ = dtype.kind == 'c'
+    if native:
+        kind, size = dtype.kind, dtype.itemsize
+        if kind == 'b':
+            return numpy.dtype(bool)
+        if kind in 'iu' and size in (1, 2, 4, 8):
+            return dtype.newbyteorder('=')
+        if (kind, size) in (('f', 4), ('c', 8)):
+            return numpy.dtype(numpy.complex64 if complex_ else
+                               numpy.float32)
+    return numpy.dtype(numpy.complex128 if complex_ else numpy.float64)
+
+
+def _array2mx(a, native):
+    if a.dtype.kind not in 'biufc':
+        raise TypeError("Non-numeric array types not supported")
+    if a.dtype.kind == 'c' and a.size == 0:
+        # (empty arrays come back real)
+        a = a.real
+    if a.ndim == 0:
+        shape = (1, 1)
+    elif a.ndim == 1:
+        shape = (a.shape[0], min(1, a.shape[0]))
+    else:
+        shape = _norm_shape(a.shape)
+    # (a copy, so that the caller is free to modify `a` later)
+    data = numpy.array(a, _numeric_class(a.dtype, native), order='F')
+    return data.reshape(shape, order='F')
+
+
+def _seq2mx(seq):
+    a = numpy.array(seq, numpy.complex128)
+    if not a.imag.any():
+        a = a.real
+    return _array2mx(a, False)
+
+
+def _numeric2mx(obj, native):
+    """The value for a number, sequence or array (None if it is none of
+    these)."""
+    if isinstance(obj, numpy.ndarray):
+        return _array2mx(obj, native)
+    if isinstance(obj, (tuple, list, basestring, bytes)):
+        return _seq2mx(obj)
+    if isinstance(obj, (int, long, float, complex)):
+        return _seq2mx((obj,))
+    return None
+
+
+def _text2mx(s):
+    if not isinstance(s, bytes):
+        s = s.encode('utf-8')
+    return _str(s.split(b'\0')[0])
+
+
+def _dict2mx(obj, native):
+    items = []
+    for key, value in obj.items():
+        name = _text(key if isinstance(key, basestring) else repr(key))
+        if isinstance(value, (str, bytes)):
+            value = _text2mx(value)
+        else:
+            value = _numeric2mx(value, native)
+        items.append((name, _empty() if value is None else value))
+    return Struct.scalar(items)
+
+
+def _sparse2mx(obj):
+    data = numpy.asarray(obj.todense())
+    if data.dtype.kind == 'b':
+        return Sparse(data.copy())
+    return Sparse(numpy.array(
+        data, numpy.complex128 if data.dtype.kind == 'c' else numpy.float64))
+
+
+def _py2mx(obj, native=False):
+    """The value for the python object `obj` (None if it can't be
+    converted), following the rules of ``mlabraw.put``."""
+    if isinstance(obj, str):
+        return _text2mx(obj)
+    if isinstance(obj, dict):
+        return _dict2mx(obj, native)
+    if isinstance(obj, list):
+        values = [_py2mx(item, native) for item in obj]
+        return _cell([_empty() if v is None else v for v in values],
+                     (len(values), min(1, len(values))))
+    if _is_scipy_sparse(obj):
+        return _sparse2mx(obj)
+    return _numeric2mx(obj, native)
+
+
+class _Mx2PyOptions(object):
+    """The options of ``get`` and ``call`` for the conversion of results."""
+
+    def __init__(self, order=None, struct_as=None, leaf=None, max_depth=-1,
+                 max_size=-1):
+        if order not in (None, 'C', 'F'):
+            raise ValueError("order must be 'C' or 'F'")
+        if struct_as not in (None, 'dicts', 'records'):
+            raise ValueError("struct_as must be 'dicts' or 'records'")
+        self.order = order or 'C'
+        self.records = struct_as == 'records'
+        self.leaf = leaf
+        self.max_depth = max_depth
+        self.max_size = max_size
+        self.path = ''
+        self.depth = 0
+
+    def leaf_value(self, why):
+        if self.leaf is None:
+            raise TypeError(why)
+        return self.leaf(self.path)
+
+    def element(self, x, suffix):
+        """Converts `x`, an element of a cell or struct (at `suffix`)."""
+        path = self.path
+        self.path += suffix
+        self.depth += 1
+        try:
+            return _mx2py(x, self)
+        finally:
+            self.path = path
+            self.depth -= 1
+
+
+def _native_key(name):
+    return name if isinstance(name, str) else _native(name)
+
+
+def _char2py(x, opts):
+    if x.shape[0] <= 1 and x.ndim == 2:
+        s = u''.join(x.ravel(order='F')).split(u'\0')[0]
+        return _native(s)
+    # strings run along the 2nd dimension (a MxN char matrix becomes M
+    # strings of length N)
+    codes = numpy.moveaxis(_codes(x), 1, -1)
+    width = max(x.shape[1], 1)
+    padded = numpy.zeros(codes.shape[:-1] + (width,), numpy.uint32)
+    padded[..., :x.shape[1]] = codes
+    strings = padded.view('U%d' % width).reshape(codes.shape[:-1])
+    return numpy.array(strings, order=opts.order)
+
+
+def _struct2py(x, opts):
+    n = _numel(x)
+    flat = _flat(x)
+
+    def to_dict(k):
+        return dict((_native_key(f), opts.element(flat[k][f], "(%d).%s" %
+                                                  (k + 1, f)))
+                    for f in x.fields)
+    if n == 1:
+        return to_dict(0)
+    if not opts.records or not x.fields:
+        return [to_dict(k) for k in range(n)]
+    res = numpy.empty(x.shape, [(_native_key(f), object) for f in x.fields],
+                      order=opts.order)
+    for k in range(n):
+        index = numpy.unravel_index(k, x.shape, order='F')
+        for f in x.fields:
+            res[index][_native_key(f)] = opts.element(
+                flat[k][f], "(%d).%s" % (k + 1, f))
+    return res
+
+
+def _cell2py(x, opts):
+    n = _numel(x)
+    if opts.max_depth >= 0 and opts.depth >= opts.max_depth:
+        return opts.leaf_value("Cell array nested too deeply")
+    if opts.max_size >= 0 and n > opts.max_size:
+        return opts.leaf_value("Cell array too large")
+    flat = _flat(x)
+    if sum(d > 1 for d in x.shape) > 1:
+        res = numpy.empty(x.shape, object, order=opts.order)
+        for k in range(n):
+            index = numpy.unravel_index(k, x.shape, order='F')
+            res[index] = opts.element(flat[k], "{%d}" % (k + 1))
+        return res
+    return [opts.element(flat[k], "{%d}" % (k + 1)) for k in range(n)]
+
+
+def _sparse2py(x, opts):
+    cls = mclass(x)
+    if cls not in ('double', 'logical'):
+        raise TypeError("Unsupported sparse Matlab type: %s" % cls)
+    try:
+        import scipy.sparse
+    except ImportError:
+        if opts.leaf is None or not opts.depth:
+            raise
+        return opts.leaf_value("")
+    return scipy.sparse.csc_matrix(x.data)
+
+
+def _mx2py(x, opts):
+    """The python object for the value `x`, following the rules of
+    ``mlabraw.get``."""
+    if _is_char(x):
+        return _char2py(x, opts)
+    if isinstance(x, Sparse):
+        return _sparse2py(x, opts)
+    if _is_numeric(x):
+        return numpy.array(x, order=opts.order)
+    if isinstance(x, Struct):
+        return _struct2py(x, opts)
+    if _is_cell(x):
+        return _cell2py(x, opts)
+    return opts.leaf_value("Unsupported Matlab type: %s" % mclass(x))
+
+
+##############################################################################
+# sessions and the mlabraw api
+##############################################################################
+
+_STATS = ('evals', 'gets', 'puts', 'bytes_put', 'bytes_got', 'eval_seconds',
+          'get_seconds', 'put_seconds', 'py2mx_seconds', 'mx2py_seconds')
+
+
+def _default_latency():
+    return float(os.environ.get('MLABWRAP_FAKE_LATENCY') or 0)
+
+
+class _Session(object):
+    """What ``open`` returns: an interpreter and its bookkeeping."""
+
+    def __init__(self):
+        self.interp = _Interpreter()
+        self.lock = threading.RLock()
+        self.output_size = DEFAULT_OUTPUT_SIZE
+        self.latency = _default_latency()
+        self.stats = dict.fromkeys(_STATS, 0)
+        self.closed = False
+
+    def wait(self):
+        """The artificial latency of an engine round-trip."""
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def eval_string(self, cmd):
+        """As ``engEvalString``: runs `cmd`, returns the output."""
+        start = time.time()
+        try:
+            self.wait()
+            self.interp.run(_text(cmd))
+            return self.interp.take_output()
+        finally:
+            self.stats['evals'] += 1
+            self.stats['eval_seconds'] += time.time() - start
+
+    def get_var(self, name):
+        """As ``engGetVariable`` (None if there is no variable `name`)."""
+        start = time.time()
+        self.wait()
+        value = self.interp.vars.get(name)
+        self.stats['gets'] += 1
+        self.stats['get_seconds'] += time.time() - start
+        if value is not None:
+            self.stats['bytes_got'] += _mx_bytes(value)
+        return value
+
+    def put_var(self, name, value):
+        """As ``engPutVariable`` (False if `name` is not a valid name)."""
+        start = time.time()
+        self.wait()
+        ok = _is_var_name(name)
+        if ok:
+            self.interp.vars[name] = value
+        self.stats['puts'] += 1
+        self.stats['put_seconds'] += time.time() - start
+        self.stats['bytes_put'] += _mx_bytes(value)
+        return ok
+
+    def output(self, out):
+        """The captured output `out` as ``mlabraw`` returns it (cut to the
+        output size, with a warning)."""
+        out = out.encode('utf-8')
+        if len(out) >= self.output_size:
+            out = out[:self.output_size]
+            warnings.warn("MATLAB(TM) output truncated (see "
+                          "mlabraw.set_output_size)", RuntimeWarning, 3)
+        if out.startswith(b">> "):
+            out = out[3:]
+        if bytes is str:
+            return out
+        return out.decode('utf-8', 'replace')
+
+
+def _is_var_name(name):
+    return re.match(r'[A-Za-z]\w{0,62}\Z', name) is not None
+
+
+def _session(handle):
+    if not isinstance(handle, _Session):
+        raise TypeError("Invalid object passed as mlabraw session handle")
+    if handle.closed:
+        raise error("MATLAB(TM) session has been closed")
+    return handle
+
+
+def open(cmd=None):
+    """open([str]) -> handle
+
+    Opens a (fake) MATLAB(TM) engine session; `cmd` is ignored.
+    """
+    return _Session()
+
+
+def close(handle):
+    """close(handle)
+
+    Closes the session.
+    """
+    session = _session(handle)
+    with session.lock:
+        if session.interp.diary is not None:
+            session.interp.diary.close()
+        session.interp = None
+        session.closed = True
+
+
+def eval(handle, cmd):
+    """eval(handle, string) -> str
+
+    Evaluates `string` in the session and returns its output; raises an
+    ``error`` with the message if it fails.
+    """
+    session = _session(handle)
+    with session.lock:
+        out = session.output(session.eval_string(
+            u"try, %s; MLABRAW_ERROR_=0; catch, MLABRAW_ERROR_=1; end;" %
+            _text(cmd)))
+        flag = session.get_var('MLABRAW_ERROR_')
+        if flag is None:
+            raise error("Something VERY BAD happened whilst trying to "
+                        "evaluate string in MATLAB(TM) workspace.")
+        if _operand(flag).flat[0]:
+            raise error(session.output(session.eval_string(
+                "disp(subsref(lasterror(),struct('type','.','subs',"
+                "'message')))")))
+        return out
+
+
+def set_output_size(handle, nbytes):
+    """set_output_size(handle, nbytes) -> int
+
+    Sets how many bytes of output the session keeps per command and returns
+    the previous size.
+    """
+    if nbytes < 1:
+        raise ValueError("nbytes must be positive")
+    session = _session(handle)
+    with session.lock:
+        old, session.output_size = session.output_size, nbytes
+    return old
+
+
+def set_latency(handle, seconds):
+    """set_latency(handle, seconds) -> float
+
+    Sets the artificial latency of each engine round-trip of the session
+    (not in ``mlabraw``) and returns the previous one.
+    """
+    session = _session(handle)
+    old, session.latency = session.latency, float(seconds)
+    return old
+
+
+def get(handle, name, order=None, struct_as=None, leaf=None, max_depth=-1,
+        max_size=-1):
+    """get(handle, name[, order[, struct_as[, leaf[, max_depth[, max_size]]]]])
+      -> array
+
+    Gets the variable `name` from the session, converted as by
+    ``mlabraw.get``.
+    """
+    session = _session(handle)
+    opts = _Mx2PyOptions(order, struct_as, leaf, max_depth, max_size)
+    opts.path = name
+    with session.lock:
+        value = session.get_var(name)
+        if value is None:
+            raise error("Unable to get matrix from MATLAB(TM) workspace")
+        start = time.time()
+        try:
+            return _mx2py(value, opts)
+        finally:
+            session.stats['mx2py_seconds'] += time.time() - start
+
+
+def _convert_arg(session, obj, native):
+    start = time.time()
+    try:
+        return _py2mx(obj, native)
+    finally:
+        session.stats['py2mx_seconds'] += time.time() - start
+
+
+def put(handle, name, array, native=0):
+    """put(handle, name, array[, native])
+
+    Places `array`, converted as by ``mlabraw.put``, into the session.
+    """
+    session = _session(handle)
+    value = _convert_arg(session, array, native)
+    if value is None:
+        # (where mlabraw fails without saying why)
+        raise TypeError("Unsupported argument type: %s" %
+                        type(array).__name__)
+    with session.lock:
+        if not session.put_var(name, value):
+            raise error("Unable to put matrix into MATLAB(TM) workspace")
+
+
+def put_many(handle, variables, native=0):
+    """put_many(handle, variables[, native])
+
+    Places all of `variables` (a dict or a sequence of (name, value) pairs)
+    into the session in one cell, as ``mlabraw.put_many`` does.
+    """
+    session = _session(handle)
+    if isinstance(variables, dict):
+        variables = list(variables.items())
+    names, values = [], []
+    for pair in variables:
+        if not isinstance(pair, tuple) or len(pair) != 2:
+            raise TypeError("variables must be a dict or a sequence of "
+                            "(name, value) pairs")
+        name, obj = pair
+        if not _is_var_name(name):
+            raise ValueError("Invalid variable name: '%s'" % name)
+        value = _convert_arg(session, obj, native)
+        if value is None:
+            raise TypeError("Can't convert variable '%s'" % name)
+        names.append(name)
+        values.append(value)
+    if not names:
+        return
+    with session.lock:
+        session.put_var('MLABRAW_MANY__', _cell(values))
+        session.eval_string("[%s]=MLABRAW_MANY__{:}; clear MLABRAW_MANY__;"
+                            % ",".join(names))
+
+
+def get_many(handle, names, order=None, struct_as=None, leaf=None,
+             max_depth=-1, max_size=-1):
+    """get_many(handle, names[, order[, struct_as[, leaf[, max_depth
+         [, max_size]]]]]) -> list
+
+    Gets the variables `names` from the session in one cell, converted as by
+    ``mlabraw.get_many``.
+    """
+    session = _session(handle)
+    opts = _Mx2PyOptions(order, struct_as, leaf, max_depth, max_size)
+    names = list(names)
+    if not names:
+        return []
+    for name in names:
+        if not _is_var_name(name):
+            raise ValueError("Invalid variable name: '%s'" % name)
+    with session.lock:
+        session.eval_string("try, MLABRAW_MANY__={0,{%s}}; catch, "
+                            "MLABRAW_MANY__={1,lasterr}; end;" %
+                            ",".join(names))
+        out = session.get_var('MLABRAW_MANY__')
+        session.eval_string("clear MLABRAW_MANY__;")
+        if out is None or not _is_cell(out):
+            raise error("Unable to get variables from MATLAB(TM) workspace")
+        out = _flat(out)
+        if _operand(out[0]).flat[0]:
+            raise error(_native(_to_str(out[1])))
+        values = []
+        for name, value in zip(names, _flat(out[1])):
+            opts.path = name
+            start = time.time()
+            try:
+                values.append(_mx2py(value, opts))
+            finally:
+                session.stats['mx2py_seconds'] += time.time() - start
+        return values
+
+
+def _quoted(strings):
+    return ",".join("'%s'" % s.replace("'", "''") for s in strings)
+
+
+def call(handle, fname, args, nout, argnames=None, convert=None,
+         clear_args=1, order=None, native=0, maxbytes=-1, struct_as=None,
+         leaf=None, max_depth=-1, max_size=-1, prologue=None):
+    """call(handle, fname, args, nout[, argnames[, convert[, clear_args
+         [, order[, native[, maxbytes[, struct_as[, leaf[, max_depth
+         [, max_size[, prologue]]]]]]]]]]]) -> (output, classes, values)
+
+    Calls the function `fname` with `args` and fetches the results just like
+    ``mlabraw.call`` (running the same matlab code in as many round-trips).
+    """
+    session = _session(handle)
+    if nout < 0:
+        raise ValueError("nout must be >= 0")
+    opts = _Mx2PyOptions(order, struct_as, leaf, max_depth, max_size)
+    with session.lock:
+        args = list(args)
+        temps = ",".join("arg%d__" % i for i in range(len(args)))
+        if args:
+            values = []
+            for i, arg in enumerate(args):
+                value = _convert_arg(session, arg, native)
+                if value is None:
+                    raise TypeError("Can't convert argument %d" % i)
+                values.append(value)
+            session.put_var('MLABRAW_ARGS__', _cell(values))
+        results = ",".join("RES%d__" % i for i in range(nout))
+        conv = "{%s}" % _quoted(convert or ())
+        cmd = [prologue + " "] if prologue else []
+        cmd.append("try, ")
+        if args:
+            cmd.append("[%s]=MLABRAW_ARGS__{:}; clear MLABRAW_ARGS__; " %
+                       temps)
+        if nout:
+            cmd.append("[%s]=" % results)
+        cmd.append(fname)
+        if argnames is not None:
+            cmd.append("(%s)" % ",".join(argnames))
+        elif args:
+            cmd.append("(%s)" % temps)
+        cmd.append("; MLABRAW_CLS__=cell(1,%d); MLABRAW_VAL__=MLABRAW_CLS__; "
+                   % nout)
+        for i in range(nout):
+            cmd.append("MLABRAW_CLS__{%d}=class(RES%d__); if issparse(RES%d__), "
+                       "MLABRAW_CLS__{%d}=[MLABRAW_CLS__{%d} '-sparse']; " %
+                       (i + 1, i, i, i + 1, i + 1))
+            if maxbytes >= 0:
+                cmd.append("elseif isnumeric(RES%d__) || islogical(RES%d__), "
+                           "MLABRAW_W__=whos('RES%d__'); if MLABRAW_W__.bytes "
+                           "> %d, MLABRAW_CLS__{%d}=[MLABRAW_CLS__{%d} "
+                           "'-large']; end; " %
+                           (i, i, i, maxbytes, i + 1, i + 1))
+            cmd.append("end; if any(strcmp(MLABRAW_CLS__{%d},%s)), "
+                       "MLABRAW_VAL__{%d}=RES%d__; end; " %
+                       (i + 1, conv, i + 1, i))
+        cmd.append("MLABRAW_OUT__={0,MLABRAW_CLS__,MLABRAW_VAL__}; catch, "
+                   "MLABRAW_OUT__={1,lasterr}; end; clear MLABRAW_ARGS__ "
+                   "MLABRAW_CLS__ MLABRAW_VAL__ MLABRAW_W__")
+        if clear_args and args:
+            cmd.extend(" arg%d__" % i for i in range(len(args)))
+        cmd.append(";")
+        output = session.output(session.eval_string("".join(cmd)))
+
+        out = session.get_var('MLABRAW_OUT__')
+        if out is None or not _is_cell(out):
+            raise error("Something VERY BAD happened whilst trying to "
+                        "evaluate string in MATLAB(TM) workspace.")
+        out = _flat(out)
+        clear = ["clear MLABRAW_OUT__"]
+        try:
+            if _operand(out[0]).flat[0]:
+                raise error(_native(_to_str(out[1])))
+            classes, values = [], []
+            for i in range(nout):
+                cls = _char2py(_flat(out[1])[i], opts)
+                classes.append(cls)
+                if convert is None or cls not in convert:
+                    values.append(None)
+                    continue
+                opts.path = "RES%d__" % i
+                start = time.time()
+                try:
+                    values.append(_mx2py(_flat(out[2])[i], opts))
+                finally:
+                    session.stats['mx2py_seconds'] += time.time() - start
+                clear.append(" RES%d__" % i)
+        except Exception:
+            # don't leave the results lying around
+            session.eval_string("clear MLABRAW_OUT__%s;" % "".join(
+                " RES%d__" % i for i in range(nout)))
+            raise
+        session.eval_string("".join(clear) + ";")
+    return output, classes, values
+
+
+def stats(handle):
+    """stats(handle) -> dict
+
+    Returns the counters of the session (see ``mlabraw.stats``).
+    """
+    return dict(_session(handle).stats)
+
+
+def reset_stats(handle):
+    """reset_stats(handle)
+
+    Sets all counters of the session to zero.
+    """
+    session = _session(handle)
+    session.stats = dict.fromkeys(_STATS, 0)
@@ -0,0 +1,40 @@
+##############################################################################
+############# runfake: run the unittests on the fake engine ##################
+##############################################################################
+##
+## Runs all the unittests with ``fakeengine`` standing in for mlabraw, so no
+## matlab(tm) (and no build of mlabraw) is needed:
+##
+## $ python tests/runfake.py
+##
+## Each test module runs in a python of its own; the exit status is non-zero
+## if any of them fails. test_mlabwrap also needs ``awmstools``.
+
+import os
+import subprocess
+import sys
+
+TESTS = ['test_fakeengine', 'test_asyncmlab', 'test_mlabwrap']
+
+
+def main(tests):
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env['MLABWRAP_ENGINE'] = 'fake'
+    env['PYTHONPATH'] = os.pathsep.join(
+        [here, os.path.dirname(here)] +
+        [p for p in [env.get('PYTHONPATH')] if p])
+    failed = []
+    for test in tests:
+        print("=== %s ===" % test)
+        sys.stdout.flush()
+        if subprocess.call([sys.executable, os.path.join(here, test + '.py')],
+                           cwd=here, env=env):
+            failed.append(test)
+    if failed:
+        print("FAILED: %s" % ", ".join(failed))
+    return int(bool(failed))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:] or TESTS))
@@ -0,0 +1,81 @@
+##############################################################################
+############### test_asyncmlab: unittests for the asyncio front-end ##########
+##############################################################################
+##
+## These need asyncio (python 3, or python 2 with the trollius and futures
+## backports); they run on the fake engine unless MLABWRAP_ENGINE says
+## otherwise.
+
+import os
+import sys
+import time
+import unittest
+
+os.environ.setdefault('MLABWRAP_ENGINE', 'fake')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy
+
+import mlabwrap
+try:
+    from mlabwrap.asyncmlab import AsyncMlabWrap, asyncio
+except ImportError: # no asyncio
+    AsyncMlabWrap = None
+
+
+@unittest.skipIf(AsyncMlabWrap is None, "needs asyncio")
+class asyncmlabTC(unittest.TestCase):
+
+    def setUp(self):
+        self.mlab = mlabwrap.MlabWrap()
+        self.amlab = AsyncMlabWrap(self.mlab)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.amlab.shutdown()
+        self.mlab.close()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_until_complete(self, future):
+        return self.loop.run_until_complete(future)
+
+    def testCalls(self):
+        """Calls return awaitables, done in order; errors are raised."""
+        res = self.run_until_complete(asyncio.gather(
+            *[self.amlab.plus(float(i), 1.) for i in range(3)]))
+        self.assertEqual([r.item() for r in res], [1., 2., 3.])
+        self.run_until_complete(self.amlab._set('x', numpy.arange(3.)))
+        x = self.run_until_complete(self.amlab._get('x', remove=True))
+        self.assertEqual(numpy.ravel(x).tolist(), [0., 1., 2.])
+        self.assertRaises(mlabwrap.mlabraw.error, self.run_until_complete,
+                          self.amlab._do("error('oops')", nout=0))
+
+    def testInterrupt(self):
+        """Queued requests are dropped, a running one is abandoned at once."""
+        busy = self.amlab._do('pause(0.5)', nout=0)
+        dropped = self.amlab._set('TMP_ASYNC__', 1.)
+        self.run_until_complete(asyncio.sleep(0.1))
+        start = time.time()
+        self.assertEqual(self.amlab.interrupt(), 2)
+        self.assertRaises(asyncio.CancelledError, self.run_until_complete,
+                          busy)
+        assert time.time() - start < 0.3
+        # (the session is only free again once matlab is done)
+        self.assertEqual(self.run_until_complete(
+            self.amlab.plus(1., 1.)).item(), 2.)
+        assert dropped.cancelled() and 'TMP_ASYNC__' not in self.mlab.who()
+        self.assertEqual(self.amlab.cancel_pending(), 0)
+
+    def testClose(self):
+        """``close`` drops what is queued and then closes the session."""
+        self.amlab._do('pause(0.2)', nout=0)
+        dropped = self.amlab._set('y', 1.)
+        self.run_until_complete(self.amlab.close())
+        assert dropped.cancelled() and self.mlab._closed
+        self.assertRaises(RuntimeError, self.amlab._set, 'z', 1.)
+
+
+if __name__ == '__main__':
+    unittest.main()
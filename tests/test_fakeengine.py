@@ -0,0 +1,178 @@
+##############################################################################
+############## test_fakeengine: unittests for the fake engine ################
+##############################################################################
+##
+## These run without matlab(tm): the fake engine stands in for mlabraw.
+
+import os
+import sys
+import time
+import unittest
+import warnings
+
+os.environ.setdefault('MLABWRAP_ENGINE', 'fake')
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakeengine
+import mlabwrap
+
+
+class fakeengineTC(unittest.TestCase):
+
+    def setUp(self):
+        self.session = fakeengine.open()
+
+    def tearDown(self):
+        fakeengine.close(self.session)
+
+    def eval(self, cmd):
+        return fakeengine.eval(self.session, cmd)
+
+    def get(self, name, **kwargs):
+        return fakeengine.get(self.session, name, **kwargs)
+
+    def testEvalGetPut(self):
+        """Test variables, indexing and the output of commands."""
+        self.eval("a = [1 2; 3 4]; a(2) = 5; b = a';")
+        self.assertEqual(self.get('b').tolist(), [[1, 5], [2, 4]])
+        self.assertEqual(self.eval("disp(sum(a(:)))"), "    12\n")
+        self.assertEqual(self.eval(r"fprintf('3%%\tx\n')"), "3%\tx\n")
+        self.assertEqual(self.eval("c = class(int8(1));"), "")
+        self.assertEqual(self.get('c'), 'int8')
+        fakeengine.put(self.session, 'v', numpy.arange(3.))
+        self.assertEqual(self.get('v').shape, (3, 1))
+        fakeengine.put(self.session, 'w', numpy.arange(3), 1)
+        self.eval("w = class(w);")
+        self.assertEqual(self.get('w'), 'int%d' % (8 * numpy.arange(3).itemsize))
+        self.eval("clear a v")
+        self.assertRaises(fakeengine.error, self.get, 'a')
+        self.assertRaises(TypeError, fakeengine.put, self.session, 'x',
+                          object())
+
+    def testErrors(self):
+        """Errors are raised with matlab's message and can be caught."""
+        try:
+            self.eval("undefinedThing(1)")
+        except fakeengine.error, e:
+            self.assertEqual(str(e).strip(),
+                             "Undefined function or variable "
+                             "'undefinedThing'.")
+        else:
+            self.fail("no error")
+        self.eval("try, error('my:id', 'oops'); catch, [m, i] = lasterr(); "
+                  "end")
+        self.assertEqual((self.get('m'), self.get('i')), ('oops', 'my:id'))
+        # (like matlab's parse errors, which only show in the output; the
+        # fake engine doesn't know ``*``)
+        for cmd in ["x = [1 2", "x = 2 * 3"]:
+            self.assertEqual(self.eval(cmd)[:4], "??? ")
+        self.assertRaises(TypeError, fakeengine.eval, object(), "1")
+        fakeengine.close(self.session)
+        self.assertRaises(fakeengine.error, self.eval, "1")
+        self.session = fakeengine.open()
+
+    def testControlFlow(self):
+        """Test loops and conditions."""
+        self.eval("s = 0; for k = 1:10, if k > 5, s = s + k; end; end")
+        self.assertEqual(self.get('s'), 40)
+        self.eval("if 0, r = 1; elseif 1 && s > 0, r = 2; end")
+        self.assertEqual(self.get('r'), 2)
+
+    def testConversion(self):
+        """Structs, cells and chars convert as with mlabraw."""
+        self.eval("s = struct('a', {1, 2}); c = {1, 'x'; {2}, []}; "
+                  "t = ['ab'; 'cd']; f = @sin;")
+        self.assertEqual([d['a'].item() for d in self.get('s')], [1, 2])
+        records = self.get('s', struct_as='records')
+        self.assertEqual(records.shape, (1, 2))
+        c = self.get('c')
+        self.assertEqual((c.shape, c[0, 1], c[1, 0]), ((2, 2), 'x', [2.]))
+        self.assertEqual(self.get('t').tolist(), [u'ab', u'cd'])
+        self.assertRaises(TypeError, self.get, 'f')
+        leaves = self.get('c', leaf=lambda path: path, max_depth=1)
+        self.assertEqual(leaves[1, 0], 'c{2}')
+        self.assertRaises(ValueError, self.get, 'c', order='X')
+
+    def testCall(self):
+        """``call`` runs in mlabraw's round-trips, leaving what it can't
+        convert in the workspace."""
+        fakeengine.reset_stats(self.session)
+        output, classes, values = fakeengine.call(
+            self.session, 'max', [numpy.array([20., 10.])], 2,
+            convert=('double',))
+        self.assertEqual(classes, ['double', 'double'])
+        self.assertEqual([v.item() for v in values], [20, 1])
+        stats = fakeengine.stats(self.session)
+        self.assertEqual((stats['puts'], stats['evals'], stats['gets']),
+                         (1, 2, 1))
+        output, classes, values = fakeengine.call(self.session, 'int8', [3.],
+                                                  1, convert=('double',))
+        self.assertEqual((classes, values), (['int8'], [None]))
+        self.eval("r = class(RES0__); clear RES0__")
+        self.assertEqual(self.get('r'), 'int8')
+        self.assertRaises(fakeengine.error, fakeengine.call, self.session,
+                          'error', ['failed'], 0)
+        self.eval("w = who;")
+        self.assertEqual(sorted(self.get('w')), ['MLABRAW_ERROR_', 'r'])
+
+    def testPutGetMany(self):
+        """``put_many`` and ``get_many`` take a fixed number of
+        round-trips."""
+        fakeengine.reset_stats(self.session)
+        fakeengine.put_many(self.session, [('a', 1.), ('b', 'x'), ('c', [2.])])
+        a, b, c = fakeengine.get_many(self.session, ['a', 'b', 'c'])
+        self.assertEqual((a.item(), b, c), (1., 'x', [2.]))
+        stats = fakeengine.stats(self.session)
+        self.assertEqual((stats['puts'], stats['evals'], stats['gets']),
+                         (1, 3, 1))
+        self.assertRaises(fakeengine.error, fakeengine.get_many,
+                          self.session, ['a', 'nonesuch'])
+        self.assertRaises(ValueError, fakeengine.put_many, self.session,
+                          {'a b': 1})
+        self.eval("w = who;")
+        self.assertEqual(sorted(self.get('w')), ['a', 'b', 'c'])
+
+    def testOutputSizeAndLatency(self):
+        """Output beyond the output size is cut; round-trips take the
+        latency."""
+        old = fakeengine.set_output_size(self.session, 10)
+        self.assertEqual(old, fakeengine.DEFAULT_OUTPUT_SIZE)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.assertEqual(self.eval("disp(repmat('a', 1, 20))"),
+                             'a' * 10)
+        self.assertEqual(caught[0].category, RuntimeWarning)
+        self.assertRaises(ValueError, fakeengine.set_output_size,
+                          self.session, 0)
+        fakeengine.set_latency(self.session, 0.01)
+        start = time.time()
+        self.eval("1;")             # an eval and a get
+        assert time.time() - start >= 0.02
+        stats = fakeengine.stats(self.session)
+        assert stats['eval_seconds'] >= 0.01
+
+    def testMlabWrap(self):
+        """``MlabWrap`` works on the fake engine."""
+        mlab = mlabwrap.MlabWrap()
+        try:
+            self.assertEqual(mlab.plus(1., 2.).item(), 3.)
+            self.assertEqual(mlab.size(numpy.zeros((2, 3))).ravel().tolist(),
+                             [2, 3])
+            mlab._set('x', numpy.arange(4.))
+            self.assertEqual(mlab._get('x', remove=True).ravel().tolist(),
+                             [0, 1, 2, 3])
+            p = mlab.int8(numpy.array([1., 2.]))
+            self.assertEqual(p._metadata()['class'], 'int8')
+            self.assertEqual(mlab.double(p).ravel().tolist(), [1, 2])
+            del p
+            report = mlab._workspace_report()
+            self.assertEqual((report['orphans'], report['missing']), ([], []))
+        finally:
+            mlab.close()
+
+
+if __name__ == '__main__':
+    unittest.main()